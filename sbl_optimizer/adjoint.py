@@ -0,0 +1,112 @@
+"""
+Discrete adjoint of the explicit heat simulation.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import math
+import numpy as np
+from .stepping import ExplicitStepper
+
+
+class AdjointStepper(ExplicitStepper):
+    """
+    Explicit stepper that also differentiates a loss on the final field.
+
+    One explicit step maps T_n to
+        D = A T_n                                  (diffusion stencil)
+        T_n+1 = k D + s(H) - r(H) (D + 273.15)^4
+    with k = conv_keep and the H-dependent source s and radiative factor r
+    of set_heat(). The adjoint runs this backwards:
+        dL/dH += lambda_n+1 * dT_n+1/dH
+        lambda_n = A^T ((k - 4 r (D + 273.15)^3) * lambda_n+1)
+    which needs every intermediate T_n. Only every k-th state is kept on
+    the forward pass (k ~ sqrt(nt)); the states in between are recomputed
+    one segment at a time, so memory grows with sqrt(nt) instead of nt.
+    """
+
+    def _diffuse_adjoint(self, v: np.ndarray) -> np.ndarray:
+        """
+        Apply the transpose of the diffusion stencil to v.
+
+        Args:
+            v: Adjoint field on the output of the stencil.
+
+        Returns:
+            New array with A^T v.
+        """
+        out = np.zeros_like(v)
+        w = v[1:-1, 1:-1]
+        np.multiply(w, self.c0, out=out[1:-1, 1:-1])
+        out[1:-1, 2:] += self.cx * w
+        out[1:-1, :-2] += self.cx * w
+        out[2:, 1:-1] += self.cy * w
+        out[:-2, 1:-1] += self.cy * w
+
+        # Edge cells carry over unchanged in the forward step
+        out[0, :] += v[0, :]
+        out[-1, :] += v[-1, :]
+        out[1:-1, 0] += v[1:-1, 0]
+        out[1:-1, -1] += v[1:-1, -1]
+        return out
+
+    def value_and_grad(self, H: np.ndarray, max_heat: float, nt: int, loss):
+        """
+        Simulate H and differentiate a loss on the final field with respect to H.
+
+        Args:
+            H: Heat input array.
+            max_heat: Maximum applied heat per cell.
+            nt: Number of timesteps.
+            loss: Function of the final temperature field returning
+                (loss value, dL/dT).
+
+        Returns:
+            Tuple of (final temperature field (a copy), loss value, dL/dH).
+        """
+        self.set_heat(H, max_heat)
+        self.reset()
+
+        # Forward pass, keeping every seg-th state
+        seg = max(1, math.ceil(math.sqrt(nt)))
+        saved = {}
+        for n in range(nt):
+            if n % seg == 0:
+                saved[n] = self._T.copy()
+            self.step()
+        T_final = self._T.copy()
+        value, lam = loss(T_final)
+
+        cfg = self.config
+        T_amb4 = (cfg.ambient_temperature + 273.15)**4
+        drad_dH = self.rad_scale * 0.22 / max_heat
+        grad = np.zeros_like(H, dtype=self._T.dtype)
+        lam = np.asarray(lam, dtype=self._T.dtype)
+
+        # Backward pass, one segment at a time
+        for start in sorted(saved, reverse=True):
+            stop = min(start + seg, nt)
+            np.copyto(self._T, saved.pop(start))
+            states = [self._T.copy()]
+            for _ in range(start, stop - 1):
+                self.step()
+                states.append(self._T.copy())
+
+            for T_n in reversed(states):
+                np.copyto(self._T, T_n)
+                self._diffuse()
+                a = self._Tn + 273.15
+                a3 = a**3
+
+                # dT_n+1/dH = 1 / hc_paper - dr/dH ((D + 273.15)^4 - T_amb^4)
+                grad += lam * (1 / self.hc_paper - drad_dH * (a3 * a - T_amb4))
+
+                # dT_n+1/dD = k - 4 r (D + 273.15)^3
+                a3 *= -4 * self._rad
+                a3 += self.conv_keep
+                lam = self._diffuse_adjoint(a3 * lam)
+
+        # Leave the stepper holding the final field, as run() does
+        np.copyto(self._T, T_final)
+        return T_final, value, grad
@@ -0,0 +1,406 @@
+"""
+Benchmarks of the optimizer at production-like settings.
+
+Sweeps the grid resolution and the heating time over the bundled sample
+image and synthetic masks, times whole optimization runs and the
+individual kernels, and writes the results as JSON. A previous result
+file can be given as baseline; cases that got slower by more than a
+threshold are reported as regressions.
+
+    python -m sbl_optimizer.benchmark -o results.json
+    python -m sbl_optimizer.benchmark --baseline results.json
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import argparse
+import importlib.resources as resources
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from .cache import package_version
+from .config import Config
+from .heat_solver import (
+    apply_heat_losses, count_outsiders, image_to_heat_pattern, optimize, update_heat_pattern
+)
+from .stepping import make_stepper, num_steps, time_step
+from .utils import ImageContext
+
+
+# Size and resolution of the synthetic images (same sheet as the sample image)
+SYNTHETIC_SIZE = 614
+SYNTHETIC_DPI = 96
+
+# Metrics compared against the baseline; all are "lower is better"
+TIMED_METRICS = ('step_time', 'iteration_time', 'kernel_time', 'peak_mb')
+
+# Settings of --quick, for a smoke test of the harness
+QUICK = {'resolutions': [10000, 30000], 'heating_times': [6.0], 'max_iterations': 20}
+
+
+def synthetic_image(kind: str) -> np.ndarray:
+    """
+    Draw a synthetic design as a grayscale image (black design on white).
+
+    Args:
+        kind: 'disc' (one large filled disc) or 'lines' (vertical bars whose
+            width shrinks from 1/10 of the sheet to a few pixels).
+
+    Returns:
+        uint8 array of SYNTHETIC_SIZE x SYNTHETIC_SIZE pixels.
+    """
+    n = SYNTHETIC_SIZE
+    img = np.full((n, n), 255, dtype=np.uint8)
+    if kind == 'disc':
+        yy, xx = np.mgrid[:n, :n]
+        img[(yy - n / 2)**2 + (xx - n / 2)**2 < (0.3 * n)**2] = 0
+    elif kind == 'lines':
+        x = n // 20
+        width = n // 10
+        while width >= 3 and x + width < n:
+            img[n // 10:n - n // 10, x:x + width] = 0
+            x += 2 * width
+            width = width * 2 // 3
+    else:
+        raise ValueError(f"Unknown synthetic image: {kind!r} (expected 'disc' or 'lines')")
+    return img
+
+
+def load_image(name: str) -> ImageContext:
+    """
+    Load a benchmark image: 'sample' (bundled), 'disc' or 'lines' (synthetic).
+    """
+    if name == 'sample':
+        with resources.as_file(resources.files("sbl_optimizer.assets") / "sample.jpg") as path:
+            return ImageContext(path)
+    return ImageContext(synthetic_image(name), dpi=SYNTHETIC_DPI, name=name)
+
+
+def _best_time(fn, repeat: int) -> float:
+    """
+    Smallest wall-clock time of repeat calls to fn.
+    """
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_run(image: ImageContext, config: Config, repeat: int = 3) -> dict:
+    """
+    Benchmark the whole-run path (image_to_heat_pattern + optimize).
+
+    Args:
+        image: Input image.
+        config: Configuration of the run.
+        repeat: Repetitions of the single-simulation timing.
+
+    Returns:
+        Dictionary with grid size, timesteps, time per timestep, time per
+        iteration, iterations, whether the run converged, peak traced
+        memory in MB and final outlier %.
+    """
+    img_w, img_h, phys_w, phys_h = image.dims
+    mask, H_init, max_heat = image_to_heat_pattern(image, config)
+    dx = phys_w / (mask.shape[0] - 1)
+    dy = phys_h / (mask.shape[1] - 1)
+    dt = time_step(dx, dy, config)
+    nt = num_steps(dt, config)
+
+    # Time per timestep, from whole simulations of the initial pattern
+    hc_paper = config.c_paper * config.density_paper * phys_w * phys_h / mask.size
+    stepper = make_stepper(mask.shape, dx, dy, dt, hc_paper, config)
+    stepper.set_heat(H_init, max_heat)
+    step_time = _best_time(lambda: stepper.run(nt), repeat) / max(nt, 1)
+    del stepper
+
+    start = time.perf_counter()
+    _, _, errors = optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, config)
+    elapsed = time.perf_counter() - start
+
+    # Peak memory of a short run, traced separately so it does not slow the timed run
+    tracemalloc.start()
+    try:
+        short = replace(config, max_iterations=min(2, config.max_iterations))
+        image_to_heat_pattern(image, short)
+        optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, short)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'cells': int(mask.size),
+        'grid': list(mask.shape),
+        'steps': nt,
+        'step_time': step_time,
+        'iteration_time': elapsed / len(errors),
+        'iterations': len(errors),
+        'converged': len(errors) < config.max_iterations,
+        'peak_mb': peak / 2**20,
+        'outlier_pct': errors[-1] * 100 / mask.size,
+    }
+
+
+def bench_kernels(image: ImageContext, config: Config, repeat: int = 5) -> dict:
+    """
+    Benchmark the individual kernels on a realistic temperature field.
+
+    The field is the result of one simulation of the initial pattern, so
+    update_heat_pattern and count_outsiders see the usual mix of cold, hot
+    and spilling cells.
+
+    Args:
+        image: Input image.
+        config: Configuration of the run.
+        repeat: Calls per kernel; the fastest one is reported.
+
+    Returns:
+        Dictionary mapping kernel names to seconds per call.
+    """
+    _, _, phys_w, phys_h = image.dims
+    mask, H_init, max_heat = image_to_heat_pattern(image, config)
+    dx = phys_w / (mask.shape[0] - 1)
+    dy = phys_h / (mask.shape[1] - 1)
+    dt = time_step(dx, dy, config)
+    hc_paper = config.c_paper * config.density_paper * phys_w * phys_h / mask.size
+    stepper = make_stepper(mask.shape, dx, dy, dt, hc_paper, config)
+    stepper.set_heat(H_init, max_heat)
+    T = stepper.run(num_steps(dt, config)).copy()
+
+    Q_rad = np.empty_like(T)
+    Q_conv = np.empty_like(T)
+    H = H_init.copy()
+
+    def update():
+        np.copyto(H, H_init)
+        update_heat_pattern(T, H, mask, config.swell_temperature, config.buffer, max_heat)
+
+    return {
+        'update_heat_pattern': _best_time(update, repeat),
+        'count_outsiders': _best_time(lambda: count_outsiders(T, mask, config), repeat),
+        'apply_heat_losses': _best_time(
+            lambda: apply_heat_losses(Q_rad, Q_conv, T, H_init, max_heat, dx, dy, dt, config),
+            repeat),
+    }
+
+
+def run_benchmarks(config: Config, images, resolutions, heating_times, repeat: int = 3,
+                   kernels: bool = True, log=None) -> dict:
+    """
+    Run the benchmark sweep.
+
+    Args:
+        config: Base configuration; resolution and heating_time are swept.
+        images: Image names (see load_image()).
+        resolutions: Grid resolutions in cells.
+        heating_times: Heating times in seconds.
+        repeat: Repetitions of the timings that are taken as best-of.
+        kernels: Also run the kernel micro-benchmarks (once per resolution).
+        log: Called with a line of progress text per finished case.
+
+    Returns:
+        Dictionary with 'environment' metadata and a list of 'results'.
+    """
+    results = []
+    for name in images:
+        image = load_image(name)
+        for resolution in resolutions:
+            for heating_time in heating_times:
+                cfg = replace(config, resolution=resolution, heating_time=heating_time)
+                record = {'kind': 'run', 'image': name, 'resolution': resolution,
+                          'heating_time': heating_time}
+                record.update(bench_run(image, cfg, repeat))
+                results.append(record)
+                if log:
+                    log(f"run     {name:<7} {resolution:>8} cells  {heating_time:>5g}s  "
+                        f"{record['step_time'] * 1e3:8.3f} ms/step  "
+                        f"{record['iteration_time']:7.3f} s/it  {record['iterations']:4d} it  "
+                        f"{record['peak_mb']:7.1f} MB  {record['outlier_pct']:5.2f}%")
+            if kernels:
+                cfg = replace(config, resolution=resolution)
+                for kernel, seconds in bench_kernels(image, cfg, max(repeat, 5)).items():
+                    results.append({'kind': 'kernel', 'image': name, 'resolution': resolution,
+                                    'kernel': kernel, 'kernel_time': seconds})
+                    if log:
+                        log(f"kernel  {name:<7} {resolution:>8} cells  {kernel:<20} "
+                            f"{seconds * 1e3:8.3f} ms")
+
+    return {
+        'environment': {
+            'sbl_optimizer': package_version(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'config': {k: v for k, v in vars(config).items() if k not in ('resolution', 'heating_time')},
+        'results': results,
+    }
+
+
+def _case_key(record: dict):
+    """
+    Identify a benchmark case independently of its measurements.
+    """
+    return (record['kind'], record['image'], record['resolution'],
+            record.get('heating_time'), record.get('kernel'))
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2):
+    """
+    Find cases that got slower (or use more memory) than in the baseline.
+
+    Args:
+        results: Output of run_benchmarks().
+        baseline: Earlier output of run_benchmarks().
+        threshold: Allowed relative increase, e.g. 0.2 for 20%.
+
+    Returns:
+        List of dictionaries (case, metric, baseline, current, ratio), one per
+        metric beyond the threshold. Cases missing from the baseline are
+        ignored.
+    """
+    reference = {_case_key(r): r for r in baseline.get('results', [])}
+    regressions = []
+    for record in results['results']:
+        base = reference.get(_case_key(record))
+        if base is None:
+            continue
+        for metric in TIMED_METRICS:
+            if metric not in record or not base.get(metric):
+                continue
+            ratio = record[metric] / base[metric]
+            if ratio > 1 + threshold:
+                regressions.append({
+                    'case': [v for v in _case_key(record) if v is not None],
+                    'metric': metric,
+                    'baseline': base[metric],
+                    'current': record[metric],
+                    'ratio': ratio,
+                })
+    return regressions
+
+
+def parse_args(argv=None):
+    """
+    Parse command-line arguments of the benchmark.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark sbl-optimizer")
+    parser.add_argument(
+        '-c', '--config',
+        default=None,
+        help='Path to JSON config (default: bundled config.json)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default='benchmark.json',
+        help='Result file (default: benchmark.json)'
+    )
+    parser.add_argument(
+        '--images',
+        nargs='+',
+        default=['sample', 'disc', 'lines'],
+        choices=['sample', 'disc', 'lines'],
+        help='Benchmark images (default: sample disc lines)'
+    )
+    parser.add_argument(
+        '--resolutions',
+        nargs='+',
+        type=int,
+        default=[10000, 30000, 120000, 500000],
+        help='Grid resolutions in cells (default: 10000 30000 120000 500000)'
+    )
+    parser.add_argument(
+        '--heating-times',
+        nargs='+',
+        type=float,
+        default=[3.0, 6.0],
+        help='Heating times in seconds (default: 3 6)'
+    )
+    parser.add_argument(
+        '--max-iterations',
+        type=int,
+        default=100,
+        help='Iteration cap of each run (default: 100)'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Repetitions of each timing; the fastest is kept (default: 3)'
+    )
+    parser.add_argument(
+        '--no-kernels',
+        action='store_true',
+        help='Skip the kernel micro-benchmarks'
+    )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='Small sweep for a quick check of the harness'
+    )
+    parser.add_argument(
+        '--baseline',
+        default=None,
+        help='Earlier result file to compare against'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.2,
+        help='Relative slowdown reported as a regression (default: 0.2)'
+    )
+    args = parser.parse_args(argv)
+    if args.quick:
+        for key, value in QUICK.items():
+            setattr(args, key, value)
+    return args
+
+
+def main(argv=None):
+    """
+    Run the benchmarks, save the results and compare them to a baseline.
+
+    Exits with status 1 if any regression beyond the threshold was found.
+    """
+    args = parse_args(argv)
+    if args.config:
+        config = Config.from_file(Path(args.config))
+    else:
+        with resources.as_file(resources.files("sbl_optimizer.assets") / "config.json") as path:
+            config = Config.from_file(path)
+    config = replace(config, verbose=0, max_iterations=args.max_iterations)
+
+    results = run_benchmarks(config, args.images, args.resolutions, args.heating_times,
+                             repeat=args.repeat, kernels=not args.no_kernels, log=print)
+    output = Path(args.output)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Saved: {output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {'/'.join(map(str, r['case']))} {r['metric']}: "
+                  f"{r['baseline']:.4g} -> {r['current']:.4g} ({(r['ratio'] - 1) * 100:+.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold * 100:.0f}% against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+Runtime cost model and wall-clock budgets.
+
+The run time of an optimization is dominated by the simulation, which costs
+about nt * cells per iteration; with the explicit stability limit nt itself
+grows with the number of cells, so doubling the resolution roughly
+quadruples the run time. The cost model is fitted by a short
+micro-benchmark on this machine and cached, and config.time_budget uses it
+to pick the highest resolution that fits.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import json
+import logging
+import math
+import os
+import platform
+import tempfile
+import time
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+
+import numpy as np
+
+from .adjoint import AdjointStepper
+from .cache import default_cache_dir, package_version
+from .config import Config
+from .heat_solver import count_outsiders, mask_to_heat_pattern, outsider_loss, update_heat_pattern
+from .stepping import make_stepper, num_steps, time_step
+from .utils import ImageContext
+
+
+logger = logging.getLogger(__name__)
+
+# Grid sides of the calibration runs (square grids)
+CALIBRATION_SIDES = (128, 256, 512)
+
+# Timesteps of each calibration simulation
+CALIBRATION_STEPS = 8
+
+# Repetitions of each calibration timing; the fastest one is kept
+CALIBRATION_REPEAT = 3
+
+# Sheet size of the calibration runs in meters (only sets dt and max_heat)
+CALIBRATION_SHEET = 0.16
+
+# Smallest resolution a time budget selects, even if it does not fit
+MIN_RESOLUTION = 2500
+
+# File of the cached cost models in default_cache_dir()
+COST_MODEL_FILE = 'cost_model.json'
+
+
+@dataclass
+class CostModel:
+    """
+    Predicted wall-clock time of optimization runs on one machine.
+
+    One iteration costs nt * (step_per_cell * cells + step_fixed) for the
+    simulation plus update_per_cell * cells + update_fixed for the heat
+    pattern update and the error metrics.
+    """
+    # Seconds per timestep and cell, and fixed seconds per timestep
+    step_per_cell: float
+    step_fixed: float
+    # Seconds per heat pattern update and cell, and fixed seconds per update
+    update_per_cell: float
+    update_fixed: float
+
+    def iteration_time(self, cells: int, nt: int, updates: int = 1) -> float:
+        """
+        Seconds of one iteration with nt timesteps and `updates` heat pattern updates.
+        """
+        return (nt * (self.step_per_cell * cells + self.step_fixed)
+                + updates * (self.update_per_cell * cells + self.update_fixed))
+
+    def run_time(self, cells: int, nt: int, iterations: int, updates: int = 1) -> float:
+        """
+        Seconds of `iterations` iterations.
+        """
+        return iterations * self.iteration_time(cells, nt, updates)
+
+
+def _best_time(fn) -> float:
+    """
+    Smallest wall-clock time of CALIBRATION_REPEAT calls to fn.
+    """
+    best = math.inf
+    for _ in range(CALIBRATION_REPEAT):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _fit_line(cells, seconds):
+    """
+    Least-squares fit of seconds = slope * cells + intercept, both >= 0.
+    """
+    A = np.column_stack([cells, np.ones(len(cells))])
+    slope, intercept = np.linalg.lstsq(A, np.asarray(seconds), rcond=None)[0]
+    if intercept < 0:
+        slope, intercept = np.dot(cells, seconds) / np.dot(cells, cells), 0.0
+    return max(float(slope), 0.0), float(intercept)
+
+
+def calibrate(config: Config) -> CostModel:
+    """
+    Fit a CostModel with a micro-benchmark (about a second).
+
+    Times a few timesteps of the solver and optimizer selected by config
+    (solver, dtype, threads; forward and adjoint pass for the adjoint
+    optimizer) and one heat pattern update on square grids of
+    CALIBRATION_SIDES cells.
+
+    Args:
+        config: Configuration whose solver settings are measured.
+
+    Returns:
+        The fitted model.
+    """
+    cells, step_times, update_times = [], [], []
+    for side in CALIBRATION_SIDES:
+        shape = (side, side)
+        d = CALIBRATION_SHEET / (side - 1)
+        dt = time_step(d, d, config)
+        hc_paper = config.c_paper * config.density_paper * CALIBRATION_SHEET**2 / (side * side)
+
+        # A disc design, and a temperature ramp that hits every branch of the update
+        yy, xx = np.mgrid[:side, :side]
+        mask = (yy - side / 2)**2 + (xx - side / 2)**2 < (0.3 * side)**2
+        H, max_heat = mask_to_heat_pattern(mask, CALIBRATION_SHEET, CALIBRATION_SHEET, config)
+        hottest = config.swell_temperature + 2 * config.buffer
+        T = np.linspace(config.ambient_temperature, hottest, H.size).reshape(shape).astype(H.dtype)
+
+        if config.optimizer == "adjoint":
+            stepper = AdjointStepper(shape, d, d, dt, hc_paper, config)
+
+            def simulate():
+                stepper.value_and_grad(H, max_heat, CALIBRATION_STEPS,
+                                       lambda T_final: outsider_loss(T_final, mask, config))
+        else:
+            stepper = make_stepper(shape, d, d, dt, hc_paper, config)
+
+            def simulate():
+                stepper.set_heat(H, max_heat)
+                stepper.run(CALIBRATION_STEPS)
+
+        def update():
+            update_heat_pattern(T, H.copy(), mask, config.swell_temperature, config.buffer,
+                                max_heat)
+            count_outsiders(T, mask, config)
+
+        simulate()
+        cells.append(side * side)
+        step_times.append(_best_time(simulate) / CALIBRATION_STEPS)
+        update_times.append(_best_time(update))
+        if hasattr(stepper, 'close'):
+            stepper.close()
+
+    step_per_cell, step_fixed = _fit_line(cells, step_times)
+    update_per_cell, update_fixed = _fit_line(cells, update_times)
+    return CostModel(step_per_cell, step_fixed, update_per_cell, update_fixed)
+
+
+def machine_key(config: Config) -> str:
+    """
+    Identify the machine, the software versions and the solver settings a
+    cost model was measured with.
+    """
+    return '|'.join(str(v) for v in (
+        platform.machine(), platform.processor(), os.cpu_count(),
+        platform.python_version(), np.__version__, package_version(),
+        config.solver, config.dtype, config.threads, config.optimizer,
+    ))
+
+
+def load_cost_model(config: Config, path: Path = None) -> CostModel:
+    """
+    Cost model of this machine, calibrated on first use and then cached.
+
+    Args:
+        config: Configuration whose solver settings are modeled.
+        path: JSON file of the cached models (default: COST_MODEL_FILE in
+            default_cache_dir()). Delete it to recalibrate.
+
+    Returns:
+        The cached or newly fitted model.
+    """
+    path = Path(path) if path else default_cache_dir() / COST_MODEL_FILE
+    key = machine_key(config)
+    try:
+        with open(path, 'r') as f:
+            models = json.load(f)
+    except (OSError, ValueError):
+        models = {}
+    if key in models:
+        try:
+            return CostModel(**models[key])
+        except TypeError:
+            pass
+
+    start = time.perf_counter()
+    model = calibrate(config)
+    logger.info("Calibrated the cost model in %.1f s", time.perf_counter() - start)
+    models[key] = asdict(model)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(models, f, indent=2)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+    except OSError as e:
+        logger.warning("Could not save the cost model to %s: %s", path, e)
+    return model
+
+
+def grid_steps(image: ImageContext, config: Config):
+    """
+    Number of cells and timesteps of a simulation of image at config.resolution.
+    """
+    rows, cols = image.grid_shape(config.resolution)
+    rows, cols = max(rows, 2), max(cols, 2)
+    _, _, phys_w, phys_h = image.dims
+    dt = time_step(phys_w / (rows - 1), phys_h / (cols - 1), config)
+    return rows * cols, num_steps(dt, config)
+
+
+def predict_run_time(model: CostModel, image, config: Config) -> float:
+    """
+    Predict the seconds of optimizing image with config.
+
+    Assumes every level runs its full iteration budget (config.max_iterations
+    at full resolution), so runs that converge earlier take less. Active
+    regions and incremental re-simulation are not modeled and only make a
+    run faster than predicted.
+
+    Args:
+        model: Cost model of this machine.
+        image: Path to the image or an ImageContext.
+        config: Configuration of the run.
+
+    Returns:
+        Predicted wall-clock time in seconds.
+    """
+    image = ImageContext.of(image)
+    updates = config.surrogate_every if config.optimizer == "heuristic" else 1
+    schedule = list(zip(config.multigrid_levels, config.multigrid_iterations))
+    schedule.append((config.resolution, config.max_iterations))
+    total = 0.0
+    for resolution, iterations in schedule:
+        cells, nt = grid_steps(image, replace(config, resolution=resolution))
+        total += model.run_time(cells, nt, iterations, updates)
+    return total
+
+
+def budget_config(image, config: Config, model: CostModel = None):
+    """
+    Pick the highest resolution whose predicted run time fits config.time_budget.
+
+    Resolutions range from MIN_RESOLUTION to the pixel count of the image.
+    Multigrid levels at or above the chosen resolution are dropped.
+
+    Args:
+        image: Path to the image or an ImageContext.
+        config: Configuration with time_budget > 0.
+        model: Cost model (default: load_cost_model(config)).
+
+    Returns:
+        Tuple of (configuration with the chosen resolution, predicted seconds).
+    """
+    image = ImageContext.of(image)
+    model = model or load_cost_model(config)
+
+    def at(resolution):
+        levels = [(r, it) for r, it in zip(config.multigrid_levels, config.multigrid_iterations)
+                  if r < resolution]
+        return replace(config, resolution=resolution,
+                       multigrid_levels=tuple(r for r, _ in levels),
+                       multigrid_iterations=tuple(it for _, it in levels))
+
+    # Binary search; the run time grows with the resolution
+    img_w, img_h = image.size
+    lo, hi = MIN_RESOLUTION, max(img_w * img_h, MIN_RESOLUTION)
+    if predict_run_time(model, image, at(hi)) <= config.time_budget:
+        lo = hi
+    while hi - lo > max(lo // 100, 1):
+        mid = (lo + hi) // 2
+        if predict_run_time(model, image, at(mid)) <= config.time_budget:
+            lo = mid
+        else:
+            hi = mid
+
+    cfg = at(lo)
+    predicted = predict_run_time(model, image, cfg)
+    if predicted > config.time_budget:
+        logger.warning("Even resolution %d is predicted to take %.0f s; the run will stop "
+                       "at the time budget of %g s", lo, predicted, config.time_budget)
+    return cfg, predicted
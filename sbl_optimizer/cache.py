@@ -0,0 +1,171 @@
+"""
+On-disk cache of optimization results keyed on image content and configuration.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from dataclasses import asdict
+from importlib import metadata
+from pathlib import Path
+
+import numpy as np
+from .config import Config
+from .utils import ImageContext
+
+
+logger = logging.getLogger(__name__)
+
+# Arrays and scalars stored for each cached result
+CACHE_FIELDS = ('H_best', 'T_best', 'mask', 'max_heat', 'errors')
+
+# Config fields that do not change the result and are left out of the key
+NON_SEMANTIC_FIELDS = ('verbose', 'threads')
+
+
+def package_version() -> str:
+    """
+    Installed version of sbl-optimizer ("unknown" when running from source).
+    """
+    try:
+        return metadata.version("sbl-optimizer")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def default_cache_dir() -> Path:
+    """
+    Cache directory from $SBL_OPTIMIZER_CACHE_DIR, else ~/.cache/sbl-optimizer.
+    """
+    env = os.environ.get("SBL_OPTIMIZER_CACHE_DIR")
+    if env:
+        return Path(env)
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "sbl-optimizer"
+
+
+def cache_key(image, config: Config, warm_start: Path = None) -> str:
+    """
+    Hash the decoded image pixels, its DPI, the Config fields that affect
+    the result (all but NON_SEMANTIC_FIELDS) and the package version.
+
+    Args:
+        image: Path to the input image or an ImageContext.
+        config: Configuration parameters.
+        warm_start: Heat pattern the run starts from, if any.
+
+    Returns:
+        Hex digest identifying the optimization result.
+    """
+    image = ImageContext.of(image)
+    img = image.image
+    digest = hashlib.sha256()
+    digest.update(f"{img.mode}:{img.width}x{img.height}:{image.dpi}".encode())
+    digest.update(np.ascontiguousarray(np.asarray(img)).tobytes())
+    fields = {k: v for k, v in asdict(config).items() if k not in NON_SEMANTIC_FIELDS}
+    digest.update(json.dumps(fields, sort_keys=True, default=str).encode())
+    digest.update(package_version().encode())
+    if warm_start:
+        digest.update(Path(warm_start).read_bytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of optimization results stored as compressed .npz.
+
+    Entries are written atomically. A hit refreshes the entry's modification
+    time, and the least recently used entries are evicted once the directory
+    exceeds max_bytes.
+    """
+
+    def __init__(self, directory: Path = None, max_bytes: int = 1 << 30):
+        """
+        Args:
+            directory: Cache directory (default: default_cache_dir()).
+            max_bytes: Size limit of all entries in bytes.
+        """
+        self.directory = Path(directory) if directory else default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.npz"
+
+    def get(self, key: str):
+        """
+        Look up a result.
+
+        Args:
+            key: Key from cache_key().
+
+        Returns:
+            Dictionary with the CACHE_FIELDS entries, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                result = {name: data[name] for name in CACHE_FIELDS}
+        except (OSError, KeyError, ValueError):
+            return None
+        result['max_heat'] = float(result['max_heat'])
+        result['errors'] = result['errors'].tolist()
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        logger.info("Cache hit: %s", path)
+        return result
+
+    def put(self, key: str, H_best, T_best, mask, max_heat, errors):
+        """
+        Store a result and evict old entries if the cache is over its limit.
+
+        Args:
+            key: Key from cache_key().
+            H_best: Optimized heat pattern.
+            T_best: Best temperature field.
+            mask: Binary mask indicating swelling region.
+            max_heat: Maximum heat value.
+            errors: List of error counts per iteration.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(
+                    f, H_best=H_best, T_best=T_best, mask=mask,
+                    max_heat=max_heat, errors=np.asarray(errors, dtype=int)
+                )
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits max_bytes.
+        """
+        entries = []
+        for path in self.directory.glob("*.npz"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+                logger.info("Cache evicted: %s", path)
+            except OSError:
+                pass
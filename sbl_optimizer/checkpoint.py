@@ -0,0 +1,188 @@
+"""
+Checkpointing of long optimization runs.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import json
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+
+import numpy as np
+
+from .config import Config
+
+
+logger = logging.getLogger(__name__)
+
+# Config fields that may differ between the interrupted and the resumed run
+RESUMABLE_FIELDS = ('max_iterations', 'verbose')
+
+# Config fields chosen by config.time_budget; a budgeted run resumes with the saved ones
+BUDGET_FIELDS = ('resolution', 'multigrid_levels', 'multigrid_iterations')
+
+
+class OptimizationInterrupted(RuntimeError):
+    """
+    Raised by optimize() after it saved a final checkpoint on SIGTERM/SIGINT.
+    """
+
+    def __init__(self, path: Path, iteration: int):
+        super().__init__(f"Interrupted after iteration {iteration}; checkpoint saved to {path}")
+        self.path = path
+        self.iteration = iteration
+
+
+class Checkpointer:
+    """
+    Periodically saves the optimizer state to an .npz file.
+
+    The file is written to a temporary name and renamed into place, so an
+    existing checkpoint is never left half-written. While signal handlers are
+    installed (see handle_signals()), the first SIGTERM/SIGINT only sets
+    stop_requested; optimize() then saves a final checkpoint after the
+    current iteration and raises OptimizationInterrupted. A second signal
+    interrupts immediately.
+    """
+
+    def __init__(self, path: Path, every_iterations: int = 0, every_seconds: float = 0.0):
+        """
+        Args:
+            path: Checkpoint file (.npz).
+            every_iterations: Save every this many iterations (0: off).
+            every_seconds: Save when this much wall-clock time has passed
+                since the last save (0: off).
+        """
+        self.path = Path(path)
+        self.every_iterations = every_iterations
+        self.every_seconds = every_seconds
+        self.stop_requested = False
+        self._last_save = time.monotonic()
+
+    def due(self, iteration: int) -> bool:
+        """
+        Check whether a checkpoint should be written after this iteration.
+
+        Args:
+            iteration: Number of completed iterations.
+        """
+        if self.stop_requested:
+            return True
+        if self.every_iterations and iteration % self.every_iterations == 0:
+            return True
+        if self.every_seconds and time.monotonic() - self._last_save >= self.every_seconds:
+            return True
+        return False
+
+    def save(self, iteration: int, H, T, T_best, errors, config: Config, metrics: list = None,
+             optimizer: dict = None, level: int = None):
+        """
+        Atomically write the optimizer state.
+
+        Args:
+            iteration: Number of completed iterations.
+            H: Heat input field used in the last iteration.
+            T: Temperature field of the last iteration.
+            T_best: Best temperature field so far.
+            errors: List of error counts per iteration.
+            config: Configuration of the run.
+            metrics: Per-iteration outsider_metrics(), if collected.
+            optimizer: Further arrays of the optimizer state by name,
+                returned by load_checkpoint() as state['optimizer'].
+            level: Index of the multigrid level the state belongs to (None:
+                the full resolution).
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f, iteration=iteration, H=H, T=T, T_best=T_best,
+                    errors=np.asarray(errors, dtype=int),
+                    config=json.dumps(asdict(config), sort_keys=True, default=str),
+                    metrics=json.dumps(metrics or []),
+                    level=-1 if level is None else level,
+                    **{f"optimizer_{k}": v for k, v in (optimizer or {}).items()}
+                )
+            os.replace(tmp, self.path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        self._last_save = time.monotonic()
+        logger.info(f"Checkpoint saved at iteration {iteration}: {self.path}")
+
+    def _on_signal(self, signum, frame):
+        if self.stop_requested:
+            raise KeyboardInterrupt
+        self.stop_requested = True
+        logger.warning(f"Received {signal.Signals(signum).name}; stopping after the current iteration")
+
+    @contextmanager
+    def handle_signals(self):
+        """
+        Route SIGTERM/SIGINT to a graceful stop while inside the context.
+
+        Does nothing outside the main thread, where handlers cannot be set.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        previous = {sig: signal.signal(sig, self._on_signal)
+                    for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            yield
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+
+def load_checkpoint(path: Path, config: Config, shape=None):
+    """
+    Load optimizer state written by Checkpointer.save().
+
+    Args:
+        path: Checkpoint file.
+        config: Configuration of the resumed run; must match the checkpoint
+            except for RESUMABLE_FIELDS, and with a time budget also
+            BUDGET_FIELDS.
+        shape: Expected grid shape at full resolution, if known.
+
+    Returns:
+        Dictionary with iteration, H, T, T_best, errors, metrics, optimizer,
+        the multigrid level (None: full resolution) and the BUDGET_FIELDS
+        the checkpoint was written with (as 'budget').
+    """
+    with np.load(path) as data:
+        state = {
+            'iteration': int(data['iteration']),
+            'H': data['H'],
+            'T': data['T'],
+            'T_best': data['T_best'],
+            'errors': data['errors'].tolist(),
+            'metrics': json.loads(str(data['metrics'])) if 'metrics' in data else [],
+            'optimizer': {k[len('optimizer_'):]: data[k] for k in data.files
+                          if k.startswith('optimizer_')},
+            'level': int(data['level']) if 'level' in data else -1,
+        }
+        saved = json.loads(str(data['config']))
+    if state['level'] < 0:
+        state['level'] = None
+    state['budget'] = {k: saved.get(k, getattr(config, k)) for k in BUDGET_FIELDS}
+
+    current = json.loads(json.dumps(asdict(config), sort_keys=True, default=str))
+    ignored = RESUMABLE_FIELDS + (BUDGET_FIELDS if config.time_budget > 0 else ())
+    changed = sorted(k for k in set(saved) | set(current)
+                     if k not in ignored and saved.get(k) != current.get(k))
+    if changed:
+        raise ValueError(f"Checkpoint {path} was written with a different config ({', '.join(changed)})")
+    if shape is not None and state['level'] is None and tuple(state['H'].shape) != tuple(shape):
+        raise ValueError(f"Checkpoint {path} has grid {state['H'].shape}, expected {tuple(shape)}")
+    return state
@@ -62,6 +62,49 @@ class Config:
     # Number of cells the paper is divided into in thermal simulations
     resolution: int = 120000         # px²
 
+    # Time integration scheme: "explicit" (FTCS reference) or "adi" (implicit)
+    solver: str = "explicit"
+
+    # Simulation timestep in seconds; 0 uses the explicit stability limit
+    time_step: float = 0.0           # s
+
+    # Coarse resolutions optimized before the full resolution (coarse to fine)
+    multigrid_levels: tuple = ()     # px²
+
+    # Iteration budget for each coarse level; the full resolution uses max_iterations
+    multigrid_iterations: tuple = ()
+
+    # Simulate only the padded bounding boxes of the design instead of the whole sheet
+    active_region: bool = False
+
+    # Padding around the active regions, in thermal diffusion lengths sqrt(alpha * heating_time)
+    active_margin: float = 3.0
+
+    # Floating-point precision of the simulation: "float64" or "float32" (half the memory)
+    dtype: str = "float64"
+
+    # Threads of the explicit solver, each stepping one band of rows; 0 uses all cores
+    threads: int = 1
+
+    # Heat pattern update rule: "heuristic" (fixed steps) or "adjoint" (gradient-based)
+    optimizer: str = "heuristic"
+
+    # Step size of the adjoint optimizer as a fraction of the maximum heat per cell
+    learning_rate: float = 0.05
+
+    # Heat pattern updates per exact simulation; all but one are checked
+    # against the FFT surrogate instead (1 disables the surrogate)
+    surrogate_every: int = 1
+
+    # Only re-simulate windows around the cells where the heat pattern
+    # changed, with a full simulation every verify_every iterations
+    incremental: bool = False
+    verify_every: int = 10
+
+    # Wall-clock budget of the optimization in seconds: the resolution is
+    # chosen to fit it and the run stops at it (0 disables the budget)
+    time_budget: float = 0.0         # s
+
     @staticmethod
     def from_file(path: Path) -> "Config":
         """
@@ -77,5 +120,20 @@ class Config:
             light_diameter=data.get('light_diameter', 0.06),
             alpha=data.get('alpha', 1e-7),
             verbose=data.get('verbose', 1),
-            resolution=data.get('resolution', 120000)
+            resolution=data.get('resolution', 120000),
+            solver=data.get('solver', "explicit"),
+            time_step=data.get('time_step', 0.0),
+            multigrid_levels=tuple(data.get('multigrid_levels', ())),
+            multigrid_iterations=tuple(data.get('multigrid_iterations', ())),
+            max_iterations=data.get('max_iterations', 300),
+            active_region=bool(data.get('active_region', False)),
+            active_margin=data.get('active_margin', 3.0),
+            dtype=data.get('dtype', "float64"),
+            threads=data.get('threads', 1),
+            optimizer=data.get('optimizer', "heuristic"),
+            learning_rate=data.get('learning_rate', 0.05),
+            surrogate_every=data.get('surrogate_every', 1),
+            incremental=bool(data.get('incremental', False)),
+            verify_every=data.get('verify_every', 10),
+            time_budget=data.get('time_budget', 0.0)
         )
@@ -7,10 +7,21 @@ Date: 2025-07-29
 
 import math
 import logging
+import time
+from dataclasses import dataclass, replace
+from functools import lru_cache
 import numpy as np
 from PIL import Image
-from .utils import compute_dims
+from .utils import ImageContext, dilate, resize_field
+from .adjoint import AdjointStepper
+from .checkpoint import Checkpointer, OptimizationInterrupted
 from .config import Config
+from .surrogate import SurrogateModel
+from .telemetry import Profiler, stage
+from .stepping import (
+    DeltaStepper, EnsembleStepper, RegionStepper, active_regions, diffusion_length, explicit_time_step,
+    float_dtype, make_stepper, num_steps, time_step
+)
 
 
 logger = logging.getLogger(__name__)
@@ -30,42 +41,51 @@ def configure_logger(verbose: bool):
         logger.setLevel(logging.WARNING)
 
 
-def image_to_heat_pattern(image_path, config: Config):
+def image_to_heat_pattern(image, config: Config):
     """
     Convert an input image into a binary mask and an initial heatmap.
 
     Args:
-        image_path: Path to the image.
+        image: Path to the image or an ImageContext.
         config: Config object containing simulation parameters.
 
     Returns:
         Tuple containing:
             - mask: Binary array indicating active heating region.
-            - H_init: Initial heatmap based on mask.
+            - H_init: Initial heatmap based on mask, in config.dtype.
             - max_heat: Maximum heat that can be applied per cell.
     """
-    img = Image.open(image_path)
+    image = ImageContext.of(image)
 
-    # Rescale image to match the resolution of thermal simulations
-    scale = math.sqrt(config.resolution / (img.width * img.height))
-    img_rs = img.resize(
-        (int(img.width * scale), int(img.height * scale)),
-        resample=Image.Resampling.LANCZOS
-    )
-
-    # Convert to grayscale and threshold
-    gray = img_rs.convert('L')
-    arr = 255 - np.array(gray)
+    # Rescale image to match the resolution of thermal simulations,
+    # convert to grayscale and threshold
+    arr = 255 - image.gray(config.resolution)
     mask = (arr < config.upper_threshold) & (arr >= config.lower_threshold)
 
-    # Compute physical dimensions and grid spacing
-    _, _, phys_w, phys_h = compute_dims(img)
+    _, _, phys_w, phys_h = image.dims
+    H_init, max_heat = mask_to_heat_pattern(mask, phys_w, phys_h, config)
+    return mask, H_init, max_heat
+
+
+def mask_to_heat_pattern(mask, phys_w: float, phys_h: float, config: Config):
+    """
+    Compute the initial heatmap and the maximum heat of a binary mask.
+
+    Args:
+        mask: Binary array indicating active heating region.
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Config object containing simulation parameters.
+
+    Returns:
+        Tuple of (H_init in config.dtype, max_heat).
+    """
+    # Compute grid spacing
     nx, ny = mask.shape
     dx = phys_w / (nx - 1)
     dy = phys_h / (ny - 1)
 
     # Compute timestep
-    dt = 0.49 * dx**2 * dy**2 / ((dx**2 + dy**2) * config.alpha)
+    dt = time_step(dx, dy, config)
 
     # Estimate maximum heat per cell
     area_cell = phys_w * phys_h / (nx * ny)
@@ -74,7 +94,7 @@ def image_to_heat_pattern(image_path, config: Config):
     max_heat = (actual_light_power / total_area) * area_cell * dt * config.absorb_paper
     default_heat = max_heat / 2
 
-    return mask, mask.astype(float) * default_heat, max_heat
+    return mask.astype(float_dtype(config)) * default_heat, max_heat
 
 
 def apply_heat_losses(Q_rad: np.ndarray,
@@ -136,12 +156,106 @@ def add_heat(T: np.ndarray, H: np.ndarray, Q_rad: np.ndarray,
     T += (H - (Q_rad + Q_conv) * 2) / hc_paper
 
 
+@lru_cache(maxsize=None)
+def _falloff_kernel(radius: float, reach: float) -> np.ndarray:
+    """
+    Build the logarithmic falloff kernel used by update_heat_pattern.
+
+    Args:
+        radius: Neighbours with 0 < distance < radius receive a decrement.
+        reach: Distance at which the falloff log(reach / distance) reaches zero.
+
+    Returns:
+        Square array centred on the source cell holding log(reach / distance).
+    """
+    r = math.ceil(radius)
+    di, dj = np.mgrid[-r:r + 1, -r:r + 1]
+    dist_sq = di * di + dj * dj
+    inside = (dist_sq > 0) & (dist_sq < radius * radius)
+    kernel = np.zeros(dist_sq.shape)
+    kernel[inside] = np.log(reach / np.sqrt(dist_sq[inside]))
+    kernel.setflags(write=False)
+    return kernel
+
+
+def _scatter_kernel(out: np.ndarray, sources: np.ndarray, kernel: np.ndarray):
+    """
+    Add kernel-weighted copies of a source field to out (a 2D correlation).
+
+    Args:
+        out: Accumulator array (updated in-place).
+        sources: Per-cell source weights, same shape as out.
+        kernel: Odd-sized square kernel; kernel[r + di, r + dj] is the weight
+            a source at (i, j) contributes to (i + di, j + dj).
+    """
+    nx, ny = sources.shape
+    r = kernel.shape[0] // 2
+    for di, dj in zip(*np.nonzero(kernel)):
+        w = kernel[di, dj]
+        di -= r
+        dj -= r
+        if abs(di) >= nx or abs(dj) >= ny:
+            continue
+        out[max(di, 0):nx + min(di, 0), max(dj, 0):ny + min(dj, 0)] += (
+            w * sources[max(-di, 0):nx - max(di, 0), max(-dj, 0):ny - max(dj, 0)]
+        )
+
+
 def update_heat_pattern(T: np.ndarray, H: np.ndarray, mask: np.ndarray,
                         swell_temperature: float, buffer: float,
                         max_heat_rate: float):
     """
     Adjust heat pattern based on local temperature and region mask.
 
+    Cells are classified with boolean masks and the falloff decrements are
+    applied with two precomputed kernels (radius e - 1 around too-hot cells
+    inside the mask, radius 2e around too-hot cells outside it).
+
+    All increments and decrements are computed from the incoming H and summed
+    before H is clamped to [0, max_heat_rate] once, so the result does not
+    depend on the order in which cells are visited. Where no update clamps,
+    this matches update_heat_pattern_reference up to floating-point rounding
+    (~1e-16 of max_heat_rate). Only cells that the reference loop clamps
+    before their last update can differ further, by at most one step of
+    max_heat_rate / 256 (see tests/test_update_heat_pattern.py).
+
+    Args:
+        T: Temperature field.
+        H: Heat input field (updated in-place).
+        mask: Boolean array indicating regions of interest.
+        swell_temperature: Target temperature.
+        buffer: Tolerance above target temperature.
+        max_heat_rate: Maximum allowable heat per cell.
+    """
+    mask = mask.astype(bool, copy=False)
+    too_hot = T > swell_temperature + buffer
+    hot_in = mask & too_hot
+    cold_in = mask & (T < swell_temperature)
+    hot_out = ~mask & (T > swell_temperature)
+
+    dec = np.zeros_like(H)
+    if hot_in.any():
+        kernel = _falloff_kernel(math.e - 1, math.e)
+        _scatter_kernel(dec, hot_in * (max_heat_rate / 256 * 2), kernel)
+    if hot_out.any():
+        kernel = _falloff_kernel(2 * math.e, 2 * math.e)
+        _scatter_kernel(dec, hot_out * (max_heat_rate / 256 / 21.5), kernel)
+
+    H += cold_in * (max_heat_rate / 256)
+    H -= dec
+    np.clip(H, 0.0, max_heat_rate, out=H)
+
+
+def update_heat_pattern_reference(T: np.ndarray, H: np.ndarray, mask: np.ndarray,
+                                  swell_temperature: float, buffer: float,
+                                  max_heat_rate: float):
+    """
+    Adjust heat pattern based on local temperature and region mask.
+
+    Reference implementation that visits cells one by one and clamps H after
+    every single increment or decrement. Kept for regression checks against
+    the vectorized update_heat_pattern.
+
     Args:
         T: Temperature field.
         H: Heat input field (updated in-place).
@@ -198,15 +312,92 @@ def count_outsiders(T: np.ndarray, mask: np.ndarray, config: Config) -> int:
     Returns:
         Number of error points (outside acceptable temperature range).
     """
-    errs = 0
-    for t, m in zip(T.flat, mask.flat):
-        if m:
-            if t < config.swell_temperature or t > config.swell_temperature + config.buffer:
-                errs += 1
-        else:
-            if t > config.swell_temperature + config.buffer:
-                errs += 1
-    return errs
+    mask = mask.astype(bool, copy=False)
+    too_cold = np.count_nonzero((T < config.swell_temperature) & mask)
+    too_hot = np.count_nonzero(T > config.swell_temperature + config.buffer)
+    return int(too_cold + too_hot)
+
+
+def outsider_metrics(T: np.ndarray, mask: np.ndarray, config: Config) -> dict:
+    """
+    Break the error of a temperature field down by kind.
+
+    Args:
+        T: Temperature field.
+        mask: Region of interest.
+        config: Simulation configuration.
+
+    Returns:
+        Dictionary with:
+            - outsiders: Same count as count_outsiders().
+            - under: Cells in the mask below the swell temperature.
+            - over: Cells in the mask above the swell temperature plus buffer.
+            - spill: Cells outside the mask above the swell temperature plus buffer.
+            - mad: Mean absolute distance (°C) of all cells from their
+              acceptable range (0 when there are no outsiders).
+    """
+    mask = mask.astype(bool, copy=False)
+    low = config.swell_temperature
+    high = config.swell_temperature + config.buffer
+
+    # Counting boolean arrays is much faster than indexing with the mask
+    cold = T < low
+    hot = T > high
+    under = np.count_nonzero(cold & mask)
+    over = np.count_nonzero(hot & mask)
+    spill = np.count_nonzero(hot) - over
+
+    # Distance below and above the range, in place in one scratch array;
+    # fmax() leaves NaN cells out, as the comparisons above do
+    dist = np.subtract(low, T)
+    np.fmax(dist, 0.0, out=dist)
+    dist *= mask
+    deviation = dist.sum()
+    np.subtract(T, high, out=dist)
+    np.fmax(dist, 0.0, out=dist)
+    deviation += dist.sum()
+    return {
+        'outsiders': int(under + over + spill),
+        'under': int(under),
+        'over': int(over),
+        'spill': int(spill),
+        'mad': float(deviation / T.size),
+    }
+
+
+def outsider_loss(T: np.ndarray, mask: np.ndarray, config: Config,
+                  margin: float = 0.2, delta: float = 0.1):
+    """
+    Smooth counterpart of count_outsiders() for gradient-based optimization.
+
+    Huber penalties, in units of config.buffer, for cells in the mask below
+    the swell temperature or above the swell temperature plus buffer, and
+    for cells outside the mask above the swell temperature plus buffer. The
+    band is narrowed by margin * buffer on both sides so that the optimum
+    keeps cells clear of the thresholds. The penalty grows linearly beyond
+    delta * buffer, which, unlike a squared penalty, does not trade one
+    large violation for many small ones.
+
+    Args:
+        T: Temperature field.
+        mask: Region of interest.
+        config: Simulation configuration.
+        margin: Fraction of the buffer kept clear on each side of the band.
+        delta: Violation (fraction of the buffer) where the penalty turns linear.
+
+    Returns:
+        Tuple of (mean loss per cell, dLoss/dT).
+    """
+    mask = mask.astype(bool, copy=False)
+    low = config.swell_temperature + margin * config.buffer
+    high = config.swell_temperature + (1 - margin) * config.buffer
+
+    under = np.maximum(low - T, 0.0) * mask / config.buffer
+    over = np.maximum(T - high, 0.0) / config.buffer
+    x = under + over
+    value = float(np.sum(np.where(x < delta, x * x / (2 * delta), x - delta / 2)) / T.size)
+    slope = np.minimum(x / delta, 1.0) / (config.buffer * T.size)
+    return value, np.where(over > 0, slope, -slope)
 
 
 def is_converged(errors: list[int]) -> bool:
@@ -224,73 +415,765 @@ def is_converged(errors: list[int]) -> bool:
     return min(errors[-20:-10]) < min(errors[-10:])
 
 
-def optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, config: Config):
+def simulate(H: np.ndarray, max_heat: float, phys_w: float, phys_h: float,
+             config: Config) -> np.ndarray:
     """
-    Perform iterative optimization to generate an adaptive heatmap.
+    Run a single heating simulation from ambient temperature.
+
+    Args:
+        H: Heat input field.
+        max_heat: Maximum heat value.
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Configuration parameters (solver and time_step included).
+
+    Returns:
+        Temperature field in °C after config.heating_time.
+    """
+    dx = phys_w / (H.shape[0] - 1)
+    dy = phys_h / (H.shape[1] - 1)
+    dt = time_step(dx, dy, config)
+    nt = num_steps(dt, config)
+    hc_paper = config.c_paper * config.density_paper * phys_w * phys_h / H.size
+
+    stepper = make_stepper(H.shape, dx, dy, dt, hc_paper, config)
+    stepper.set_heat(H, max_heat)
+    return stepper.run(nt).copy()
+
+
+# Cells advanced per vectorized ensemble step; larger batches fall out of cache
+ENSEMBLE_BATCH_CELLS = 1 << 15
+
+
+def simulate_ensemble(H: np.ndarray, max_heat, phys_w: float, phys_h: float,
+                      configs, mask: np.ndarray = None, batch: int = None):
+    """
+    Run K heating simulations from ambient temperature in vectorized loops.
+
+    Members are stacked into batches of about ENSEMBLE_BATCH_CELLS cells and
+    each batch is advanced by one EnsembleStepper, so the per-step Python
+    overhead is shared by the members of a batch. This pays off only on
+    small grids (up to ~10k cells), where that overhead dominates. From
+    ENSEMBLE_BATCH_CELLS cells up, which includes the default resolution,
+    every member is its own batch and the call is no faster than separate
+    simulate() runs: a step is then bound by memory bandwidth, and larger
+    batches only fall out of cache. Parameter sweeps (run_sweep()) therefore
+    optimize each setting separately and gain speed from processes only.
+
+    Members may differ in any physical parameter that does not change the
+    timestep (e.g. swell_temperature, buffer, h, sigma, light_power via
+    H and max_heat). Members with different alpha need the same explicit
+    config.time_step. Each member gives the same result as simulate() with
+    the explicit solver.
+
+    Args:
+        H: Heat input fields stacked as (K, rows, columns), or one field
+            shared by all members.
+        max_heat: Maximum heat value, one value or one per member.
+        phys_w, phys_h: Physical dimensions in meters.
+        configs: One Config per member, or a single Config shared by all.
+        mask: If given, the outsider count of each member is returned too.
+        batch: Members per batch (default: from ENSEMBLE_BATCH_CELLS).
+
+    Returns:
+        Tuple of:
+            - T: Temperature fields (K, rows, columns) in °C after heating_time.
+            - outsiders: count_outsiders() of each member (None without mask).
+
+    Raises:
+        ValueError: If the members need different timesteps or step counts.
+    """
+    H = np.asarray(H)
+    if isinstance(configs, Config):
+        configs = [configs] * (H.shape[0] if H.ndim == 3 else 1)
+    configs = list(configs)
+    k = len(configs)
+    shape = H.shape[-2:]
+    H = np.broadcast_to(H, (k,) + shape)
+    max_heat = np.broadcast_to(np.asarray(max_heat, dtype=float), k)
+
+    dx = phys_w / (shape[0] - 1)
+    dy = phys_h / (shape[1] - 1)
+    steps = {(time_step(dx, dy, cfg), num_steps(time_step(dx, dy, cfg), cfg)) for cfg in configs}
+    if len(steps) > 1:
+        raise ValueError(
+            "Ensemble members need the same timestep and number of steps "
+            f"(got {sorted(steps)}); set the same time_step and heating_time"
+        )
+    (dt, nt), = steps
+    hc_paper = [cfg.c_paper * cfg.density_paper * phys_w * phys_h / (shape[0] * shape[1])
+                for cfg in configs]
+    if batch is None:
+        batch = max(1, ENSEMBLE_BATCH_CELLS // (shape[0] * shape[1]))
+
+    T = np.empty((k,) + shape, float_dtype(configs[0]))
+    for start in range(0, k, batch):
+        part = slice(start, start + batch)
+        stepper = EnsembleStepper(shape, dx, dy, dt, hc_paper[part], configs[part])
+        stepper.set_heat(H[part].astype(stepper.dtype, copy=False), max_heat[part])
+        T[part] = stepper.run(nt)
+
+    outsiders = None
+    if mask is not None:
+        outsiders = [count_outsiders(T_k, mask, cfg) for T_k, cfg in zip(T, configs)]
+    return T, outsiders
+
+
+def compare_solvers(mask, H, max_heat, phys_w, phys_h, config: Config,
+                    reference: Config = None) -> dict:
+    """
+    Compare the final temperature field of config against a reference run.
+
+    H and max_heat are given per timestep of the explicit stability limit
+    (as image_to_heat_pattern returns them with time_step=0) and are rescaled
+    to the timestep of each run, so both runs apply the same heating power.
+
+    Args:
+        mask: Binary mask indicating swelling region.
+        H: Heat input field.
+        max_heat: Maximum heat value.
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Configuration to evaluate (e.g. solver="adi" or dtype="float32").
+        reference: Reference configuration (default: config with the
+            explicit solver at its stability limit in float64).
+
+    Returns:
+        Dictionary with max/mean/RMS absolute differences in °C, both peak
+        temperatures and both outlier counts.
+    """
+    if reference is None:
+        reference = replace(config, solver="explicit", time_step=0.0, dtype="float64")
+
+    dx = phys_w / (H.shape[0] - 1)
+    dy = phys_h / (H.shape[1] - 1)
+    dt_H = explicit_time_step(dx, dy, config.alpha)
+
+    runs = []
+    for cfg in (reference, config):
+        scale = time_step(dx, dy, cfg) / dt_H
+        runs.append(simulate(H * scale, max_heat * scale, phys_w, phys_h, cfg))
+    T_ref, T = runs
+    diff = np.abs(T - T_ref)
+    return {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "rms_diff": float(np.sqrt(np.mean(diff**2))),
+        "peak_reference": float(T_ref.max()),
+        "peak": float(T.max()),
+        "outsiders_reference": count_outsiders(T_ref, mask, reference),
+        "outsiders": count_outsiders(T, mask, config),
+    }
+
+
+@dataclass
+class IterationState:
+    """
+    State of optimize_iter() after one iteration.
+
+    H and T are views of the optimizer's working arrays, not copies: they
+    change as soon as the generator is resumed. Copy them to keep them.
+    """
+    # Number of completed iterations (1-based)
+    iteration: int
+    # Heat input field the iteration was simulated with
+    H: np.ndarray
+    # Temperature field at the end of the heating time
+    T: np.ndarray
+    # Outsider count of T (see count_outsiders())
+    outsiders: int
+    # Wall-clock seconds since optimize_iter() started
+    elapsed: float
+    # Outsider counts of all iterations so far (the generator's own list)
+    errors: list
+    # True if is_converged(errors); the generator stops after this state
+    converged: bool
+
+
+def optimize_iter(mask, H_init, max_heat, phys_w, phys_h, config: Config,
+                  resume: dict = None, metrics: list = None, profiler: Profiler = None,
+                  stop_on_convergence: bool = True):
+    """
+    Run the optimization one iteration at a time.
+
+    Yields an IterationState after every iteration, without copying any
+    array. The caller may stop consuming at any time to end the run, e.g.
+    with its own stopping rule; otherwise the generator ends after
+    config.max_iterations iterations or at convergence.
+
+    With config.surrogate_every = k > 1, each iteration updates the heat
+    pattern k times but runs the exact simulation only once: the k - 1
+    updates in between are made on fields predicted by a SurrogateModel,
+    which is recalibrated to every exact field. Errors, convergence and
+    checkpoints only ever see exact fields.
+
+    With config.incremental, a DeltaStepper only re-simulates windows around
+    the cells whose heat changed (padded by config.active_margin diffusion
+    lengths), and every config.verify_every-th iteration is simulated in
+    full to bound the drift. It cannot be combined with config.active_region.
 
     Args:
         mask: Binary mask indicating swelling region.
         H_init: Initial heat input.
         max_heat: Maximum heat value.
-        img_w, img_h: Image dimensions in pixels (unused).
         phys_w, phys_h: Physical dimensions in meters.
         config: Configuration parameters.
+        resume: State from load_checkpoint(); iterations continue after the
+            saved one (its T_best is left to the caller).
+        metrics: If given, a list that receives the outsider_metrics() of
+            every iteration, in the same order as errors.
+        profiler: Times the diffusion, heat losses, heat pattern update,
+            surrogate and error metrics stages and records every iteration.
+        stop_on_convergence: End the run when is_converged() (default True).
 
-    Returns:
-        Tuple of:
-            - T_best: Best temperature field achieved.
-            - H: Final heat input field.
-            - errors: List of error counts over iterations.
+    Yields:
+        IterationState of each iteration.
     """
     configure_logger(config.verbose == 1)
+    clock_start = time.perf_counter()
 
     dx = phys_w / (mask.shape[0] - 1)
     dy = phys_h / (mask.shape[1] - 1)
-    dt = 0.49 * dx**2 * dy**2 / ((dx**2 + dy**2) * config.alpha)
-    nt = int(config.heating_time / dt)
+    dt = time_step(dx, dy, config)
+    nt = num_steps(dt, config)
 
     errors = []
-    T_best = np.ones_like(H_init) * config.ambient_temperature
-    H = H_init.copy()
-    Q_rad = H_init.copy()
-    Q_conv = H_init.copy()
+    dtype = float_dtype(config)
+    H = np.array(H_init, dtype=dtype)
+    start = 0
+    if resume is not None:
+        start = resume['iteration']
+        H = resume['H'].astype(dtype)
+        T = resume['T'].astype(dtype)
+        errors = list(resume['errors'])
+        if metrics is not None:
+            metrics.extend(resume.get('metrics', []))
+        logger.info(f"Resuming after iteration {start}")
+
+    if config.incremental:
+        if config.verify_every < 1:
+            raise ValueError(f"verify_every must be at least 1 (got {config.verify_every})")
+        if config.active_region:
+            # The deltas are simulated on the whole sheet, but a RegionStepper
+            # keeps everything outside its regions at ambient
+            raise ValueError("incremental cannot be combined with active_region")
+
+    # Heat capacity per cell
+    hc_paper = config.c_paper * config.density_paper * phys_w * phys_h / H.size
+    if config.active_region:
+        # Only simulate the design plus a thermal margin; the rest stays ambient
+        margin = math.ceil(config.active_margin * diffusion_length(config) / min(dx, dy))
+        regions = active_regions(mask.astype(bool) | (H > 0), margin)
+        stepper = RegionStepper(regions, H.shape, dx, dy, dt, hc_paper, config)
+        logger.info(f"Active regions: {len(regions)}, "
+                    f"{stepper.active_cells * 100 / H.size:.0f}% of the sheet")
+    else:
+        stepper = make_stepper(H.shape, dx, dy, dt, hc_paper, config)
+    if config.incremental:
+        margin = math.ceil(config.active_margin * diffusion_length(config) / min(dx, dy))
+        stepper = DeltaStepper(stepper, margin, dx, dy, dt, hc_paper, config)
+        if resume is not None:
+            stepper.seed(H, T)
+
+    surrogate = None
+    if config.surrogate_every > 1:
+        surrogate = SurrogateModel(H.shape, dx, dy, dt, nt, hc_paper, config)
+        if resume is not None:
+            surrogate.calibrate(H, T)
 
-    for it in range(config.max_iterations):
-        # Update heat pattern after first iteration
+    for it in range(start, config.max_iterations):
+        # Update heat pattern after first iteration, on the exact field and
+        # then on surrogate predictions
         if it > 0:
-            update_heat_pattern(
-                T, H, mask,
-                config.swell_temperature, config.buffer,
-                max_heat
-            )
-
-        # Reset temperature field to ambient
-        T = np.ones_like(H) * config.ambient_temperature
-
-        # Time-stepping for heat diffusion
-        for _ in range(nt):
-            Tn = T.copy()
-            T[1:-1, 1:-1] = (
-                Tn[1:-1, 1:-1]
-                + (config.alpha * dt / dx**2) * (Tn[1:-1, 2:] - 2 * Tn[1:-1, 1:-1] + Tn[1:-1, :-2])
-                + (config.alpha * dt / dy**2) * (Tn[2:, 1:-1] - 2 * Tn[1:-1, 1:-1] + Tn[:-2, 1:-1])
-            )
-            apply_heat_losses(Q_rad, Q_conv, T, H, max_heat, dx, dy, dt, config)
-            add_heat(T, H, Q_rad, Q_conv, phys_w, phys_h, config)
+            for k in range(config.surrogate_every if surrogate is not None else 1):
+                if k > 0:
+                    with stage(profiler, 'surrogate'):
+                        T = surrogate.predict(H)
+                with stage(profiler, 'update_heat_pattern'):
+                    update_heat_pattern(
+                        T, H, mask,
+                        config.swell_temperature, config.buffer,
+                        max_heat
+                    )
+
+        # Time-stepping for heat diffusion, starting from ambient
+        if config.incremental and (it + 1) % config.verify_every == 0:
+            stepper.invalidate()
+        stepper.set_heat(H, max_heat)
+        T = stepper.run(nt, profiler)
+        if surrogate is not None:
+            with stage(profiler, 'surrogate'):
+                surrogate.calibrate(H, T)
 
         # Track and store error
-        err = count_outsiders(T, mask, config)
+        with stage(profiler, 'metrics'):
+            if metrics is None:
+                err = count_outsiders(T, mask, config)
+            else:
+                metrics.append(outsider_metrics(T, mask, config))
+                err = metrics[-1]['outsiders']
         errors.append(err)
 
         # Log the iteration number and the error count
         logger.info(f"Iteration {it + 1}: Outlier = {int(err * 100 / config.resolution)}%")
 
-        # Store best temperature result
-        if err < min(errors[:-1] or [err]):
-            T_best = T.copy()
+        if profiler is not None:
+            profiler.record(it + 1, err * 100 / mask.size, nt)
 
-        if is_converged(errors):
+        converged = is_converged(errors)
+        if converged:
+            logger.info(f"Converged at iteration {it + 1}.")
+        yield IterationState(it + 1, H, T, err, time.perf_counter() - clock_start,
+                             errors, converged)
+        if converged and stop_on_convergence:
+            return
+
+
+# Iterations without a new best outsider count before optimize_adjoint() stops
+ADJOINT_PATIENCE = 30
+
+
+def optimize_adjoint(mask, H_init, max_heat, phys_w, phys_h, config: Config,
+                     checkpoint: Checkpointer = None, resume: dict = None,
+                     metrics: list = None, profiler: Profiler = None, deadline: float = None):
+    """
+    Optimize a heat pattern by gradient descent on outsider_loss().
+
+    Each iteration runs one forward simulation and its discrete adjoint
+    (AdjointStepper) to get the gradient of the loss with respect to H, and
+    takes a projected Adam step: H stays within [0, max_heat] and at zero
+    outside the mask. Only the explicit solver on the whole sheet is
+    supported: active_region, incremental and surrogate_every > 1 are
+    rejected, and threads is ignored.
+
+    Checkpoints hold the heat pattern and temperature field of the last
+    iteration, its gradient, the Adam moments and step count and the best
+    pattern so far, so a resumed run ends exactly as an uninterrupted one.
+
+    Args:
+        mask: Binary mask indicating swelling region.
+        H_init: Initial heat input.
+        max_heat: Maximum heat value.
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Configuration parameters (learning_rate sets the step size).
+        checkpoint: Saves the optimizer state periodically and, after
+            SIGTERM/SIGINT, once more before raising OptimizationInterrupted.
+        resume: State from load_checkpoint() to continue from.
+        metrics: If given, a list that receives the outsider_metrics() of
+            every iteration.
+        profiler: Times the forward/adjoint passes and records every iteration.
+        deadline: time.perf_counter() value by which the run must end (see
+            optimize()).
+
+    Returns:
+        Tuple of:
+            - T_best: Best temperature field achieved.
+            - H_best: Heat input field that produced T_best.
+            - errors: List of error counts over iterations.
+    """
+    configure_logger(config.verbose == 1)
+    if config.solver != "explicit":
+        raise ValueError(f"optimizer='adjoint' requires solver='explicit' (got {config.solver!r})")
+    unsupported = [name for name, used in (('active_region', config.active_region),
+                                           ('incremental', config.incremental),
+                                           ('surrogate_every > 1', config.surrogate_every > 1))
+                   if used]
+    if unsupported:
+        raise ValueError(f"optimizer='adjoint' does not support {', '.join(unsupported)}")
+    mask = mask.astype(bool, copy=False)
+
+    dx = phys_w / (mask.shape[0] - 1)
+    dy = phys_h / (mask.shape[1] - 1)
+    dt = time_step(dx, dy, config)
+    nt = num_steps(dt, config)
+    hc_paper = config.c_paper * config.density_paper * phys_w * phys_h / mask.size
+    stepper = AdjointStepper(mask.shape, dx, dy, dt, hc_paper, config)
+
+    dtype = float_dtype(config)
+    H = np.array(H_init, dtype=dtype)
+    H[~mask] = 0.0
+    H_best = H.copy()
+    T_best = np.full(mask.shape, config.ambient_temperature, dtype)
+    best_err = math.inf
+    best_it = 0
+    errors = []
+    start = 0
+    # Gradient of the last iteration, applied at the start of the next one,
+    # and Adam moments and number of steps taken
+    beta1, beta2, eps = 0.9, 0.999, 1e-12
+    grad = None
+    m = np.zeros_like(H)
+    v = np.zeros_like(H)
+    steps = 0
+    if resume is not None:
+        start = resume['iteration']
+        saved = resume.get('optimizer', {})
+        H = resume['H'].astype(dtype)
+        H_best = saved['H_best'].astype(dtype) if 'H_best' in saved else H.copy()
+        T_best = resume['T_best'].astype(dtype)
+        grad = saved['grad'].astype(dtype) if 'grad' in saved else None
+        if 'adam_m' in saved:
+            m = saved['adam_m'].astype(dtype)
+            v = saved['adam_v'].astype(dtype)
+            steps = int(saved['adam_steps'])
+        errors = list(resume['errors'])
+        if metrics is not None:
+            metrics.extend(resume.get('metrics', []))
+        if errors:
+            best_err = min(errors)
+            best_it = errors.index(best_err) + 1
+        logger.info(f"Resuming after iteration {start}")
+
+    lr = config.learning_rate * max_heat
+
+    def loss(T):
+        return outsider_loss(T, mask, config)
+
+    last = time.perf_counter()
+    for it in range(start, config.max_iterations):
+        # Projected Adam step on the gradient of the previous iteration
+        if grad is not None:
+            with stage(profiler, 'update_heat_pattern'):
+                steps += 1
+                grad[~mask] = 0.0
+                m *= beta1
+                m += (1 - beta1) * grad
+                v *= beta2
+                v += (1 - beta2) * grad**2
+                m_hat = m / (1 - beta1**steps)
+                v_hat = v / (1 - beta2**steps)
+                H -= lr * m_hat / (np.sqrt(v_hat) + eps)
+                np.clip(H, 0.0, max_heat, out=H)
+                H[~mask] = 0.0
+
+        with stage(profiler, 'adjoint'):
+            T, value, grad = stepper.value_and_grad(H, max_heat, nt, loss)
+
+        with stage(profiler, 'metrics'):
+            if metrics is None:
+                err = count_outsiders(T, mask, config)
+            else:
+                metrics.append(outsider_metrics(T, mask, config))
+                err = metrics[-1]['outsiders']
+        errors.append(err)
+        logger.info(f"Iteration {it + 1}: Outlier = {int(err * 100 / config.resolution)}%, "
+                    f"loss = {value:.3e}")
+
+        if err < best_err:
+            best_err, best_it = err, it + 1
+            np.copyto(T_best, T)
+            np.copyto(H_best, H)
+
+        if profiler is not None:
+            profiler.record(it + 1, err * 100 / mask.size, nt, loss=value)
+
+        # Adam overshoots now and then, so wait longer than is_converged() does
+        if err == 0 or it + 1 - best_it >= ADJOINT_PATIENCE:
             logger.info(f"Converged at iteration {it + 1}.")
             break
 
-    return T_best, H, errors
+        if deadline is not None:
+            # Stop if another iteration as long as the last one would overrun
+            now = time.perf_counter()
+            if now + (now - last) > deadline:
+                logger.info(f"Time budget reached after iteration {it + 1}.")
+                break
+            last = now
+
+        if checkpoint is not None and checkpoint.due(it + 1):
+            with stage(profiler, 'checkpoint'):
+                checkpoint.save(it + 1, H, T, T_best, errors, config, metrics,
+                                optimizer={'H_best': H_best, 'grad': grad, 'adam_m': m,
+                                           'adam_v': v, 'adam_steps': steps})
+            if checkpoint.stop_requested:
+                raise OptimizationInterrupted(checkpoint.path, it + 1)
+
+    return T_best, H_best, errors
+
+
+def optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, config: Config,
+             checkpoint: Checkpointer = None, resume: dict = None, metrics: list = None,
+             profiler: Profiler = None, deadline: float = None, best_heat: bool = False):
+    """
+    Perform iterative optimization to generate an adaptive heatmap.
+
+    Runs optimize_iter() to the end, keeping a copy of the best temperature
+    field and writing checkpoints. With config.optimizer == "adjoint" the
+    run is delegated to optimize_adjoint() instead.
+
+    Args:
+        mask: Binary mask indicating swelling region.
+        H_init: Initial heat input.
+        max_heat: Maximum heat value.
+        img_w, img_h: Image dimensions in pixels (unused).
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Configuration parameters.
+        checkpoint: Saves the optimizer state periodically and, after
+            SIGTERM/SIGINT, once more before raising OptimizationInterrupted.
+        resume: State from load_checkpoint(); the run continues after the
+            saved iteration and ends exactly as an uninterrupted run would.
+        metrics: If given, a list that receives the outsider_metrics() of
+            every iteration, in the same order as errors.
+        profiler: Times the diffusion, heat losses, heat pattern update,
+            error metrics and checkpoint stages and records every iteration.
+        deadline: time.perf_counter() value by which the run must end. No
+            iteration is started that would not finish by then (judged by
+            the previous one), and the heat pattern of T_best is returned
+            instead of the final one.
+        best_heat: Return the heat pattern of T_best instead of the final
+            one (implied by a deadline and by the adjoint optimizer).
+
+    Returns:
+        Tuple of:
+            - T_best: Best temperature field achieved.
+            - H: Final heat input field (with a deadline or best_heat, the
+              one that produced T_best).
+            - errors: List of error counts over iterations.
+    """
+    if config.optimizer == "adjoint":
+        return optimize_adjoint(mask, H_init, max_heat, phys_w, phys_h, config,
+                                checkpoint=checkpoint, resume=resume, metrics=metrics,
+                                profiler=profiler, deadline=deadline)
+    if config.optimizer != "heuristic":
+        raise ValueError(f"Unknown optimizer: {config.optimizer!r}")
+
+    dtype = float_dtype(config)
+    T_best = np.full(H_init.shape, config.ambient_temperature, dtype)
+    H = np.array(H_init, dtype=dtype)
+    errors = []
+    if resume is not None:
+        T_best = resume['T_best'].astype(dtype)
+        H = resume['H'].astype(dtype)
+        errors = list(resume['errors'])
+    best_err = min(errors, default=math.inf)
+    H_best = H.copy() if deadline is not None or best_heat else None
+    last = time.perf_counter()
+
+    for state in optimize_iter(mask, H_init, max_heat, phys_w, phys_h, config,
+                               resume=resume, metrics=metrics, profiler=profiler):
+        H, errors = state.H, state.errors
+
+        # Store best temperature result
+        if state.outsiders < best_err:
+            best_err = state.outsiders
+            np.copyto(T_best, state.T)
+            if H_best is not None:
+                np.copyto(H_best, H)
+
+        if state.converged:
+            break
+
+        if deadline is not None:
+            # Stop if another iteration as long as the last one would overrun
+            now = time.perf_counter()
+            if now + (now - last) > deadline:
+                logger.info(f"Time budget reached after iteration {state.iteration}.")
+                break
+            last = now
+
+        if checkpoint is not None and checkpoint.due(state.iteration):
+            with stage(profiler, 'checkpoint'):
+                checkpoint.save(state.iteration, H, state.T, T_best, errors, config, metrics)
+            if checkpoint.stop_requested:
+                raise OptimizationInterrupted(checkpoint.path, state.iteration)
+
+    return T_best, H if H_best is None else H_best, errors
+
+
+def resample_heat_pattern(H, max_heat, mask_prev, mask, new_max_heat):
+    """
+    Carry a heat pattern over to a grid of a different shape.
+
+    The pattern is resampled as a fraction of max_heat, so it can be reused
+    with a different cell area and timestep. Cells that lie in the new mask
+    but not in the resampled old mask start from the default heat.
+
+    Args:
+        H: Heat input field on the old grid.
+        max_heat: Maximum heat value on the old grid.
+        mask_prev: Binary mask on the old grid.
+        mask: Binary mask on the new grid.
+        new_max_heat: Maximum heat value on the new grid.
+
+    Returns:
+        Heat input field on the new grid.
+    """
+    mask = mask.astype(bool, copy=False)
+    level = resize_field(H / max_heat, mask.shape)
+    covered = resize_field(mask_prev, mask.shape, resample=Image.Resampling.NEAREST) > 0.5
+
+    H_new = np.clip(level, 0.0, 1.0) * new_max_heat
+    H_new[mask & ~covered] = new_max_heat / 2
+    H_new[~mask] = 0.0
+    return H_new
+
+
+def warm_start_heat_pattern(H_prev, max_heat_prev, mask_prev, mask, H_init,
+                            max_heat, phys_w, phys_h, config: Config):
+    """
+    Seed a run with a heat pattern optimized for a previous version of the image.
+
+    The previous pattern is resampled to the current grid if needed. Cells
+    where the mask changed, plus a halo of one thermal diffusion length
+    around them, are reset to H_init; everything else keeps the previous
+    pattern.
+
+    Args:
+        H_prev: Previously optimized heat pattern.
+        max_heat_prev: Maximum heat value of H_prev.
+        mask_prev: Binary mask H_prev was optimized for.
+        mask: Binary mask of the current image.
+        H_init: Default initial heat pattern of the current image.
+        max_heat: Maximum heat value of the current grid.
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Configuration parameters.
+
+    Returns:
+        Initial heat pattern for optimize().
+    """
+    mask = mask.astype(bool, copy=False)
+    mask_prev = np.asarray(mask_prev, dtype=bool)
+    if mask_prev.shape != mask.shape:
+        mask_prev = resize_field(mask_prev, mask.shape, resample=Image.Resampling.NEAREST) > 0.5
+
+    H = resample_heat_pattern(H_prev, max_heat_prev, mask_prev, mask, max_heat)
+
+    dx = phys_w / (mask.shape[0] - 1)
+    dy = phys_h / (mask.shape[1] - 1)
+    halo = math.ceil(diffusion_length(config) / min(dx, dy))
+    reset = dilate(mask != mask_prev, halo)
+    H[reset] = H_init[reset]
+
+    logger.info(f"Warm start: reset {reset.mean() * 100:.1f}% of the cells")
+    return H
+
+
+def calibrate_heat_pattern(H, mask, max_heat, phys_w, phys_h, config: Config,
+                           passes: int = 3):
+    """
+    Rescale a carried-over heat pattern cell by cell toward the target band.
+
+    A coarse grid cannot resolve how fast heat leaves thin features, so a
+    pattern that converged on it runs hot or cold on a finer grid. Each pass
+    simulates the pattern once and scales H inside the mask by
+    (T_target - T_ambient) / (T - T_ambient), clipped to [0.5, 2].
+
+    Args:
+        H: Heat input field (updated in-place).
+        mask: Binary mask indicating swelling region.
+        max_heat: Maximum heat value.
+        phys_w, phys_h: Physical dimensions in meters.
+        config: Configuration parameters.
+        passes: Number of simulate-and-rescale passes.
+    """
+    mask = mask.astype(bool, copy=False)
+    rise = config.swell_temperature + config.buffer / 2 - config.ambient_temperature
+    for _ in range(passes):
+        T = simulate(H, max_heat, phys_w, phys_h, config)
+        gain = np.clip(rise / np.maximum(T - config.ambient_temperature, 1.0), 0.5, 2.0)
+        H[mask] = np.clip(H[mask] * gain[mask], 0.0, max_heat)
+
+
+class _LevelCheckpointer:
+    """
+    Checkpointer of one coarse multigrid level.
+
+    Saves through the Checkpointer of the run, tagged with the level and
+    with the configuration of the whole run, so that load_checkpoint()
+    accepts the file and optimize_multigrid() resumes at that level.
+    """
+
+    def __init__(self, checkpoint: Checkpointer, level: int, config: Config):
+        self.checkpoint = checkpoint
+        self.level = level
+        self.config = config
+
+    @property
+    def path(self):
+        return self.checkpoint.path
+
+    @property
+    def stop_requested(self):
+        return self.checkpoint.stop_requested
+
+    def due(self, iteration: int) -> bool:
+        return self.checkpoint.due(iteration)
+
+    def save(self, iteration: int, H, T, T_best, errors, config: Config, metrics: list = None,
+             optimizer: dict = None):
+        self.checkpoint.save(iteration, H, T, T_best, errors, self.config, metrics, optimizer,
+                             level=self.level)
+
+
+def optimize_multigrid(image, config: Config, checkpoint: Checkpointer = None,
+                       resume: dict = None, metrics: list = None,
+                       profiler: Profiler = None, deadline: float = None):
+    """
+    Optimize a heat pattern coarse to fine.
+
+    Each resolution in config.multigrid_levels is optimized for the matching
+    budget in config.multigrid_iterations, and its heat pattern seeds the
+    next level after calibrate_heat_pattern() has corrected it for the finer
+    grid. The last level runs at config.resolution for at most
+    config.max_iterations iterations.
+
+    Args:
+        image: Path to the image or an ImageContext.
+        config: Configuration parameters.
+        checkpoint: Checkpointer of the run. Checkpoints of coarse levels
+            record the level, and SIGTERM/SIGINT interrupts any level.
+        resume: State from load_checkpoint(); skips the levels before the
+            one it was saved at and resumes that level.
+        metrics: If given, receives the outsider_metrics() of the
+            full-resolution iterations.
+        profiler: Times the stages of all levels (see optimize()).
+        deadline: time.perf_counter() value by which the run must end (see
+            optimize()). Levels reached after it run a single iteration.
+
+    Returns:
+        Tuple of:
+            - mask: Binary mask at full resolution.
+            - T_best: Best temperature field at full resolution.
+            - H: Final heat input field at full resolution.
+            - errors: Error counts of the full-resolution iterations.
+            - max_heat: Maximum heat value at full resolution.
+    """
+    configure_logger(config.verbose == 1)
+
+    levels = tuple(config.multigrid_levels)
+    budgets = tuple(config.multigrid_iterations)
+    if len(levels) != len(budgets):
+        raise ValueError(
+            "multigrid_levels and multigrid_iterations must have the same length "
+            f"(got {len(levels)} and {len(budgets)})"
+        )
+
+    image = ImageContext.of(image)
+    img_w, img_h, phys_w, phys_h = image.dims
+    schedule = list(zip(levels, budgets)) + [(config.resolution, config.max_iterations)]
+    first = 0
+    if resume is not None:
+        first = len(schedule) - 1 if resume.get('level') is None else resume['level']
+
+    prev = None
+    for level, (resolution, iterations) in enumerate(schedule[first:], start=first):
+        final = level == len(schedule) - 1
+        cfg = config if final else replace(config, resolution=resolution, max_iterations=iterations)
+        with stage(profiler, 'resize'):
+            mask, H_init, max_heat = image_to_heat_pattern(image, cfg)
+        if prev is not None:
+            with stage(profiler, 'calibrate'):
+                prev_mask, prev_H, prev_max_heat = prev
+                H_init = resample_heat_pattern(prev_H, prev_max_heat, prev_mask, mask, max_heat)
+                calibrate_heat_pattern(H_init, mask, max_heat, phys_w, phys_h, cfg)
+
+        logger.info(f"Level {level + 1}/{len(schedule)}: {mask.shape[0]}x{mask.shape[1]} cells")
+        level_checkpoint = checkpoint
+        if checkpoint is not None and not final:
+            level_checkpoint = _LevelCheckpointer(checkpoint, level, config)
+        T_best, H, errors = optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, cfg,
+                                     checkpoint=level_checkpoint,
+                                     resume=resume if level == first else None,
+                                     metrics=metrics if final else None,
+                                     profiler=profiler, deadline=deadline)
+        prev = (mask, H, max_heat)
+
+    return mask, T_best, H, errors, max_heat
@@ -5,39 +5,116 @@ Author: Sosuke Ichihashi
 Date: 2025-07-29
 """
 
+import io
 import numpy as np
-from PIL import Image, ImageOps
-import matplotlib.pyplot as plt
+from PIL import Image, ImageDraw, ImageFont, ImageOps, TiffImagePlugin
 from pathlib import Path
-from .utils import scale_to_255
+from .utils import ImageContext, resize_strips, scale_to_255
 
 
-def save_pattern(img_path: Path, H, max_heat):
+# File formats of the pattern and their extensions
+PATTERN_FORMATS = {'pdf': '.pdf', 'tiff': '.tif'}
+
+# PIL format names of the pattern formats
+PIL_FORMATS = {'pdf': 'PDF', 'tiff': 'TIFF'}
+
+
+# Contour levels (degrees C) and file suffixes of the temperature plots
+PLOT_LEVELS = (
+    ((0, 140, 180, 300), '_swell.png'),
+    ((0, 20, 40, 60, 80, 100, 120, 140, 160), '_temperature.png'),
+)
+
+# Plot backends accepted by save_plots()
+PLOT_BACKENDS = ('none', 'fast', 'matplotlib')
+
+# Viridis colormap sampled at 17 evenly spaced points (RGB, 0-255)
+VIRIDIS = np.array([
+    (68, 1, 84), (72, 24, 106), (71, 45, 123), (66, 64, 134), (59, 82, 139),
+    (51, 99, 141), (44, 114, 142), (38, 130, 142), (33, 145, 140), (31, 160, 136),
+    (40, 174, 128), (63, 188, 115), (94, 201, 98), (132, 212, 75), (173, 220, 48),
+    (216, 226, 25), (253, 231, 37)
+], dtype=float)
+
+
+def _output(out_dir: Path, name: str, buffers: dict = None):
+    """
+    Destination of one output file.
+
+    Args:
+        out_dir: Output directory (default: current working directory).
+        name: File name.
+        buffers: If given, a new io.BytesIO is stored in it under name and
+            returned instead of a path.
+
+    Returns:
+        Path in out_dir, or the new buffer.
+    """
+    if buffers is None:
+        return Path(out_dir or Path.cwd()) / name
+    buffers[name] = io.BytesIO()
+    return buffers[name]
+
+
+def save_pattern(image, H, max_heat, out_dir: Path = None, tile_rows: int = 0,
+                 file_format: str = 'pdf', buffers: dict = None):
     """
     Generate and save a PDF pattern image from a heatmap.
 
+    With tile_rows set, the pattern is upsampled and written one strip of
+    rows at a time, each strip as its own page, so memory use is bounded by
+    the strip size instead of the print size. Stacking the pages gives
+    exactly the pixels of the untiled pattern.
+
     Args:
-        img_path: Path to the input image used for sizing and DPI.
+        image: Path to the input image or an ImageContext, used for naming,
+            sizing and DPI.
         H: Heatmap array (2D).
         max_heat: Maximum heat value used for scaling.
+        out_dir: Output directory (default: current working directory).
+        tile_rows: Rows of the printed image per page (0: single page).
+            Rounded up to a multiple of 8 so the JPEG blocks of PDF pages
+            line up with the untiled image.
+        file_format: 'pdf' or 'tiff' (lossless, deflate-compressed).
+        buffers: Write into an io.BytesIO stored in this dictionary under
+            the file name, instead of into out_dir.
 
     Returns:
-        Path to the saved PDF file.
+        Path to the saved file (the file name when writing to buffers).
     """
-    img = Image.open(img_path)
+    if file_format not in PATTERN_FORMATS:
+        raise ValueError(f"Unknown pattern format '{file_format}' (expected one of {', '.join(PATTERN_FORMATS)})")
+    image = ImageContext.of(image)
     
     # Convert heatmap to 8-bit grayscale image and invert it
     pattern = ImageOps.invert(Image.fromarray(scale_to_255(H, max_heat)))
     
-    # Resize pattern to match original image dimensions
-    pattern = pattern.resize(img.size, resample=Image.Resampling.BILINEAR)
-    
     # Create output file path
-    out = Path.cwd() / f"{img_path.stem}_opt.pdf"
-    
-    # Save pattern with original DPI
-    pattern.save(out, dpi=img.info.get('dpi', (72, 72)))
-    return out
+    name = f"{image.name}_opt{PATTERN_FORMATS[file_format]}"
+    out = _output(out_dir, name, buffers)
+    options = {'dpi': image.dpi, 'format': PIL_FORMATS[file_format]}
+    if file_format == 'tiff':
+        options['compression'] = 'tiff_deflate'
+
+    if not tile_rows or tile_rows >= image.size[1]:
+        # Resize pattern to match original image dimensions
+        pattern = pattern.resize(image.size, resample=Image.Resampling.BILINEAR)
+
+        # Save pattern with original DPI
+        pattern.save(out, **options)
+        return out if buffers is None else name
+
+    rows = -(-tile_rows // 8) * 8
+    strips = resize_strips(np.asarray(pattern), image.size, rows)
+    if file_format == 'pdf':
+        for k, strip in enumerate(strips):
+            Image.fromarray(strip).save(out, append=k > 0, **options)
+    else:
+        with TiffImagePlugin.AppendingTiffWriter(out, new=True) as tf:
+            for strip in strips:
+                Image.fromarray(strip).save(tf, **options)
+                tf.newFrame()
+    return out if buffers is None else name
 
 
 def save_errors(errors, path: Path = Path('errors.csv')):
@@ -56,7 +133,113 @@ def save_errors(errors, path: Path = Path('errors.csv')):
     return full_path
 
 
-def save_plots(T, phys_w, phys_h, img_path: Path, dpi: int):
+def save_state(path: Path, H, mask, max_heat):
+    """
+    Save an optimized heat pattern so that a later run can warm-start from it.
+
+    Args:
+        path: Destination .npz file.
+        H: Heatmap array (2D).
+        mask: Binary mask the pattern was optimized for.
+        max_heat: Maximum heat value of the pattern.
+
+    Returns:
+        Path to the saved file.
+    """
+    path = Path(path)
+    np.savez_compressed(path, H=H, mask=mask, max_heat=max_heat)
+    return path
+
+
+def load_state(path: Path):
+    """
+    Load a heat pattern saved by save_state() (or a result cache entry).
+
+    Args:
+        path: Path to the .npz file.
+
+    Returns:
+        Tuple of (H, mask, max_heat).
+    """
+    with np.load(path) as data:
+        H = data['H'] if 'H' in data else data['H_best']
+        return H, data['mask'].astype(bool), float(data['max_heat'])
+
+
+def band_colors(levels):
+    """
+    Colors of the filled contour bands between levels, picked from the
+    viridis colormap at each band's midpoint as matplotlib's contourf does.
+
+    Args:
+        levels: Increasing band boundaries.
+
+    Returns:
+        A uint8 array of shape (len(levels) - 1, 3).
+    """
+    levels = np.asarray(levels, dtype=float)
+    mids = (levels[:-1] + levels[1:]) / 2
+    pos = (mids - levels[0]) / (levels[-1] - levels[0])
+    anchors = np.linspace(0, 1, len(VIRIDIS))
+    rgb = [np.interp(pos, anchors, VIRIDIS[:, c]) for c in range(3)]
+    return np.rint(np.stack(rgb, axis=1)).astype(np.uint8)
+
+
+def _load_font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has a single fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def render_bands(T, levels, size, dpi: float):
+    """
+    Rasterize a temperature field as filled contour bands with a colorbar.
+
+    Cells outside [levels[0], levels[-1]) are left white, as with contourf.
+
+    Args:
+        T: 2D NumPy array of temperature values.
+        levels: Increasing band boundaries.
+        size: Pixel size (width, height) of the plotted area.
+        dpi: Resolution used to size the colorbar strip and its labels.
+
+    Returns:
+        An RGB PIL Image of size (width + 1.5 * dpi, height).
+    """
+    width, height = size
+    levels = np.asarray(levels, dtype=np.float32)
+    n = len(levels) - 1
+
+    # Band index per pixel: 0 below the first level, n + 1 at or above the last
+    field = Image.fromarray(np.asarray(T, dtype=np.float32)).resize(size, Image.Resampling.BILINEAR)
+    idx = np.searchsorted(levels, np.asarray(field), side='right').astype(np.uint8)
+    lut = np.full((n + 2, 3), 255, dtype=np.uint8)
+    lut[1:n + 1] = band_colors(levels)
+
+    canvas = Image.new('RGB', (width + round(1.5 * dpi), height), 'white')
+    canvas.paste(Image.fromarray(lut[idx]), (0, 0))
+
+    # Colorbar strip: equally tall bands stacked bottom to top
+    draw = ImageDraw.Draw(canvas)
+    x0 = width + round(0.15 * dpi)
+    x1 = x0 + max(round(0.2 * dpi), 1)
+    y_bottom, y_top = round(0.9 * height), round(0.1 * height)
+    ys = [y_bottom - (y_bottom - y_top) * k / n for k in range(n + 1)]
+    for k in range(n):
+        draw.rectangle([x0, round(ys[k + 1]), x1, round(ys[k])], fill=tuple(int(c) for c in lut[k + 1]))
+    draw.rectangle([x0, y_top, x1, y_bottom], outline='black')
+
+    font_px = max(round(20 * dpi / 72), 8)  # 20 pt labels, as in the matplotlib plots
+    font = _load_font(font_px)
+    for v, y in zip(levels, ys):
+        draw.line([x1, round(y), x1 + max(round(0.05 * dpi), 2), round(y)], fill='black')
+        draw.text((x1 + round(0.08 * dpi), round(y - font_px / 2)), f"{v:g}", fill='black', font=font)
+    return canvas
+
+
+def save_plots(T, phys_w, phys_h, image, dpi: int = None, out_dir: Path = None,
+               backend: str = 'fast', buffers: dict = None):
     """
     Generate and save contour plots from temperature data.
 
@@ -64,20 +247,53 @@ def save_plots(T, phys_w, phys_h, img_path: Path, dpi: int):
         T: 2D NumPy array of temperature values.
         phys_w: Physical width of the object in meters.
         phys_h: Physical height of the object in meters.
-        img_path: Path to the reference image (for naming and sizing).
-        dpi: Desired DPI for output plots.
+        image: Path to the reference image or an ImageContext (for naming
+            and sizing).
+        dpi: Desired DPI for output plots (default: horizontal DPI of the image).
+        out_dir: Output directory (default: current working directory).
+        backend: 'fast' rasterizes the bands with NumPy and PIL, 'matplotlib'
+            draws them with contourf, 'none' saves nothing.
+        buffers: Write into io.BytesIO objects stored in this dictionary
+            under the file names, instead of into out_dir.
 
     Returns:
-        List of paths to the saved plot images.
+        List of paths to the saved plot images (file names when writing to
+        buffers).
+    """
+    if backend not in PLOT_BACKENDS:
+        raise ValueError(f"Unknown plot backend '{backend}' (expected one of {', '.join(PLOT_BACKENDS)})")
+    if backend == 'none':
+        return []
+
+    image = ImageContext.of(image)
+    dpi = dpi or image.dpi[0]
+    if backend == 'matplotlib':
+        return _save_plots_matplotlib(T, phys_w, phys_h, image, dpi, out_dir, buffers)
+
+    outs = []
+    for levels, suf in PLOT_LEVELS:
+        name = f"{image.name}{suf}"
+        out = _output(out_dir, name, buffers)
+        render_bands(T, levels, image.size, dpi).save(out, format='PNG', dpi=(dpi, dpi))
+        outs.append(out if buffers is None else name)
+    return outs
+
+
+def _save_plots_matplotlib(T, phys_w, phys_h, image: ImageContext, dpi: int, out_dir: Path = None,
+                           buffers: dict = None):
+    """
+    Draw the plots with matplotlib contourf (imported only here, as it is slow to load).
     """
-    # Open image to retrieve pixel dimensions
-    img = Image.open(img_path)
+    import matplotlib.pyplot as plt
+
+    # Pixel dimensions of the reference image
+    width, height = image.size
     dpi_x = dpi
     dpi_y = dpi
 
     # Convert image size from pixels to inches
-    width_in = img.width / dpi_x
-    height_in = img.height / dpi_y
+    width_in = width / dpi_x
+    height_in = height / dpi_y
 
     # Create meshgrid in physical space (meters)
     X, Y = np.meshgrid(
@@ -85,26 +301,21 @@ def save_plots(T, phys_w, phys_h, img_path: Path, dpi: int):
         np.linspace(0, phys_w, T.shape[0])
     )
 
-    # Define contour levels and suffixes for output files
-    levels_list = [
-        ([0, 140, 180, 300], '_swell.png'),
-        ([0, 20, 40, 60, 80, 100, 120, 140, 160], '_temperature.png')
-    ]
-
     outs = []
-    for levels, suf in levels_list:
+    for levels, suf in PLOT_LEVELS:
         # Set up figure with padding to avoid clipping
         plt.figure(figsize=(width_in + 1.5, height_in), dpi=dpi_x)
-        plt.contourf(X, Y[::-1], T, levels)
+        plt.contourf(X, Y[::-1], T, list(levels))
         cb = plt.colorbar()
         cb.ax.tick_params(labelsize=20)
         plt.xticks([])
         plt.yticks([])
 
         # Save the plot image
-        out = Path.cwd() / f"{img_path.stem}{suf}"
-        plt.savefig(out)
+        name = f"{image.name}{suf}"
+        out = _output(out_dir, name, buffers)
+        plt.savefig(out, format='png')
         plt.close()
-        outs.append(out)
+        outs.append(out if buffers is None else name)
 
     return outs
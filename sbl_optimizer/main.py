@@ -24,15 +24,39 @@ Date: 2025-07-29
 """
 
 import argparse
+import glob
+import json
 import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import replace
 from pathlib import Path
-from PIL import Image
 import importlib.resources as resources
 
+from .budget import budget_config
+from .cache import ResultCache, cache_key, default_cache_dir
+from .checkpoint import Checkpointer, OptimizationInterrupted, load_checkpoint
 from .config import Config
-from .heat_solver import image_to_heat_pattern, optimize
-from .utils import compute_dims
-from .io import save_pattern, save_errors, save_plots
+from .heat_solver import (
+    image_to_heat_pattern, optimize, optimize_multigrid, warm_start_heat_pattern
+)
+from .utils import ImageContext
+from .io import PATTERN_FORMATS, PLOT_BACKENDS, load_state, save_pattern, save_errors, save_plots, save_state
+from .sweep import format_sweep, load_sweep, run_sweep
+from .telemetry import Profiler, format_stages, stage
+
+
+# File extensions picked up when a directory is given as input
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
+
+# Environment variables that limit BLAS/OpenMP threads in worker processes
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS'
+)
 
 
 def parse_args():
@@ -40,7 +64,8 @@ def parse_args():
     Parse command-line arguments.
 
     Returns:
-        argparse.Namespace containing input image path and config path.
+        argparse.Namespace containing input image paths, config path and
+        batch options.
     """
     # Default config path from package resources
     try:
@@ -51,16 +76,130 @@ def parse_args():
 
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        'image',
-        nargs='?',
-        default=None,
-        help='Input image path (defaults to bundled sample image)'
+        'images',
+        nargs='*',
+        metavar='image',
+        help='Input image paths, glob patterns or directories (defaults to bundled sample image)'
     )
     parser.add_argument(
         '-c', '--config',
         default=str(default_cfg),
         help=f'Path to JSON config (default: {default_cfg})'
     )
+    parser.add_argument(
+        '-o', '--output-dir',
+        default=None,
+        help='Directory for output files (default: current directory)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        help='Number of images optimized in parallel in batch mode, or worker processes of --serve (default: 1)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help=f'Directory of the result cache (default: {default_cache_dir()})'
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=float,
+        default=1024,
+        help='Size limit of the result cache in MB (default: 1024)'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always run the optimizer and do not store results in the cache'
+    )
+    parser.add_argument(
+        '--warm-start',
+        default=None,
+        metavar='NPZ',
+        help='Start from a heat pattern saved with --save-state (single image only)'
+    )
+    parser.add_argument(
+        '--save-state',
+        action='store_true',
+        help='Also save the optimized heat pattern as <image>_opt.npz for --warm-start'
+    )
+    parser.add_argument(
+        '--plots',
+        choices=PLOT_BACKENDS,
+        default='fast',
+        help="Temperature plots: 'fast' (NumPy/PIL), 'matplotlib' (contourf) or 'none' (default: fast)"
+    )
+    parser.add_argument(
+        '--pattern-format',
+        choices=tuple(PATTERN_FORMATS),
+        default='pdf',
+        help='File format of the optimized pattern (default: pdf)'
+    )
+    parser.add_argument(
+        '--tile-rows',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Write the pattern in strips of N rows, one page each, to bound memory on large prints (default: 0, one page)'
+    )
+    parser.add_argument(
+        '--checkpoint-every',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Save a checkpoint as <image>_checkpoint.npz every N iterations (default: 0, off)'
+    )
+    parser.add_argument(
+        '--checkpoint-seconds',
+        type=float,
+        default=0,
+        metavar='S',
+        help='Save a checkpoint at most every S seconds of wall-clock time (default: 0, off)'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue from <image>_checkpoint.npz in the output directory if it exists'
+    )
+    parser.add_argument(
+        '--sweep',
+        default=None,
+        metavar='JSON',
+        help='Optimize one image for every config override in JSON (a grid or a list) across -j processes'
+    )
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        default=None,
+        metavar='SECONDS',
+        help='Optimize each image at the highest resolution predicted to fit SECONDS, and stop there (overrides time_budget in the config)'
+    )
+    parser.add_argument(
+        '--serve',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='ADDRESS',
+        help='Run a local optimization service on HOST:PORT or unix:PATH with -j warm workers (default: 127.0.0.1:8765)'
+    )
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=16,
+        metavar='N',
+        help='Jobs the service holds waiting for a worker before refusing new ones (default: 16)'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage of the run and print a breakdown at the end'
+    )
+    parser.add_argument(
+        '--telemetry',
+        action='store_true',
+        help='Write per-iteration stage timings to <image>_telemetry.jsonl in the output directory'
+    )
     return parser.parse_args()
 
 
@@ -83,10 +222,440 @@ def configure_main_logging(verbose: bool):
     logger.addHandler(handler)
 
 
+def collect_images(inputs):
+    """
+    Expand input arguments into a list of image paths.
+
+    Args:
+        inputs: Image paths, glob patterns or directories.
+
+    Returns:
+        Tuple of (list of image paths, True if batch mode was requested).
+
+    Raises:
+        ValueError: If two images share a file stem, since their outputs
+            (<stem>_opt.pdf, checkpoints, telemetry) would overwrite each other.
+    """
+    images = []
+    batch = len(inputs) > 1
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            batch = True
+            images.extend(sorted(
+                p for p in path.iterdir()
+                if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+            ))
+        elif glob.has_magic(item):
+            batch = True
+            images.extend(sorted(
+                p for p in map(Path, glob.glob(item))
+                if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+            ))
+        else:
+            images.append(path)
+
+    # Drop duplicates while keeping order
+    seen = set()
+    unique = []
+    for p in images:
+        key = p.resolve()
+        if key not in seen:
+            seen.add(key)
+            unique.append(p)
+
+    # Output files are named after the stem, so stems must be unique
+    stems = {}
+    for p in unique:
+        stems.setdefault(p.stem, []).append(p)
+    clashes = [paths for paths in stems.values() if len(paths) > 1]
+    if clashes:
+        names = '; '.join(', '.join(str(p) for p in paths) for paths in clashes)
+        raise ValueError(f"Images with the same file name would overwrite each other's outputs: {names}")
+    return unique, batch
+
+
+def output_paths(image_path: Path, out_dir: Path, plots: str = 'fast', pattern_format: str = 'pdf'):
+    """
+    List the files written for one image.
+    """
+    paths = [out_dir / f"{image_path.stem}_opt{PATTERN_FORMATS[pattern_format]}"]
+    if plots != 'none':
+        paths += [
+            out_dir / f"{image_path.stem}_swell.png",
+            out_dir / f"{image_path.stem}_temperature.png",
+        ]
+    return paths
+
+
+def checkpoint_path(image_path: Path, out_dir: Path):
+    """
+    Path of the checkpoint written while optimizing one image.
+    """
+    return Path(out_dir) / f"{Path(image_path).stem}_checkpoint.npz"
+
+
+def telemetry_path(image_path: Path, out_dir: Path):
+    """
+    Path of the telemetry records written while optimizing one image.
+    """
+    return Path(out_dir) / f"{Path(image_path).stem}_telemetry.jsonl"
+
+
+def run_image(image_path: Path, cfg: Config, out_dir: Path, cache: ResultCache = None,
+              warm_start: Path = None, state: bool = False, checkpoint_every: int = 0,
+              checkpoint_seconds: float = 0.0, resume: bool = False, plots: str = 'fast',
+              pattern_format: str = 'pdf', tile_rows: int = 0, profile: bool = False,
+              telemetry: bool = False):
+    """
+    Optimize one image and save its outputs.
+
+    Args:
+        image_path: Path to the input image.
+        cfg: Configuration parameters.
+        out_dir: Output directory.
+        cache: Result cache; a hit skips the optimizer entirely.
+        warm_start: .npz heat pattern to start from (see warm_start_heat_pattern).
+        state: Also save the heat pattern as <stem>_opt.npz.
+        checkpoint_every: Save <stem>_checkpoint.npz every this many iterations.
+        checkpoint_seconds: Save <stem>_checkpoint.npz at most every this
+            many seconds.
+        resume: Continue from <stem>_checkpoint.npz if it exists.
+        plots: Plot backend passed to save_plots().
+        pattern_format: File format of the pattern ('pdf' or 'tiff').
+        tile_rows: Rows per page of the pattern (0: single page).
+        profile: Time each stage and add the totals to the summary.
+        telemetry: Write per-iteration records to <stem>_telemetry.jsonl.
+
+    Returns:
+        Dictionary summarizing the run (iterations, outlier %, error
+        breakdown of the last iteration, wall time, output paths and, when
+        profiling, seconds per stage).
+
+    Raises:
+        OptimizationInterrupted: SIGTERM/SIGINT arrived; the checkpoint holds
+            the state to resume from.
+    """
+    start = time.perf_counter()
+    profiler = None
+    if profile or telemetry:
+        profiler = Profiler(telemetry_path(image_path, out_dir) if telemetry else None)
+    try:
+        summary = _run_image(image_path, cfg, out_dir, cache, warm_start, state, checkpoint_every,
+                             checkpoint_seconds, resume, plots, pattern_format, tile_rows, profiler)
+    finally:
+        if profiler is not None:
+            profiler.close()
+    summary['wall_time'] = time.perf_counter() - start
+    if profiler is not None:
+        summary['stages'] = dict(profiler.totals)
+    return summary
+
+
+def optimize_image(image: ImageContext, cfg: Config, cache: ResultCache = None,
+                   warm_start: Path = None, checkpoint: Checkpointer = None, resume: dict = None,
+                   metrics: list = None, profiler: Profiler = None):
+    """
+    Optimize the heat pattern of one decoded image, or fetch it from the cache.
+
+    Args:
+        image: Input image.
+        cfg: Configuration parameters.
+        cache: Result cache; a hit skips the optimizer entirely, a miss is
+            stored.
+        warm_start: .npz heat pattern to start from (see warm_start_heat_pattern).
+        checkpoint: Checkpointer passed to the optimizer.
+        resume: Checkpoint from load_checkpoint() to continue from.
+        metrics: If given, receives the outsider_metrics() of every iteration.
+        profiler: Times the stages of the run.
+
+    With cfg.time_budget, the resolution is replaced by the highest one the
+    cost model predicts to fit the budget (or, when resuming, by the one of
+    the checkpoint), and the run stops at the budget. Such runs depend on
+    the speed of the machine and may be cut short, so they bypass the cache.
+
+    Returns:
+        Tuple of (mask, T_best, H_best, errors, max_heat, cached).
+    """
+    start = time.perf_counter()
+    img_w, img_h, phys_w, phys_h = image.dims
+    deadline = None
+    if cfg.time_budget > 0:
+        cache = None
+        deadline = start + cfg.time_budget
+        if resume is not None:
+            # Continue with the levels and the resolution of the checkpoint
+            budget = resume['budget']
+            cfg = replace(cfg, resolution=budget['resolution'],
+                          multigrid_levels=tuple(budget['multigrid_levels']),
+                          multigrid_iterations=tuple(budget['multigrid_iterations']))
+            logging.info(f"Time budget {cfg.time_budget:g} s: resuming at resolution "
+                         f"{cfg.resolution}")
+        else:
+            cfg, predicted = budget_config(image, cfg)
+            logging.info(f"Time budget {cfg.time_budget:g} s: resolution {cfg.resolution} "
+                         f"(predicted {predicted:.1f} s for {cfg.max_iterations} iterations)")
+    key = cache_key(image, cfg, warm_start) if cache else None
+    cached = cache.get(key) if cache else None
+
+    if cached:
+        mask, T_best, H_best = cached['mask'], cached['T_best'], cached['H_best']
+        errors, max_heat = cached['errors'], cached['max_heat']
+    elif cfg.multigrid_levels and not warm_start:
+        # Run optimization coarse to fine
+        mask, T_best, H_best, errors, max_heat = optimize_multigrid(
+            image, cfg, checkpoint=checkpoint, resume=resume, metrics=metrics,
+            profiler=profiler, deadline=deadline)
+    else:
+        # Load image
+        with stage(profiler, 'resize'):
+            mask, H_init, max_heat = image_to_heat_pattern(image, cfg)
+
+        # Start from a previous pattern where the design did not change
+        if warm_start and resume is None:
+            H_prev, mask_prev, max_heat_prev = load_state(warm_start)
+            H_init = warm_start_heat_pattern(H_prev, max_heat_prev, mask_prev, mask, H_init,
+                                             max_heat, phys_w, phys_h, cfg)
+
+        if resume is not None and resume['H'].shape != mask.shape:
+            raise ValueError(f"Checkpoint has grid {resume['H'].shape}, expected {mask.shape}")
+
+        # Run optimization
+        T_best, H_best, errors = optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h,
+                                          cfg, checkpoint=checkpoint, resume=resume,
+                                          metrics=metrics, profiler=profiler,
+                                          deadline=deadline)
+
+    if cache and not cached:
+        cache.put(key, H_best, T_best, mask, max_heat, errors)
+    return mask, T_best, H_best, errors, max_heat, bool(cached)
+
+
+def _run_image(image_path, cfg, out_dir, cache, warm_start, state, checkpoint_every,
+               checkpoint_seconds, resume, plots, pattern_format, tile_rows, profiler):
+    """
+    Body of run_image(), with the profiler already set up.
+    """
+    # SIGTERM/SIGINT always leave a checkpoint behind; periodic saves are optional
+    ckpt_path = checkpoint_path(image_path, out_dir)
+    checkpointer = Checkpointer(ckpt_path, checkpoint_every, checkpoint_seconds)
+    ckpt = None
+    if resume and ckpt_path.exists():
+        ckpt = load_checkpoint(ckpt_path, cfg)
+        logging.info("Resuming %s from %s", image_path, ckpt_path)
+
+    # Decode the image once and get physical dimensions
+    image = ImageContext(image_path)
+    img_w, img_h, phys_w, phys_h = image.dims
+
+    metrics = []
+    with checkpointer.handle_signals():
+        mask, T_best, H_best, errors, max_heat, cached = optimize_image(
+            image, cfg, cache, warm_start, checkpointer, ckpt, metrics, profiler)
+
+    # Save results
+    with stage(profiler, 'save_pattern'):
+        out_pattern = save_pattern(image, H_best, max_heat, out_dir, tile_rows=tile_rows,
+                                   file_format=pattern_format)
+    # Comment out the line below to track error scores
+    # err_csv = save_errors(errors)
+    with stage(profiler, 'plotting'):
+        plot_paths = save_plots(T_best, phys_w, phys_h, image, out_dir=out_dir, backend=plots)
+    outputs = [out_pattern] + plot_paths
+    if state:
+        outputs.append(save_state(Path(out_dir) / f"{image_path.stem}_opt.npz", H_best, mask, max_heat))
+
+    # Log output file paths
+    # logging.info("Saved errors: %s", err_csv)
+    for p in outputs:
+        logging.info("Saved: %s", p)
+
+    # The outputs supersede the checkpoint
+    ckpt_path.unlink(missing_ok=True)
+
+    return {
+        'image': str(image_path),
+        'status': 'ok',
+        'iterations': len(errors),
+        'outlier_pct': errors[-1] * 100 / mask.size,
+        'best_outlier_pct': min(errors) * 100 / mask.size,
+        'final_metrics': metrics[-1] if metrics else None,
+        'cached': bool(cached),
+        'outputs': [str(p) for p in outputs],
+    }
+
+
+def _run_image_safe(image_path: Path, cfg: Config, out_dir: Path, cache: ResultCache = None,
+                    state: bool = False, checkpoint_every: int = 0,
+                    checkpoint_seconds: float = 0.0, resume: bool = False, plots: str = 'fast',
+                    pattern_format: str = 'pdf', tile_rows: int = 0, profile: bool = False,
+                    telemetry: bool = False):
+    """
+    Run run_image() and turn any failure into an error summary.
+    """
+    start = time.perf_counter()
+    try:
+        return run_image(image_path, cfg, out_dir, cache, state=state,
+                         checkpoint_every=checkpoint_every,
+                         checkpoint_seconds=checkpoint_seconds, resume=resume, plots=plots,
+                         pattern_format=pattern_format, tile_rows=tile_rows, profile=profile,
+                         telemetry=telemetry)
+    except OptimizationInterrupted as e:
+        logging.warning("%s", e)
+        return {
+            'image': str(image_path),
+            'status': 'interrupted',
+            'error': str(e),
+            'wall_time': time.perf_counter() - start,
+        }
+    except Exception as e:
+        logging.exception("Failed to optimize %s", image_path)
+        return {
+            'image': str(image_path),
+            'status': 'error',
+            'error': f"{type(e).__name__}: {e}",
+            'wall_time': time.perf_counter() - start,
+        }
+
+
+def _init_worker(verbose: bool):
+    """
+    Set up logging in a batch worker process.
+    """
+    configure_main_logging(verbose)
+
+
+@contextmanager
+def pinned_threads(n: int = 1):
+    """
+    Limit BLAS/OpenMP threads of processes started inside the context.
+    """
+    saved = {k: os.environ.get(k) for k in THREAD_ENV_VARS}
+    os.environ.update({k: str(n) for k in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def read_manifest(path: Path):
+    """
+    Read the latest manifest record of each image.
+
+    Args:
+        path: Path to a JSON Lines manifest.
+
+    Returns:
+        Dictionary mapping image path strings to their latest record.
+    """
+    records = {}
+    if path.exists():
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Partially written line from an interrupted run
+                records[record.get('image')] = record
+    return records
+
+
+def run_batch(images, cfg: Config, out_dir: Path, jobs: int = 1, cache: ResultCache = None,
+              state: bool = False, checkpoint_every: int = 0, checkpoint_seconds: float = 0.0,
+              resume: bool = False, plots: str = 'fast', pattern_format: str = 'pdf',
+              tile_rows: int = 0, profile: bool = False, telemetry: bool = False):
+    """
+    Optimize many images across a process pool.
+
+    Each finished image appends one record to manifest.jsonl in out_dir.
+    Images whose last record is successful and whose outputs still exist are
+    skipped, so an interrupted batch can simply be re-run. A failing image is
+    recorded and does not stop the batch.
+
+    Args:
+        images: List of image paths.
+        cfg: Configuration parameters.
+        out_dir: Output directory.
+        jobs: Maximum number of worker processes.
+        cache: Result cache shared by all workers.
+        state: Also save each heat pattern as <stem>_opt.npz.
+        checkpoint_every: Checkpoint each image every this many iterations.
+        checkpoint_seconds: Checkpoint each image at most every this many seconds.
+        resume: Continue unfinished images from their checkpoints.
+        plots: Plot backend passed to save_plots().
+        pattern_format: File format of the patterns ('pdf' or 'tiff').
+        tile_rows: Rows per page of the patterns (0: single page).
+        profile: Time each stage and add the totals to each record.
+        telemetry: Write per-iteration records to <stem>_telemetry.jsonl.
+
+    Returns:
+        List of summary records of the images processed in this run.
+    """
+    manifest = out_dir / 'manifest.jsonl'
+    done = read_manifest(manifest)
+
+    todo = []
+    for image_path in images:
+        image_path = Path(image_path).resolve()
+        record = done.get(str(image_path))
+        if (record and record.get('status') == 'ok'
+                and all(p.exists() for p in output_paths(image_path, out_dir, plots, pattern_format))):
+            logging.info("Skipping %s (already complete)", image_path)
+            continue
+        todo.append(image_path)
+
+    logging.info("Batch: %d images to optimize, %d skipped", len(todo), len(images) - len(todo))
+    options = (state, checkpoint_every, checkpoint_seconds, resume, plots, pattern_format, tile_rows,
+               profile, telemetry)
+    results = []
+    with open(manifest, 'a') as log, pinned_threads(1):
+        def record(result):
+            log.write(json.dumps(result) + '\n')
+            log.flush()
+            results.append(result)
+            if result['status'] == 'ok':
+                logging.info("Done %s: %d iterations, outlier %.2f%%, %.1fs",
+                             result['image'], result['iterations'],
+                             result['outlier_pct'], result['wall_time'])
+            else:
+                logging.error("Failed %s: %s", result['image'], result['error'])
+
+        if jobs <= 1:
+            for image_path in todo:
+                record(_run_image_safe(image_path, cfg, out_dir, cache, *options))
+        else:
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx,
+                                     initializer=_init_worker,
+                                     initargs=(cfg.verbose,)) as pool:
+                futures = {
+                    pool.submit(_run_image_safe, image_path, cfg, out_dir, cache, *options): image_path
+                    for image_path in todo
+                }
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:  # e.g. a worker process died
+                        result = {
+                            'image': str(futures[future]),
+                            'status': 'error',
+                            'error': f"{type(e).__name__}: {e}",
+                        }
+                    record(result)
+    return results
+
+
 def main():
     """
     Main execution function:
-    - Loads configuration and input image.
+    - Loads configuration and input images.
     - Generates initial heat pattern.
     - Optimizes heat distribution.
     - Saves output pattern, error log, and temperature plots.
@@ -100,41 +669,96 @@ def main():
     if not cfg_path.exists():
         raise FileNotFoundError(f"Config file not found: {cfg_path}")
     cfg = Config.from_file(cfg_path)
+    if args.time_budget is not None:
+        cfg = replace(cfg, time_budget=args.time_budget)
 
     # Set logger
     configure_main_logging(cfg.verbose)
 
-    # Resolve image path
-    if args.image:
-        image_path = Path(args.image)
+    # Result cache
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 * 1024))
+
+    if args.serve is not None:
+        # The HTTP service stack is only imported when it is used
+        from .service import DEFAULT_ADDRESS, serve
+        with pinned_threads(1):
+            serve(cfg, args.serve or DEFAULT_ADDRESS, workers=args.jobs, queue_size=args.queue_size, cache=cache,
+                  plots=args.plots, pattern_format=args.pattern_format, tile_rows=args.tile_rows)
+        return
+
+    # Output directory
+    out_dir = Path(args.output_dir) if args.output_dir else Path.cwd()
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # Resolve image paths
+    if args.images:
+        images, batch = collect_images(args.images)
+        if not images:
+            raise FileNotFoundError(f"No images found in: {' '.join(args.images)}")
     else:
         try:
             with resources.as_file(resources.files("sbl_optimizer.assets") / "sample.jpg") as sample_img_path:
-                image_path = sample_img_path
-                logging.info(f"No image provided. Using default: {image_path}")
+                images, batch = [sample_img_path], False
+                logging.info(f"No image provided. Using default: {sample_img_path}")
         except (FileNotFoundError, ModuleNotFoundError):
             raise FileNotFoundError("No image provided and default sample image not found in package.")
 
-    # Load image
-    mask, H_init, max_heat = image_to_heat_pattern(image_path, cfg)
+    run_options = {
+        'checkpoint_every': args.checkpoint_every,
+        'checkpoint_seconds': args.checkpoint_seconds,
+        'resume': args.resume,
+        'plots': args.plots,
+        'pattern_format': args.pattern_format,
+        'tile_rows': args.tile_rows,
+        'profile': args.profile,
+        'telemetry': args.telemetry,
+    }
+    if args.sweep:
+        if batch:
+            raise ValueError("--sweep applies to a single image, not to batch mode")
+        overrides = load_sweep(Path(args.sweep))
+        with pinned_threads(1):
+            results = run_sweep(images[0], cfg, overrides, jobs=args.jobs, out_dir=out_dir)
+        table = out_dir / f"{Path(images[0]).stem}_sweep.json"
+        with open(table, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(format_sweep(results))
+        logging.info("Saved: %s", table)
+        if any(r['status'] != 'ok' for r in results):
+            raise SystemExit(1)
+        return
 
-    # Get physical dimensions
-    img_w, img_h, phys_w, phys_h = compute_dims(Image.open(image_path))
-
-    # Run optimization
-    T_best, H_best, errors = optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, cfg)
-
-    # Save results
-    out_pdf = save_pattern(image_path, H_best, max_heat)
-    # Comment out the line below to track error scores
-    # err_csv = save_errors(errors)
-    plots = save_plots(T_best, phys_w, phys_h, image_path, dpi=Image.open(image_path).info.get('dpi', (72, 72))[0])
+    if not batch:
+        try:
+            result = run_image(images[0], cfg, out_dir, cache, warm_start=args.warm_start,
+                               state=args.save_state, **run_options)
+        except OptimizationInterrupted as e:
+            logging.warning("%s; re-run with --resume to continue", e)
+            raise SystemExit(130)
+        if args.profile:
+            print(format_stages(result['stages']))
+        return
+    if args.warm_start:
+        raise ValueError("--warm-start applies to a single image, not to batch mode")
 
-    # Log output file paths
-    logging.info("Saved: %s", out_pdf)
-    # logging.info("Saved errors: %s", err_csv)
-    for p in plots:
-        logging.info("Saved: %s", p)
+    results = run_batch(images, cfg, out_dir, jobs=args.jobs, cache=cache,
+                        state=args.save_state, **run_options)
+    if args.profile:
+        totals = {}
+        for r in results:
+            for name, seconds in r.get('stages', {}).items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        print(format_stages(totals))
+    if any(r['status'] == 'interrupted' for r in results):
+        logging.warning("Batch interrupted; re-run with --resume to continue")
+        raise SystemExit(130)
+    failed = [r for r in results if r['status'] != 'ok']
+    if failed:
+        logging.error("%d of %d images failed; see %s", len(failed), len(results),
+                      out_dir / 'manifest.jsonl')
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
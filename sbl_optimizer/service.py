@@ -0,0 +1,721 @@
+"""
+Local optimization service backed by a pool of warm worker processes.
+
+The server speaks HTTP on a localhost port or on a Unix socket. Its worker
+processes are started once; each imports everything and runs a tiny
+optimization before it takes jobs, so a request pays neither the import
+time nor the first-call costs of a CLI run. The pattern and the plots of a
+job are rendered into memory and served from there; nothing is written to
+the working directory.
+
+Endpoints (JSON unless noted):
+    POST   /jobs                    Submit {"image": base64, "name": str,
+                                    "config": {field: value}, "plots": str,
+                                    "pattern_format": str, "tile_rows": int}.
+                                    202 with the job, 503 if the queue is full.
+    GET    /jobs                    All jobs.
+    GET    /jobs/<id>               One job with its latest progress.
+    GET    /jobs/<id>/events        Progress records as JSON Lines, streamed
+                                    until the job ends.
+    GET    /jobs/<id>/files/<name>  An output file (PDF, TIFF or PNG).
+    DELETE /jobs/<id>               Cancel a queued or running job, or drop a
+                                    finished one with its results.
+    GET    /health                  Workers, queue and job counts.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import base64
+import binascii
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import socketserver
+import stat
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, fields, replace
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+from .cache import ResultCache
+from .config import Config
+from .io import PATTERN_FORMATS, PLOT_BACKENDS, save_pattern, save_plots
+from .telemetry import Profiler
+from .utils import ImageContext
+
+
+# Address the server binds to when none is given
+DEFAULT_ADDRESS = '127.0.0.1:8765'
+
+# Largest request body accepted (the image is sent base64-encoded)
+MAX_REQUEST_BYTES = 64 * 2**20
+
+# Seconds between checks for worker processes that died
+WATCH_INTERVAL = 1.0
+
+# Content types of the output files
+CONTENT_TYPES = {'.pdf': 'application/pdf', '.tif': 'image/tiff', '.png': 'image/png'}
+
+# Job states; a job in a final state never changes again
+FINAL_STATES = ('done', 'error', 'cancelled')
+
+
+class QueueFull(Exception):
+    """
+    Raised by OptimizationService.submit() when the queue is full.
+    """
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a worker to stop the job it is running.
+    """
+
+
+@dataclass
+class Job:
+    """
+    One optimization request and, once finished, its results.
+    """
+    # Unique identifier
+    id: str
+    # Base name of the output files
+    name: str
+    # 'queued', 'running', 'done', 'error' or 'cancelled'
+    status: str = 'queued'
+    # Wall-clock times (time.time()) of submission, start and end
+    submitted: float = 0.0
+    started: float = None
+    finished: float = None
+    # Progress records (iteration, outlier_pct, elapsed, ...) so far
+    events: list = field(default_factory=list)
+    # Summary of a finished job (iterations, outlier %, file names, ...)
+    summary: dict = None
+    # Error message of a failed job
+    error: str = None
+    # Output files of a finished job: file name -> contents
+    files: dict = field(default_factory=dict)
+    # Sequence number that identifies the job to the workers
+    seq: int = 0
+    # Request sent to the worker; dropped once the job is dispatched
+    request: dict = field(default=None, repr=False)
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serializable view of the job, without the file contents.
+        """
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': self.events[-1] if self.events else None,
+            'summary': self.summary,
+            'error': self.error,
+            'files': sorted(self.files),
+        }
+
+
+def _warm_up(config: Config, plots: str):
+    """
+    Run a tiny optimization so that imports and first-call costs are paid
+    before the first job.
+    """
+    from .main import optimize_image
+
+    pixels = np.full((64, 64), 255, np.uint8)
+    pixels[16:48, 16:48] = 0
+    image = ImageContext(pixels, dpi=72, name='warmup')
+    cfg = replace(config, resolution=1024, max_iterations=2, multigrid_levels=(), verbose=0)
+    mask, T_best, H_best, errors, max_heat, _ = optimize_image(image, cfg)
+    buffers = {}
+    save_pattern(image, H_best, max_heat, buffers=buffers)
+    save_plots(T_best, *image.dims[2:], image, backend=plots, buffers=buffers)
+
+
+def _run_job(seq: int, request: dict, config: Config, cache: ResultCache, cancel, events):
+    """
+    Optimize one image in a worker process and render its outputs into memory.
+
+    Args:
+        seq: Sequence number of the job.
+        request: Job request (see OptimizationService.submit()).
+        config: Base configuration of the service.
+        cache: Result cache, or None.
+        cancel: Shared value; the job stops when it holds seq.
+        events: Queue that receives the progress records.
+
+    Returns:
+        Tuple of (summary, files).
+    """
+    from .main import optimize_image
+
+    start = time.perf_counter()
+
+    def progress(record):
+        if cancel.value == seq:
+            raise JobCancelled()
+        if record.get('event') == 'iteration':
+            events.put(('progress', seq, {k: v for k, v in record.items() if k != 'stages'}))
+
+    cfg = replace(config, **request['config'])
+    image = ImageContext(request['image'], name=request['name'])
+    phys_w, phys_h = image.dims[2:]
+    profiler = Profiler(callback=progress)
+    metrics = []
+    mask, T_best, H_best, errors, max_heat, cached = optimize_image(
+        image, cfg, cache, metrics=metrics, profiler=profiler)
+    if cancel.value == seq:
+        raise JobCancelled()
+
+    buffers = {}
+    save_pattern(image, H_best, max_heat, tile_rows=request['tile_rows'],
+                 file_format=request['pattern_format'], buffers=buffers)
+    save_plots(T_best, phys_w, phys_h, image, backend=request['plots'], buffers=buffers)
+    files = {name: buf.getvalue() for name, buf in buffers.items()}
+    summary = {
+        'iterations': len(errors),
+        'outlier_pct': errors[-1] * 100 / mask.size,
+        'best_outlier_pct': min(errors) * 100 / mask.size,
+        'final_metrics': metrics[-1] if metrics else None,
+        'cached': cached,
+        'stages': dict(profiler.totals),
+        'wall_time': time.perf_counter() - start,
+    }
+    return summary, files
+
+
+def _worker_main(index: int, config: Config, cache: ResultCache, plots: str,
+                 events, inbox, cancel):
+    """
+    Loop of a worker process: warm up, then run jobs from inbox until None.
+
+    Every message to the service is a tuple starting with its kind and the
+    worker index or job sequence number.
+    """
+    from .main import configure_main_logging
+
+    # Ctrl-C reaches the whole process group; the service shuts workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_main_logging(config.verbose)
+    _warm_up(config, plots)
+    events.put(('ready', index))
+    while True:
+        task = inbox.get()
+        if task is None:
+            return
+        seq, request = task
+        events.put(('started', seq))
+        try:
+            summary, files = _run_job(seq, request, config, cache, cancel, events)
+        except JobCancelled:
+            events.put(('cancelled', seq))
+        except Exception as e:
+            logging.exception("Job %s failed", request['name'])
+            events.put(('error', seq, f"{type(e).__name__}: {e}"))
+        else:
+            events.put(('done', seq, summary, files))
+
+
+class _Worker:
+    """
+    Handle of one worker process.
+    """
+
+    def __init__(self, index: int, ctx, args):
+        self.index = index
+        self.inbox = ctx.Queue()
+        self.cancel = ctx.Value('q', 0, lock=False)
+        self.process = ctx.Process(target=_worker_main, daemon=True, name=f'sbl-worker-{index}',
+                                   args=(index,) + args + (self.inbox, self.cancel))
+        self.process.start()
+        self.ready = False
+        self.job = None
+
+
+class OptimizationService:
+    """
+    Queue of optimization jobs run by a pool of warm worker processes.
+
+    At most `workers` jobs run at a time, one per worker process; at most
+    `queue_size` more wait in the queue, and submit() refuses new jobs
+    beyond that (backpressure). Finished jobs keep their results in memory
+    until they are dropped, or until more than `keep` jobs have finished,
+    when the oldest are dropped.
+    """
+
+    def __init__(self, config: Config, workers: int = 1, queue_size: int = 16, keep: int = 64,
+                 cache: ResultCache = None, plots: str = 'fast', pattern_format: str = 'pdf',
+                 tile_rows: int = 0):
+        """
+        Args:
+            config: Base configuration; jobs override some of its fields.
+            workers: Number of worker processes (maximum concurrent jobs).
+            queue_size: Maximum number of jobs waiting for a worker.
+            keep: Maximum number of finished jobs kept in memory.
+            cache: Result cache shared by the workers.
+            plots: Default plot backend of a job.
+            pattern_format: Default file format of the pattern of a job.
+            tile_rows: Default rows per page of the pattern of a job.
+        """
+        self.config = config
+        self.queue_size = queue_size
+        self.keep = keep
+        self.defaults = {'plots': plots, 'pattern_format': pattern_format, 'tile_rows': tile_rows}
+        self._ctx = multiprocessing.get_context('spawn')
+        self._events = self._ctx.Queue()
+        self._args = (config, cache, plots, self._events)
+        self._workers = [self._start_worker(i) for i in range(max(workers, 1))]
+        self._jobs = OrderedDict()
+        self._by_seq = {}
+        self._pending = deque()
+        self._seq = 0
+        self._changed = threading.Condition()
+        self._closed = False
+        self._listener = threading.Thread(target=self._listen, name='sbl-service', daemon=True)
+        self._listener.start()
+
+    def _start_worker(self, index: int) -> _Worker:
+        return _Worker(index, self._ctx, self._args)
+
+    def submit(self, image: bytes, name: str = 'image', overrides: dict = None,
+               plots: str = None, pattern_format: str = None, tile_rows: int = None) -> Job:
+        """
+        Queue an image for optimization.
+
+        Args:
+            image: Encoded image (any format PIL reads).
+            name: Base name of the output files.
+            overrides: Config fields that differ from the base configuration.
+            plots: Plot backend (default: the service's).
+            pattern_format: File format of the pattern (default: the service's).
+            tile_rows: Rows per page of the pattern (default: the service's).
+
+        Returns:
+            The new job.
+
+        Raises:
+            ValueError: If an override or option is invalid.
+            QueueFull: If queue_size jobs are already waiting.
+        """
+        overrides = dict(overrides or {})
+        known = {f.name for f in fields(Config)}
+        unknown = set(overrides) - known
+        if unknown:
+            raise ValueError(f"Unknown config fields: {', '.join(sorted(unknown))}")
+        request = dict(self.defaults)
+        request.update((k, v) for k, v in (('plots', plots), ('pattern_format', pattern_format),
+                                            ('tile_rows', tile_rows)) if v is not None)
+        if request['plots'] not in PLOT_BACKENDS:
+            raise ValueError(f"Unknown plot backend: {request['plots']!r}")
+        if request['pattern_format'] not in PATTERN_FORMATS:
+            raise ValueError(f"Unknown pattern format: {request['pattern_format']!r}")
+        request.update(image=bytes(image), name=Path(name).stem or 'image', config=overrides)
+
+        with self._changed:
+            if self._closed:
+                raise QueueFull("The service is shutting down")
+            if len(self._pending) >= self.queue_size:
+                raise QueueFull(f"{len(self._pending)} jobs are waiting; try again later")
+            self._seq += 1
+            job = Job(uuid.uuid4().hex, request['name'], submitted=time.time(), seq=self._seq,
+                      request=request)
+            self._jobs[job.id] = job
+            self._by_seq[job.seq] = job
+            self._pending.append(job)
+            self._dispatch()
+            self._changed.notify_all()
+        return job
+
+    def job(self, job_id: str) -> Job:
+        """
+        Look up a job by its identifier (KeyError if unknown).
+        """
+        with self._changed:
+            return self._jobs[job_id]
+
+    def jobs(self):
+        """
+        All jobs, oldest first.
+        """
+        with self._changed:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Job:
+        """
+        Cancel a queued or running job, or drop a finished one.
+
+        A running job stops at its next iteration. A finished job is removed
+        together with its results.
+
+        Returns:
+            The job.
+
+        Raises:
+            KeyError: If the job is unknown.
+        """
+        with self._changed:
+            job = self._jobs[job_id]
+            if job.status == 'queued':
+                self._pending.remove(job)
+                self._finish(job, 'cancelled')
+            elif job.status == 'running':
+                for worker in self._workers:
+                    if worker.job is job:
+                        worker.cancel.value = job.seq
+            else:
+                self._forget(job)
+            self._changed.notify_all()
+            return job
+
+    def stats(self) -> dict:
+        """
+        Numbers of workers and of jobs by state.
+        """
+        with self._changed:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {
+                'workers': len(self._workers),
+                'ready_workers': sum(w.ready for w in self._workers),
+                'queue_size': self.queue_size,
+                'queued': len(self._pending),
+                'jobs': counts,
+            }
+
+    def wait(self, job: Job, after: int = 0, timeout: float = None):
+        """
+        Wait until a job has more than `after` progress records or has ended.
+
+        Returns:
+            Tuple of (new progress records, whether the job has ended).
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(job.events) > after or job.status in FINAL_STATES or self._closed,
+                timeout)
+            return job.events[after:], job.status in FINAL_STATES or self._closed
+
+    def close(self):
+        """
+        Cancel all jobs and stop the worker processes.
+        """
+        with self._changed:
+            self._closed = True
+            for job in list(self._pending):
+                self._finish(job, 'cancelled')
+            self._pending.clear()
+            for worker in self._workers:
+                if worker.job is not None:
+                    worker.cancel.value = worker.job.seq
+                worker.inbox.put(None)
+            self._changed.notify_all()
+        for worker in self._workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._events.put(None)
+        self._listener.join()
+
+    def _dispatch(self):
+        """
+        Hand queued jobs to idle workers (lock held).
+        """
+        for worker in self._workers:
+            if not self._pending:
+                return
+            if worker.ready and worker.job is None:
+                job = self._pending.popleft()
+                worker.job = job
+                job.status = 'running'
+                job.started = time.time()
+                worker.inbox.put((job.seq, job.request))
+                job.request = None
+
+    def _finish(self, job: Job, status: str, error: str = None):
+        """
+        Put a job into a final state and drop old results (lock held).
+        """
+        job.status = status
+        job.error = error
+        job.finished = time.time()
+        job.request = None
+        finished = [j for j in self._jobs.values() if j.status in FINAL_STATES]
+        for old in finished[:max(len(finished) - self.keep, 0)]:
+            self._forget(old)
+
+    def _forget(self, job: Job):
+        """
+        Remove a finished job and its results (lock held).
+        """
+        self._jobs.pop(job.id, None)
+        self._by_seq.pop(job.seq, None)
+
+    def _listen(self):
+        """
+        Apply the messages of the workers and restart workers that died.
+        """
+        while True:
+            try:
+                message = self._events.get(timeout=WATCH_INTERVAL)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            with self._changed:
+                if message:
+                    self._apply(message)
+                if not self._closed:
+                    self._watch()
+                self._dispatch()
+                self._changed.notify_all()
+
+    def _apply(self, message):
+        """
+        Update the state after one message of a worker (lock held).
+        """
+        kind, key = message[:2]
+        if kind == 'ready':
+            self._workers[key].ready = True
+            return
+        job = self._by_seq.get(key)
+        if kind == 'started' or job is None:
+            return
+        if kind == 'progress':
+            job.events.append(message[2])
+            return
+
+        for worker in self._workers:
+            if worker.job is job:
+                worker.job = None
+        if kind == 'done':
+            job.summary, job.files = message[2], message[3]
+            job.summary['files'] = sorted(job.files)
+            self._finish(job, 'done')
+        elif kind == 'error':
+            self._finish(job, 'error', message[2])
+        else:
+            self._finish(job, 'cancelled')
+
+    def _watch(self):
+        """
+        Replace worker processes that died, failing the job they ran (lock held).
+        """
+        for i, worker in enumerate(self._workers):
+            if worker.process.is_alive():
+                continue
+            logging.error("Worker %d exited with code %s; restarting it", i, worker.process.exitcode)
+            if worker.job is not None:
+                self._finish(worker.job, 'error', "Worker process exited unexpectedly")
+            self._workers[i] = self._start_worker(i)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    HTTP front end of an OptimizationService (server.service).
+    """
+
+    server_version = 'sbl-optimizer'
+
+    def address_string(self):
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def log_message(self, format, *args):
+        logging.info("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str):
+        self._send_json(status, {'error': message})
+
+    def _route(self):
+        """
+        Split the path into (job, rest) for /jobs/<id>/..., else (None, parts).
+        """
+        parts = [p for p in self.path.split('?', 1)[0].split('/') if p]
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            try:
+                return self.server.service.job(parts[1]), parts[2:]
+            except KeyError:
+                return None, None
+        return None, parts
+
+    def do_GET(self):
+        service = self.server.service
+        job, rest = self._route()
+        if rest is None:
+            return self._error(HTTPStatus.NOT_FOUND, "Unknown job")
+        if job is None:
+            if rest == ['health']:
+                return self._send_json(HTTPStatus.OK, service.stats())
+            if rest == ['jobs']:
+                return self._send_json(HTTPStatus.OK, [j.to_dict() for j in service.jobs()])
+            return self._error(HTTPStatus.NOT_FOUND, "Unknown path")
+        if not rest:
+            return self._send_json(HTTPStatus.OK, job.to_dict())
+        if rest == ['events']:
+            return self._stream(job)
+        if len(rest) == 2 and rest[0] == 'files':
+            data = job.files.get(rest[1])
+            if data is None:
+                return self._error(HTTPStatus.NOT_FOUND, "Unknown file")
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type',
+                             CONTENT_TYPES.get(Path(rest[1]).suffix, 'application/octet-stream'))
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        return self._error(HTTPStatus.NOT_FOUND, "Unknown path")
+
+    def _stream(self, job: Job):
+        """
+        Send the progress records of a job as JSON Lines until it ends.
+        """
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        sent = 0
+        ended = False
+        try:
+            while not ended:
+                records, ended = self.server.service.wait(job, sent, timeout=WATCH_INTERVAL * 15)
+                for record in records:
+                    self.wfile.write((json.dumps(record) + '\n').encode())
+                sent += len(records)
+                self.wfile.flush()
+            final = job.to_dict()
+            self.wfile.write((json.dumps({'event': job.status, 'job': final}) + '\n').encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_POST(self):
+        if self._route()[1] != ['jobs']:
+            return self._error(HTTPStatus.NOT_FOUND, "Unknown path")
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_REQUEST_BYTES:
+            return self._error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request too large")
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+            image = base64.b64decode(body['image'], validate=True)
+            job = self.server.service.submit(
+                image, body.get('name', 'image'), body.get('config'), plots=body.get('plots'),
+                pattern_format=body.get('pattern_format'), tile_rows=body.get('tile_rows'))
+        except QueueFull as e:
+            self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+            data = json.dumps({'error': str(e)}).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Retry-After', '5')
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        except KeyError:
+            return self._error(HTTPStatus.BAD_REQUEST, "Missing field: image")
+        except (ValueError, TypeError, binascii.Error) as e:
+            return self._error(HTTPStatus.BAD_REQUEST, str(e))
+        self._send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def do_DELETE(self):
+        job, rest = self._route()
+        if job is None or rest:
+            return self._error(HTTPStatus.NOT_FOUND, "Unknown job")
+        self._send_json(HTTPStatus.OK, self.server.service.cancel(job.id).to_dict())
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Threaded HTTP server on a Unix socket.
+    """
+    daemon_threads = True
+
+
+def _remove_socket(path: Path):
+    """
+    Delete a Unix socket file left behind by an earlier server.
+
+    Raises:
+        FileExistsError: If path exists and is not a socket.
+    """
+    try:
+        mode = path.lstat().st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    path.unlink(missing_ok=True)
+
+
+def make_server(service: OptimizationService, address: str = DEFAULT_ADDRESS):
+    """
+    Create the HTTP server of a service.
+
+    Args:
+        service: Service that runs the jobs.
+        address: 'host:port', a port on localhost, or 'unix:<path>'.
+
+    Returns:
+        A socketserver.BaseServer; call serve_forever() to handle requests.
+
+    Raises:
+        FileExistsError: If a Unix socket path is taken by something other
+            than a socket.
+    """
+    if address.startswith('unix:'):
+        path = Path(address[len('unix:'):])
+        _remove_socket(path)
+        server = _UnixHTTPServer(str(path), _Handler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), _Handler)
+        server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(config: Config, address: str = DEFAULT_ADDRESS, **options):
+    """
+    Run the service until SIGINT or SIGTERM.
+
+    Args:
+        config: Base configuration.
+        address: See make_server().
+        **options: Passed to OptimizationService.
+    """
+    service = OptimizationService(config, **options)
+    try:
+        server = make_server(service, address)
+    except BaseException:
+        service.close()
+        raise
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logging.warning("Serving on %s with %d workers", address, len(service._workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if address.startswith('unix:'):
+            _remove_socket(Path(address[len('unix:'):]))
@@ -0,0 +1,1079 @@
+"""
+Preallocated time-stepping engines for the heat diffusion simulation.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .config import Config
+
+
+class ExplicitStepper:
+    """
+    Explicit (FTCS) time stepper with ping-pong buffers.
+
+    Combines the diffusion stencil of optimize() with apply_heat_losses() and
+    add_heat() into one update. Everything that stays fixed while H is fixed
+    (stencil coefficients, E * sigma * A * dt, H / hc_paper) is computed once
+    in set_heat(), so a time step performs no new array allocations.
+
+    All buffers use config.dtype. In float32, (T + 273.15)^4 stays far from
+    overflow, the radiative term enters as a difference from its ambient
+    part (folded into the source), and each step adds increments of well
+    above the float32 resolution of T, so rounding errors do not build up:
+    on the sample image the final field stays within 0.002 °C of float64.
+    """
+
+    def __init__(self, shape, dx: float, dy: float, dt: float,
+                 hc_paper: float, config: Config):
+        """
+        Args:
+            shape: Grid shape (rows, columns).
+            dx, dy: Spatial resolution in meters.
+            dt: Timestep in seconds.
+            hc_paper: Heat capacity per cell in J/K.
+            config: Simulation configuration.
+        """
+        self.shape = tuple(shape)
+        self.config = config
+        dtype = float_dtype(config)
+
+        # Stencil coefficients (dx runs along columns, dy along rows)
+        self.cx = config.alpha * dt / dx**2
+        self.cy = config.alpha * dt / dy**2
+        self.c0 = 1 - 2 * self.cx - 2 * self.cy
+
+        # Loss coefficients per step, already divided by the heat capacity.
+        # The factor 2 accounts for both faces of the sheet as in add_heat().
+        area = dx * dy
+        self.rad_scale = 2 * config.sigma * area * dt / hc_paper
+        self.conv_keep = 1 - 2 * config.h * area * dt / hc_paper
+        self.hc_paper = hc_paper
+
+        # Ping-pong temperature buffers and scratch space
+        self._T = np.empty(self.shape, dtype)
+        self._Tn = np.empty(self.shape, dtype)
+        self._tmp = np.empty(self.shape, dtype)
+        self._lap = np.empty((self.shape[0] - 2, self.shape[1] - 2), dtype)
+
+        # Per-heat-pattern invariants, filled by set_heat()
+        self._rad = np.empty(self.shape, dtype)
+        self._src = np.empty(self.shape, dtype)
+
+    def set_heat(self, H: np.ndarray, max_heat: float):
+        """
+        Precompute the terms of the update that only depend on H.
+
+        Args:
+            H: Heat input array.
+            max_heat: Maximum applied heat per cell.
+        """
+        cfg = self.config
+        T_amb_abs = cfg.ambient_temperature + 273.15
+
+        # Radiative coefficient: sigma * E * A * dt * 2 / hc_paper
+        np.multiply(H, 0.22 / max_heat, out=self._rad)
+        self._rad += 0.68
+        self._rad *= self.rad_scale
+
+        # Constant source: heat input plus the ambient parts of both losses
+        np.multiply(self._rad, T_amb_abs**4, out=self._src)
+        self._src += H / self.hc_paper
+        self._src += (1 - self.conv_keep) * cfg.ambient_temperature
+
+    def reset(self):
+        """
+        Reset the temperature field to ambient.
+        """
+        self._T.fill(self.config.ambient_temperature)
+
+    def step(self):
+        """
+        Advance the temperature field by one timestep.
+        """
+        self._diffuse()
+        self._apply_losses()
+
+    def _diffuse(self):
+        """
+        Write the diffusion stencil of the current field into the spare buffer.
+        """
+        T, Tn, lap = self._Tn, self._T, self._lap
+
+        # Diffusion stencil on the interior; edges carry over unchanged.
+        # Leading axes (members of an EnsembleStepper) are passed through.
+        c = Tn[..., 1:-1, 1:-1]
+        np.multiply(c, self.c0, out=T[..., 1:-1, 1:-1])
+        np.add(Tn[..., 1:-1, 2:], Tn[..., 1:-1, :-2], out=lap)
+        lap *= self.cx
+        T[..., 1:-1, 1:-1] += lap
+        np.add(Tn[..., 2:, 1:-1], Tn[..., :-2, 1:-1], out=lap)
+        lap *= self.cy
+        T[..., 1:-1, 1:-1] += lap
+        T[..., 0, :] = Tn[..., 0, :]
+        T[..., -1, :] = Tn[..., -1, :]
+        T[..., 1:-1, 0] = Tn[..., 1:-1, 0]
+        T[..., 1:-1, -1] = Tn[..., 1:-1, -1]
+
+    def _apply_losses(self):
+        """
+        Apply heat input and losses to the diffused field and make it current.
+        """
+        T, tmp = self._Tn, self._tmp
+
+        # Radiative loss term E * sigma * (T + 273.15)^4, pre-scaled
+        np.add(T, 273.15, out=tmp)
+        np.square(tmp, out=tmp)
+        np.square(tmp, out=tmp)
+        tmp *= self._rad
+
+        # Convective loss, heat input and radiative loss
+        T *= self.conv_keep
+        T += self._src
+        T -= tmp
+
+        self._T, self._Tn = T, self._T
+
+    @property
+    def phases(self):
+        """
+        (stage name, method) pairs that make up one step, for profiling.
+        """
+        return (('diffusion', self._diffuse), ('heat_losses', self._apply_losses))
+
+    def run(self, nt: int, profiler=None) -> np.ndarray:
+        """
+        Simulate nt timesteps starting from ambient temperature.
+
+        Args:
+            nt: Number of timesteps.
+            profiler: Profiler that receives the time spent in each phase.
+
+        Returns:
+            Temperature field in °C. The array is owned by the stepper and is
+            overwritten by the next call to run(); copy it to keep it.
+        """
+        self.reset()
+        if profiler is not None:
+            _run_profiled(self, nt, profiler)
+            return self._T
+        for _ in range(nt):
+            self.step()
+        return self._T
+
+
+class BandedStepper(ExplicitStepper):
+    """
+    Explicit time stepper that splits the grid into row bands across threads.
+
+    Each band runs the stencil, the losses and the heat input of its own
+    rows; the rows just outside the band are read from the shared previous
+    field as halos. A barrier after every step keeps the bands in lockstep,
+    so no band overwrites a row its neighbour still has to read. Every cell
+    goes through the same operations as in ExplicitStepper, so results are
+    bitwise identical. NumPy releases the GIL inside the array operations,
+    so the bands run in parallel.
+
+    The calling thread runs the first band; the other bands run on a thread
+    pool that is created once and reused by every run().
+    """
+
+    # Bands narrower than this are not worth a thread of their own
+    MIN_BAND_ROWS = 16
+
+    def __init__(self, shape, dx: float, dy: float, dt: float,
+                 hc_paper: float, config: Config, threads: int = 2):
+        """
+        Args:
+            shape: Grid shape (rows, columns).
+            dx, dy: Spatial resolution in meters.
+            dt: Timestep in seconds.
+            hc_paper: Heat capacity per cell in J/K.
+            config: Simulation configuration.
+            threads: Number of bands (and threads, including the caller's).
+        """
+        super().__init__(shape, dx, dy, dt, hc_paper, config)
+        rows = self.shape[0]
+        n = max(1, min(threads, rows // self.MIN_BAND_ROWS))
+        edges = [rows * k // n for k in range(n + 1)]
+        self.bands = list(zip(edges[:-1], edges[1:]))
+
+        # One stencil scratch array per band
+        dtype = self._T.dtype
+        self._band_lap = [np.empty((b - a, self.shape[1] - 2), dtype) for a, b in self.bands]
+        self._pool = ThreadPoolExecutor(n - 1, thread_name_prefix='sbl-band') if n > 1 else None
+
+    def close(self):
+        """
+        Shut down the worker threads.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _band_step(self, k: int, T: np.ndarray, Tn: np.ndarray):
+        """
+        Advance the rows of band k from Tn to T by one timestep.
+        """
+        a, b = self.bands[k]
+        n_rows = self.shape[0]
+
+        # Diffusion stencil on the interior rows of the band
+        i0, i1 = max(a, 1), min(b, n_rows - 1)
+        if i0 < i1:
+            lap = self._band_lap[k][:i1 - i0]
+            out = T[i0:i1, 1:-1]
+            np.multiply(Tn[i0:i1, 1:-1], self.c0, out=out)
+            np.add(Tn[i0:i1, 2:], Tn[i0:i1, :-2], out=lap)
+            lap *= self.cx
+            out += lap
+            np.add(Tn[i0 + 1:i1 + 1, 1:-1], Tn[i0 - 1:i1 - 1, 1:-1], out=lap)
+            lap *= self.cy
+            out += lap
+            T[i0:i1, 0] = Tn[i0:i1, 0]
+            T[i0:i1, -1] = Tn[i0:i1, -1]
+        if a == 0:
+            T[0, :] = Tn[0, :]
+        if b == n_rows:
+            T[-1, :] = Tn[-1, :]
+
+        # Radiative loss, convective loss and heat input, as in _apply_losses()
+        Tb, tmp = T[a:b], self._tmp[a:b]
+        np.add(Tb, 273.15, out=tmp)
+        np.square(tmp, out=tmp)
+        np.square(tmp, out=tmp)
+        tmp *= self._rad[a:b]
+        Tb *= self.conv_keep
+        Tb += self._src[a:b]
+        Tb -= tmp
+
+    def _band_run(self, k: int, nt: int, barrier: threading.Barrier):
+        """
+        Take nt steps of band k, waiting for all bands after each step.
+        """
+        bufs = (self._T, self._Tn)
+        try:
+            for it in range(nt):
+                self._band_step(k, bufs[(it + 1) % 2], bufs[it % 2])
+                barrier.wait()
+        except BaseException:
+            barrier.abort()
+            raise
+
+    def _advance(self, nt: int):
+        """
+        Take nt steps on all bands and leave the result in self._T.
+        """
+        if nt <= 0:
+            return
+        barrier = threading.Barrier(len(self.bands))
+        futures = [self._pool.submit(self._band_run, k, nt, barrier)
+                   for k in range(1, len(self.bands))] if self._pool else []
+        try:
+            self._band_run(0, nt, barrier)
+        finally:
+            for future in futures:
+                future.result()
+        if nt % 2:
+            self._T, self._Tn = self._Tn, self._T
+
+    def step(self):
+        """
+        Advance the temperature field by one timestep.
+        """
+        self._advance(1)
+
+    def run(self, nt: int, profiler=None) -> np.ndarray:
+        """
+        Simulate nt timesteps starting from ambient temperature.
+
+        Args:
+            nt: Number of timesteps.
+            profiler: Profiler that receives the time of the banded steps
+                (stage 'banded_step'; diffusion and losses are not split).
+
+        Returns:
+            Temperature field in °C. The array is owned by the stepper and is
+            overwritten by the next call to run(); copy it to keep it.
+        """
+        self.reset()
+        if profiler is None:
+            self._advance(nt)
+        else:
+            with profiler.stage('banded_step'):
+                self._advance(nt)
+        return self._T
+
+
+class EnsembleStepper(ExplicitStepper):
+    """
+    Explicit time stepper that advances K temperature fields at once.
+
+    The fields are stacked along a leading axis and every array operation of
+    a step covers all members, so the Python overhead of a step is paid once
+    for the whole ensemble. Each member has its own configuration; the
+    per-member constants (stencil, loss and ambient terms) are (K, 1, 1)
+    arrays broadcast over the grid. They are computed in float64 and cast to
+    config.dtype, as Python scalars are in ExplicitStepper, so a member
+    evolves bitwise exactly as it would in an ExplicitStepper of its own.
+    All members share the grid, the timestep and the dtype.
+    """
+
+    def __init__(self, shape, dx: float, dy: float, dt: float,
+                 hc_paper, configs):
+        """
+        Args:
+            shape: Grid shape (rows, columns) of each member.
+            dx, dy: Spatial resolution in meters.
+            dt: Timestep in seconds.
+            hc_paper: Heat capacity per cell in J/K, one value or one per member.
+            configs: Simulation configuration of each member.
+        """
+        self.shape = tuple(shape)
+        self.configs = list(configs)
+        self.config = self.configs[0]
+        k = len(self.configs)
+        dtype = float_dtype(self.config)
+        if any(float_dtype(cfg) != dtype for cfg in self.configs):
+            raise ValueError("All members of an ensemble must use the same dtype")
+        self.dtype = dtype
+
+        def member(values):
+            return np.asarray(np.broadcast_to(values, k), dtype=float).reshape(k, 1, 1)
+
+        # Per-member constants in float64, as ExplicitStepper computes them
+        alpha = member([cfg.alpha for cfg in self.configs])
+        hc = member(hc_paper)
+        cx = alpha * dt / dx**2
+        cy = alpha * dt / dy**2
+        area = dx * dy
+        self._conv_keep64 = 1 - 2 * member([cfg.h for cfg in self.configs]) * area * dt / hc
+        self._ambient64 = member([cfg.ambient_temperature for cfg in self.configs])
+
+        # ... and in the working precision for the array operations
+        self.cx = cx.astype(dtype)
+        self.cy = cy.astype(dtype)
+        self.c0 = (1 - 2 * cx - 2 * cy).astype(dtype)
+        self.rad_scale = (2 * member([cfg.sigma for cfg in self.configs]) * area * dt / hc).astype(dtype)
+        self.conv_keep = self._conv_keep64.astype(dtype)
+        self.hc_paper = hc.astype(dtype)
+        self.ambient = self._ambient64.astype(dtype)
+
+        full = (k,) + self.shape
+        self._T = np.empty(full, dtype)
+        self._Tn = np.empty(full, dtype)
+        self._tmp = np.empty(full, dtype)
+        self._lap = np.empty((k, self.shape[0] - 2, self.shape[1] - 2), dtype)
+        self._rad = np.empty(full, dtype)
+        self._src = np.empty(full, dtype)
+
+    def set_heat(self, H: np.ndarray, max_heat):
+        """
+        Precompute the terms of the update that only depend on H.
+
+        Args:
+            H: Heat input arrays (K, rows, columns), or one array shared by
+                all members.
+            max_heat: Maximum applied heat per cell, one value or one per member.
+        """
+        k = len(self.configs)
+        max_heat = np.asarray(np.broadcast_to(max_heat, k), dtype=float).reshape(k, 1, 1)
+        T_amb_abs = self._ambient64 + 273.15
+
+        np.multiply(H, (0.22 / max_heat).astype(self.dtype), out=self._rad)
+        self._rad += 0.68
+        self._rad *= self.rad_scale
+
+        np.multiply(self._rad, (T_amb_abs**4).astype(self.dtype), out=self._src)
+        self._src += H / self.hc_paper
+        self._src += ((1 - self._conv_keep64) * self._ambient64).astype(self.dtype)
+
+    def reset(self):
+        """
+        Reset every member to its ambient temperature.
+        """
+        self._T[...] = self.ambient
+
+
+def _thomas_factors(n: int, r: float):
+    """
+    Precompute the forward-elimination factors of a tridiagonal system.
+
+    The system is (I - r/2 * D2) x = d along a line of n cells, where D2 is
+    the second-difference operator. The first and last rows are identity
+    rows so that edge cells are left untouched, as in the explicit scheme.
+
+    Args:
+        n: Number of cells along the line.
+        r: Diffusion number alpha * dt / dx².
+
+    Returns:
+        Tuple of (sub, c_prime, inv_denom) arrays of length n.
+    """
+    sub = np.full(n, -r / 2)
+    diag = np.full(n, 1 + r)
+    sup = np.full(n, -r / 2)
+    sub[0] = sup[0] = 0.0
+    sub[-1] = sup[-1] = 0.0
+    diag[0] = diag[-1] = 1.0
+
+    c_prime = np.zeros(n)
+    inv_denom = np.zeros(n)
+    inv_denom[0] = 1 / diag[0]
+    c_prime[0] = sup[0] * inv_denom[0]
+    for j in range(1, n):
+        inv_denom[j] = 1 / (diag[j] - sub[j] * c_prime[j - 1])
+        c_prime[j] = sup[j] * inv_denom[j]
+    return sub, c_prime, inv_denom
+
+
+def _thomas_solve(d: np.ndarray, sub, c_prime, inv_denom):
+    """
+    Solve a batch of tridiagonal systems along axis 0, in-place.
+
+    Args:
+        d: Right-hand sides; each column is one system (overwritten with x).
+        sub, c_prime, inv_denom: Factors from _thomas_factors().
+    """
+    n = d.shape[0]
+    d[0] *= inv_denom[0]
+    for j in range(1, n):
+        d[j] -= sub[j] * d[j - 1]
+        d[j] *= inv_denom[j]
+    for j in range(n - 2, -1, -1):
+        d[j] -= c_prime[j] * d[j + 1]
+
+
+class ADIStepper:
+    """
+    Implicit Peaceman–Rachford ADI time stepper.
+
+    Each timestep takes two half steps, each implicit along one axis
+    (solved with vectorized Thomas sweeps) and explicit along the other, so
+    diffusion stays stable for any dt. Heat input and radiative/convective
+    losses are applied by Strang splitting (half a step before and after the
+    diffusion), with T^4 linearized around the current temperature so that
+    the loss update is stable as well. Edge cells do not diffuse, matching
+    ExplicitStepper.
+    """
+
+    def __init__(self, shape, dx: float, dy: float, dt: float,
+                 hc_paper: float, config: Config):
+        """
+        Args:
+            shape: Grid shape (rows, columns).
+            dx, dy: Spatial resolution in meters.
+            dt: Timestep in seconds.
+            hc_paper: Heat capacity per cell in J/K.
+            config: Simulation configuration.
+        """
+        self.shape = tuple(shape)
+        self.config = config
+        self.rx = config.alpha * dt / dx**2
+        self.ry = config.alpha * dt / dy**2
+        dtype = float_dtype(config)
+
+        # Factors for implicit solves along columns (x) and rows (y),
+        # computed in float64 and stored in the working precision
+        self._fx = tuple(f.astype(dtype) for f in _thomas_factors(self.shape[1], self.rx))
+        self._fy = tuple(f.astype(dtype) for f in _thomas_factors(self.shape[0], self.ry))
+
+        # Loss coefficients per half step (both faces of the sheet)
+        area = dx * dy
+        self.rad_scale = config.sigma * area * dt / hc_paper
+        self.k_conv = config.h * area * dt / hc_paper
+        self.hc_paper = hc_paper
+
+        self._T = np.empty(self.shape, dtype)
+        self._half = np.empty(self.shape, dtype)
+        self._halfT = np.empty(self.shape[::-1], dtype)
+        self._tmp = np.empty(self.shape, dtype)
+        self._tmp2 = np.empty(self.shape, dtype)
+        self._lap = np.empty((self.shape[0] - 2, self.shape[1] - 2), dtype)
+        self._rad = np.empty(self.shape, dtype)
+        self._src = np.empty(self.shape, dtype)
+
+    def set_heat(self, H: np.ndarray, max_heat: float):
+        """
+        Precompute the terms of the update that only depend on H.
+
+        Args:
+            H: Heat input array.
+            max_heat: Maximum applied heat per cell.
+        """
+        cfg = self.config
+        T_amb_abs = cfg.ambient_temperature + 273.15
+
+        np.multiply(H, 0.22 / max_heat, out=self._rad)
+        self._rad += 0.68
+        self._rad *= self.rad_scale
+
+        # H is the heat of a full step; each half step applies half of it
+        np.multiply(self._rad, T_amb_abs**4, out=self._src)
+        self._src += H / (2 * self.hc_paper)
+        self._src += self.k_conv * T_amb_abs
+
+    def reset(self):
+        """
+        Reset the temperature field to ambient.
+        """
+        self._T.fill(self.config.ambient_temperature)
+
+    def _explicit_half(self, out: np.ndarray, T: np.ndarray, r: float, axis: int):
+        """
+        Write (I + r/2 * D2) T along the given axis into out (interior only).
+        """
+        lap = self._lap
+        np.copyto(out, T)
+        if axis == 0:
+            np.add(T[2:, 1:-1], T[:-2, 1:-1], out=lap)
+        else:
+            np.add(T[1:-1, 2:], T[1:-1, :-2], out=lap)
+        lap *= r / 2
+        out[1:-1, 1:-1] *= 1 - r
+        out[1:-1, 1:-1] += lap
+
+    def _apply_losses(self):
+        """
+        Apply heat input and losses for half a timestep, linearizing T^4
+        around the current T: T' (1 + 4 r T^3 + k) = T + src + 3 r T^4 (in K).
+        """
+        T, tmp, tmp2 = self._T, self._tmp, self._tmp2
+        np.add(T, 273.15, out=tmp)
+        np.multiply(tmp, tmp, out=tmp2)
+        tmp2 *= tmp
+        tmp2 *= self._rad
+        np.multiply(tmp2, 3, out=T)
+        T *= tmp
+        T += tmp
+        T += self._src
+        tmp2 *= 4
+        tmp2 += 1 + self.k_conv
+        T /= tmp2
+        T -= 273.15
+
+    def step(self):
+        """
+        Advance the temperature field by one timestep.
+        """
+        self._apply_losses()
+        self._diffuse()
+        self._apply_losses()
+
+    def _diffuse(self):
+        """
+        Take both ADI half steps of the diffusion.
+        """
+        T, half, halfT = self._T, self._half, self._halfT
+
+        # Half step 1: explicit along rows, implicit along columns
+        self._explicit_half(half, T, self.ry, axis=0)
+        np.copyto(halfT, half.T)
+        _thomas_solve(halfT[:, 1:-1], *self._fx)
+        np.copyto(half, halfT.T)
+
+        # Half step 2: explicit along columns, implicit along rows
+        self._explicit_half(T, half, self.rx, axis=1)
+        _thomas_solve(T[:, 1:-1], *self._fy)
+
+    @property
+    def phases(self):
+        """
+        (stage name, method) pairs that make up one step, for profiling.
+        """
+        return (('heat_losses', self._apply_losses), ('diffusion', self._diffuse),
+                ('heat_losses', self._apply_losses))
+
+    def run(self, nt: int, profiler=None) -> np.ndarray:
+        """
+        Simulate nt timesteps starting from ambient temperature.
+
+        Args:
+            nt: Number of timesteps.
+            profiler: Profiler that receives the time spent in each phase.
+
+        Returns:
+            Temperature field in °C. The array is owned by the stepper and is
+            overwritten by the next call to run(); copy it to keep it.
+        """
+        self.reset()
+        if profiler is not None:
+            _run_profiled(self, nt, profiler)
+            return self._T
+        for _ in range(nt):
+            self.step()
+        return self._T
+
+
+class RegionStepper:
+    """
+    Time stepper that only simulates the active regions of the sheet.
+
+    Each region is a rectangle (e.g. from active_regions()) simulated by its
+    own stepper; everything outside the regions stays at ambient temperature.
+    This is exact when H is zero outside the regions and the regions are
+    padded by enough cells that no heat reaches their edges.
+    """
+
+    def __init__(self, regions, shape, dx: float, dy: float, dt: float,
+                 hc_paper: float, config: Config):
+        """
+        Args:
+            regions: List of (row_slice, column_slice) rectangles.
+            shape: Grid shape (rows, columns) of the full sheet.
+            dx, dy: Spatial resolution in meters.
+            dt: Timestep in seconds.
+            hc_paper: Heat capacity per cell in J/K.
+            config: Simulation configuration.
+        """
+        self.shape = tuple(shape)
+        self.config = config
+        self.regions = [
+            (box, make_stepper((box[0].stop - box[0].start, box[1].stop - box[1].start),
+                               dx, dy, dt, hc_paper, config))
+            for box in regions
+        ]
+        self._T = np.empty(self.shape, float_dtype(config))
+
+    @property
+    def active_cells(self) -> int:
+        """
+        Number of cells that are simulated.
+        """
+        return sum(stepper.shape[0] * stepper.shape[1] for _, stepper in self.regions)
+
+    def set_heat(self, H: np.ndarray, max_heat: float):
+        """
+        Precompute the terms of the update that only depend on H.
+
+        Args:
+            H: Heat input array of the full sheet.
+            max_heat: Maximum applied heat per cell.
+        """
+        for box, stepper in self.regions:
+            stepper.set_heat(H[box], max_heat)
+
+    def run(self, nt: int, profiler=None) -> np.ndarray:
+        """
+        Simulate nt timesteps starting from ambient temperature.
+
+        Args:
+            nt: Number of timesteps.
+            profiler: Profiler that receives the time spent in each phase.
+
+        Returns:
+            Temperature field of the full sheet in °C. The array is owned by
+            the stepper and is overwritten by the next call to run().
+        """
+        self._T.fill(self.config.ambient_temperature)
+        for box, stepper in self.regions:
+            self._T[box] = stepper.run(nt, profiler)
+        return self._T
+
+
+def _area(box) -> int:
+    """
+    Number of cells of a (row_slice, column_slice) rectangle.
+    """
+    return (box[0].stop - box[0].start) * (box[1].stop - box[1].start)
+
+
+def _pack_windows(boxes, shape):
+    """
+    Place windows of a sheet close together on a smaller canvas.
+
+    Edge cells of the sheet do not diffuse, so a window that touches an
+    edge of the sheet has to touch the same edge of the canvas. The canvas
+    is laid out as a frame: windows on the top and bottom edges in a row
+    along the top and bottom of the canvas (corner windows at its ends),
+    windows on the left and right edges stacked along its sides, and all
+    other windows in rows in the middle. Windows that touch opposite edges
+    of the sheet do not fit and are left over.
+
+    Args:
+        boxes: List of non-overlapping (row_slice, column_slice) windows.
+        shape: Shape of the sheet.
+
+    Returns:
+        Tuple of (canvas shape, list of (box, place) of the packed windows,
+        list of left-over boxes), where place is the (row_slice,
+        column_slice) of the window on the canvas.
+    """
+    nx, ny = shape
+    top, bottom, left, right, middle, rest = [], [], [], [], [], []
+    for box in boxes:
+        r, c = box
+        at_top, at_bottom = r.start == 0, r.stop == nx
+        at_left, at_right = c.start == 0, c.stop == ny
+        if (at_top and at_bottom) or (at_left and at_right):
+            rest.append(box)
+        elif at_top or at_bottom:
+            (top if at_top else bottom).append(box)
+        elif at_left or at_right:
+            (left if at_left else right).append(box)
+        else:
+            middle.append(box)
+    for row in (top, bottom):
+        # Corner windows go to the ends of their row
+        row.sort(key=lambda box: (box[1].stop == ny) - (box[1].start == 0))
+
+    def height(box):
+        return box[0].stop - box[0].start
+
+    def width(box):
+        return box[1].stop - box[1].start
+
+    # Rows of middle windows, tallest first
+    middle.sort(key=lambda box: -height(box))
+    middle_w = max([0] + [width(box) for box in middle]
+                   + [math.isqrt(sum(map(_area, middle)))])
+    shelves = []
+    for box in middle:
+        if not shelves or sum(map(width, shelves[-1])) + width(box) > middle_w:
+            shelves.append([])
+        shelves[-1].append(box)
+
+    def extent(sizes):
+        return max([0] + list(sizes))
+
+    left_w = extent(map(width, left))
+    right_w = extent(map(width, right))
+    top_h = extent(map(height, top))
+    bottom_h = extent(map(height, bottom))
+    middle_h = max(sum(map(height, left)), sum(map(height, right)),
+                   sum(height(shelf[0]) for shelf in shelves))
+    canvas_w = max(sum(map(width, top)), sum(map(width, bottom)), left_w + middle_w + right_w)
+    canvas_h = top_h + middle_h + bottom_h
+
+    placed = []
+
+    def place(box, row, col):
+        placed.append((box, (slice(row, row + height(box)), slice(col, col + width(box)))))
+
+    for row, at_row in ((top, lambda box: 0), (bottom, lambda box: canvas_h - height(box))):
+        col = 0
+        for box in row:
+            if box[1].stop == ny:
+                col = canvas_w - width(box)
+            place(box, at_row(box), col)
+            col += width(box)
+    for column, at_col in ((left, lambda box: 0), (right, lambda box: canvas_w - width(box))):
+        row = top_h
+        for box in column:
+            place(box, row, at_col(box))
+            row += height(box)
+    row = top_h
+    for shelf in shelves:
+        col = left_w
+        for box in shelf:
+            place(box, row, col)
+            col += width(box)
+        row += height(shelf[0])
+    return (canvas_h, canvas_w), placed, rest
+
+
+class DeltaStepper:
+    """
+    Time stepper that only re-simulates the parts of the sheet where H changed.
+
+    After a full run, the heat pattern and the final field are kept. The
+    next run finds the cells where H differs and pads them by margin cells
+    (active_regions()). The padded windows are packed together on one
+    canvas (_pack_windows()), which is simulated twice, with the old and
+    the new heat pattern, and the difference of the two is added to the
+    kept field. Effects of the window edges, and of neighbours on the
+    canvas that are not neighbours on the sheet, are the same in both runs
+    and cancel; everything outside the windows keeps its previous
+    temperature. The result drifts from a full simulation by the heat that
+    crosses the padding, so callers run a full simulation now and then
+    (invalidate()).
+
+    A run costs two simulations of the canvas, so it falls back to a full
+    simulation when the canvas is half the sheet or larger.
+    """
+
+    def __init__(self, stepper, margin: int, dx: float, dy: float, dt: float,
+                 hc_paper: float, config: Config):
+        """
+        Args:
+            stepper: Stepper of the full sheet, used for full runs.
+            margin: Padding in cells around the changed cells.
+            dx, dy: Spatial resolution in meters.
+            dt: Timestep in seconds.
+            hc_paper: Heat capacity per cell in J/K.
+            config: Simulation configuration.
+        """
+        self.stepper = stepper
+        self.shape = stepper.shape
+        self.margin = margin
+        self.config = config
+        self._grid = (dx, dy, dt, hc_paper)
+        self._canvas = None
+        self._H = None
+        self._max_heat = None
+        self._H_prev = None
+        self._T = np.empty(self.shape, float_dtype(config))
+
+        # Cells simulated by the last run (twice the canvas for a delta run)
+        self.last_cells = 0
+
+    def seed(self, H: np.ndarray, T: np.ndarray):
+        """
+        Use a known heat pattern and its final field as the previous run.
+        """
+        if self._H_prev is None:
+            self._H_prev = np.empty(self.shape, self._T.dtype)
+        np.copyto(self._H_prev, H)
+        np.copyto(self._T, T)
+
+    def invalidate(self):
+        """
+        Make the next run a full simulation.
+        """
+        self._H_prev = None
+
+    def close(self):
+        """
+        Shut down the worker threads of the steppers, if any.
+        """
+        for stepper in (self.stepper, self._canvas):
+            if hasattr(stepper, 'close'):
+                stepper.close()
+        self._canvas = None
+
+    def set_heat(self, H: np.ndarray, max_heat: float):
+        """
+        Set the heat pattern of the next run.
+
+        Args:
+            H: Heat input array of the full sheet.
+            max_heat: Maximum applied heat per cell.
+        """
+        if self._max_heat is not None and max_heat != self._max_heat:
+            self._H_prev = None
+        self._H = H
+        self._max_heat = max_heat
+
+    def _canvas_stepper(self, shape):
+        """
+        Stepper for a canvas of the given shape, reused while the shape stays.
+        """
+        if self._canvas is None or self._canvas.shape != shape:
+            if hasattr(self._canvas, 'close'):
+                self._canvas.close()
+            self._canvas = make_stepper(shape, *self._grid, self.config)
+        return self._canvas
+
+    def run(self, nt: int, profiler=None) -> np.ndarray:
+        """
+        Simulate nt timesteps starting from ambient temperature.
+
+        Args:
+            nt: Number of timesteps.
+            profiler: Profiler that receives the time spent in each phase.
+
+        Returns:
+            Temperature field of the full sheet in °C. The array is owned by
+            the stepper and is overwritten by the next call to run().
+        """
+        H, max_heat = self._H, self._max_heat
+        boxes = None
+        if self._H_prev is not None:
+            boxes = active_regions(H != self._H_prev, self.margin)
+            shape, placed, rest = _pack_windows(boxes, self.shape)
+            cells = shape[0] * shape[1] + sum(_area(box) for box in rest)
+            if 2 * cells >= self._T.size:
+                boxes = None
+
+        if boxes is None:
+            self.stepper.set_heat(H, max_heat)
+            np.copyto(self._T, self.stepper.run(nt, profiler))
+            self.last_cells = self._T.size
+        else:
+            if placed:
+                canvas = self._canvas_stepper(shape)
+                H_canvas = np.zeros(shape, self._T.dtype)
+                for H_src, sign in ((self._H_prev, -1), (H, 1)):
+                    for box, place in placed:
+                        H_canvas[place] = H_src[box]
+                    canvas.set_heat(H_canvas, max_heat)
+                    T_canvas = canvas.run(nt, profiler)
+                    for box, place in placed:
+                        self._T[box] += sign * T_canvas[place]
+            for box in rest:
+                window = make_stepper((box[0].stop - box[0].start, box[1].stop - box[1].start),
+                                      *self._grid, self.config)
+                window.set_heat(self._H_prev[box], max_heat)
+                self._T[box] -= window.run(nt, profiler)
+                window.set_heat(H[box], max_heat)
+                self._T[box] += window.run(nt, profiler)
+                if hasattr(window, 'close'):
+                    window.close()
+            self.last_cells = 2 * cells
+        self.seed(H, self._T)
+        return self._T
+
+
+def _run_profiled(stepper, nt: int, profiler):
+    """
+    Run nt steps phase by phase and add the time of each phase to profiler.
+
+    Args:
+        stepper: Stepper with a phases property, already reset.
+        nt: Number of timesteps.
+        profiler: Profiler (see telemetry.Profiler).
+    """
+    clock = time.perf_counter
+    phases = stepper.phases
+    spent = dict.fromkeys((name for name, _ in phases), 0.0)
+    for _ in range(nt):
+        for name, phase in phases:
+            start = clock()
+            phase()
+            spent[name] += clock() - start
+    for name, seconds in spent.items():
+        profiler.add(name, seconds)
+
+
+def _runs(flags: np.ndarray, gap: int):
+    """
+    Find [start, stop) runs of True values, merging runs closer than gap.
+    """
+    idx = np.flatnonzero(flags)
+    if idx.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(idx) > gap)
+    starts = np.concatenate(([idx[0]], idx[breaks + 1]))
+    stops = np.concatenate((idx[breaks], [idx[-1]])) + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def active_regions(active: np.ndarray, margin: int):
+    """
+    Split the active cells of a sheet into padded rectangles.
+
+    Rectangles are found by recursively cutting the sheet along empty rows
+    and columns wider than 2 * margin, so separated parts of the design get
+    their own rectangle and padded rectangles never overlap. Parts that can
+    only be separated diagonally share one rectangle.
+
+    Args:
+        active: Boolean array of cells that receive heat.
+        margin: Padding in cells around the active cells.
+
+    Returns:
+        List of (row_slice, column_slice) rectangles.
+    """
+    nx, ny = active.shape
+    boxes = []
+    stack = [(0, nx, 0, ny)]
+    while stack:
+        r0, r1, c0, c1 = stack.pop()
+        sub = active[r0:r1, c0:c1]
+        rows = _runs(sub.any(axis=1), 2 * margin)
+        cols = _runs(sub.any(axis=0), 2 * margin)
+        if not rows:
+            continue
+        if len(rows) == 1 and len(cols) == 1:
+            (a, b), (c, d) = rows[0], cols[0]
+            boxes.append((slice(max(r0 + a - margin, 0), min(r0 + b + margin, nx)),
+                          slice(max(c0 + c - margin, 0), min(c0 + d + margin, ny))))
+        elif len(rows) > 1:
+            stack.extend((r0 + a, r0 + b, c0, c1) for a, b in rows)
+        else:
+            stack.extend((r0, r1, c0 + c, c0 + d) for c, d in cols)
+    return boxes
+
+
+def float_dtype(config: Config) -> np.dtype:
+    """
+    Floating-point type of the simulation arrays selected by config.dtype.
+    """
+    if config.dtype not in ("float32", "float64"):
+        raise ValueError(f"Unknown dtype: {config.dtype!r} (expected 'float32' or 'float64')")
+    return np.dtype(config.dtype)
+
+
+def diffusion_length(config: Config) -> float:
+    """
+    Thermal diffusion length sqrt(alpha * heating_time) in meters.
+    """
+    return math.sqrt(config.alpha * config.heating_time)
+
+
+def explicit_time_step(dx: float, dy: float, alpha: float) -> float:
+    """
+    Largest stable timestep of the explicit scheme (with a 2% margin).
+
+    Args:
+        dx, dy: Spatial resolution in meters.
+        alpha: Thermal diffusivity in m²/s.
+
+    Returns:
+        Timestep in seconds.
+    """
+    return 0.49 * dx**2 * dy**2 / ((dx**2 + dy**2) * alpha)
+
+
+def time_step(dx: float, dy: float, config: Config) -> float:
+    """
+    Timestep used by the simulation.
+
+    A user-chosen config.time_step is shortened slightly so that
+    config.heating_time is a whole number of steps.
+
+    Args:
+        dx, dy: Spatial resolution in meters.
+        config: Simulation configuration.
+
+    Returns:
+        Timestep in seconds; the explicit stability limit if
+        config.time_step is not set.
+    """
+    if config.time_step > 0:
+        return config.heating_time / math.ceil(config.heating_time / config.time_step - 1e-9)
+    return explicit_time_step(dx, dy, config.alpha)
+
+
+def num_steps(dt: float, config: Config) -> int:
+    """
+    Number of timesteps that fit into config.heating_time.
+    """
+    return int(config.heating_time / dt + 1e-9)
+
+
+def make_stepper(shape, dx: float, dy: float, dt: float,
+                 hc_paper: float, config: Config):
+    """
+    Create the time stepper selected by config.solver.
+
+    Args:
+        shape: Grid shape (rows, columns).
+        dx, dy: Spatial resolution in meters.
+        dt: Timestep in seconds.
+        hc_paper: Heat capacity per cell in J/K.
+        config: Simulation configuration.
+
+    Returns:
+        An ExplicitStepper, a BandedStepper (explicit with config.threads
+        other than 1) or an ADIStepper.
+    """
+    if config.solver == "explicit":
+        if dt > explicit_time_step(dx, dy, config.alpha) * (1 + 1e-9):
+            raise ValueError(
+                f"time_step={dt:g}s exceeds the explicit stability limit "
+                f"({explicit_time_step(dx, dy, config.alpha):g}s); use solver='adi'"
+            )
+        threads = config.threads if config.threads > 0 else os.cpu_count() or 1
+        if threads > 1:
+            return BandedStepper(shape, dx, dy, dt, hc_paper, config, threads)
+        return ExplicitStepper(shape, dx, dy, dt, hc_paper, config)
+    if config.solver == "adi":
+        return ADIStepper(shape, dx, dy, dt, hc_paper, config)
+    raise ValueError(f"Unknown solver: {config.solver!r} (expected 'explicit' or 'adi')")
@@ -0,0 +1,226 @@
+"""
+Parallel parameter sweeps over configuration overrides.
+
+The image is decoded and thresholded once in the parent process. Each
+distinct mask is placed in multiprocessing shared memory, and the worker
+processes of the pool attach to it once at startup, so a task only
+derives its initial heat pattern (cheap) and runs optimize().
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import itertools
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import fields, replace
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+from .config import Config
+from .heat_solver import image_to_heat_pattern, mask_to_heat_pattern, optimize
+from .io import save_state
+from .utils import ImageContext
+
+
+# Config fields that change the mask; overrides of any other field reuse it
+MASK_FIELDS = ('resolution', 'lower_threshold', 'upper_threshold')
+
+# Shared masks attached by a worker process: key -> (SharedMemory, array)
+_shared = {}
+
+
+def expand_grid(grid: dict):
+    """
+    Expand a grid of values into a list of overrides (Cartesian product).
+
+    Args:
+        grid: Mapping of Config field names to lists of values.
+
+    Returns:
+        List of dictionaries, one per combination.
+    """
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def load_sweep(path: Path):
+    """
+    Read the overrides of a sweep from a JSON file.
+
+    The file holds either a grid {"light_power": [80, 100], ...} (optionally
+    under a "grid" key), a list of overrides [{"alpha": 4e-7}, ...]
+    (optionally under a "runs" key), or both keys, whose runs are combined.
+
+    Args:
+        path: Path to the JSON file.
+
+    Returns:
+        List of override dictionaries.
+
+    Raises:
+        ValueError: If an override names a field that Config does not have.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+
+    if isinstance(data, list):
+        overrides = data
+    elif 'grid' in data or 'runs' in data:
+        overrides = expand_grid(data.get('grid', {})) if data.get('grid') else []
+        overrides += data.get('runs', [])
+    else:
+        overrides = expand_grid(data)
+
+    known = {f.name for f in fields(Config)}
+    for override in overrides:
+        unknown = set(override) - known
+        if unknown:
+            raise ValueError(f"Unknown config fields in sweep: {', '.join(sorted(unknown))}")
+    return overrides
+
+
+def _mask_key(config: Config):
+    """
+    Identify the mask a configuration produces.
+    """
+    return tuple(getattr(config, name) for name in MASK_FIELDS)
+
+
+def _init_sweep_worker(blocks: dict, verbose: bool):
+    """
+    Attach a worker process to the shared masks.
+
+    Args:
+        blocks: Mapping of mask keys to (shared memory name, shape).
+        verbose: Enable logging.
+    """
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING,
+                        format="%(asctime)s [%(levelname)s] %(message)s")
+    for key, (name, shape) in blocks.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[key] = (shm, np.ndarray(shape, dtype=bool, buffer=shm.buf))
+
+
+def _sweep_task(index: int, override: dict, config: Config, dims, out_path: Path = None):
+    """
+    Optimize one combination of a sweep.
+
+    Args:
+        index: Position of the combination in the sweep.
+        override: Config fields that differ from config.
+        config: Base configuration.
+        dims: Image dimensions (img_w, img_h, phys_w, phys_h).
+        out_path: Save the heat pattern of the best iteration here (see
+            save_state()).
+
+    Returns:
+        Summary record of the run.
+    """
+    start = time.perf_counter()
+    cfg = replace(config, **override)
+    img_w, img_h, phys_w, phys_h = dims
+    mask = _shared[_mask_key(cfg)][1]
+    H_init, max_heat = mask_to_heat_pattern(mask, phys_w, phys_h, cfg)
+    _, H_best, errors = optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, cfg,
+                                 best_heat=True)
+    if out_path is not None:
+        save_state(out_path, H_best, mask, max_heat)
+    return {
+        'index': index,
+        'overrides': override,
+        'status': 'ok',
+        'iterations': len(errors),
+        'outlier_pct': errors[-1] * 100 / mask.size,
+        'best_outlier_pct': min(errors) * 100 / mask.size,
+        'runtime': time.perf_counter() - start,
+        'state': str(out_path) if out_path is not None else None,
+    }
+
+
+def run_sweep(image, config: Config, overrides, jobs: int = 1, out_dir: Path = None):
+    """
+    Optimize one image for every override across a process pool.
+
+    Args:
+        image: Path to the image or an ImageContext.
+        config: Base configuration.
+        overrides: List of dictionaries of Config fields to change.
+        jobs: Number of worker processes.
+        out_dir: If given, the best heat pattern of each combination is
+            saved as <stem>_sweep_<index>.npz (usable with --warm-start).
+
+    Returns:
+        List of summary records ranked by final outlier %, then runtime.
+        Failed combinations come last with status 'error'.
+    """
+    image = ImageContext.of(image)
+    dims = image.dims
+    configs = [replace(config, **override) for override in overrides]
+
+    # Threshold the image once per distinct mask and share it with the workers
+    blocks = {}
+    handles = []
+    try:
+        for cfg in configs:
+            key = _mask_key(cfg)
+            if key in blocks:
+                continue
+            mask = image_to_heat_pattern(image, cfg)[0]
+            shm = shared_memory.SharedMemory(create=True, size=max(mask.nbytes, 1))
+            handles.append(shm)
+            np.ndarray(mask.shape, dtype=bool, buffer=shm.buf)[:] = mask
+            blocks[key] = (shm.name, mask.shape)
+        logging.info("Sweep: %d combinations, %d distinct masks, %d workers",
+                     len(overrides), len(blocks), jobs)
+
+        def state_path(index):
+            return Path(out_dir) / f"{image.name}_sweep_{index}.npz" if out_dir else None
+
+        results = []
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max(jobs, 1), mp_context=ctx,
+                                 initializer=_init_sweep_worker,
+                                 initargs=(blocks, config.verbose)) as pool:
+            futures = {
+                pool.submit(_sweep_task, i, override, config, dims, state_path(i)): i
+                for i, override in enumerate(overrides)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error("Sweep combination %d %s failed: %s", i, overrides[i], e)
+                    result = {'index': i, 'overrides': overrides[i], 'status': 'error',
+                              'error': f"{type(e).__name__}: {e}"}
+                results.append(result)
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    ok = sorted((r for r in results if r['status'] == 'ok'),
+                key=lambda r: (r['outlier_pct'], r['runtime']))
+    failed = sorted((r for r in results if r['status'] != 'ok'), key=lambda r: r['index'])
+    return ok + failed
+
+
+def format_sweep(results) -> str:
+    """
+    Format ranked sweep results as a table.
+    """
+    lines = [f"{'rank':>4}  {'outlier %':>9}  {'best %':>7}  {'iters':>5}  {'runtime':>8}  overrides"]
+    for rank, r in enumerate(results, start=1):
+        overrides = ', '.join(f"{k}={v}" for k, v in r['overrides'].items())
+        if r['status'] != 'ok':
+            lines.append(f"{'-':>4}  {'error':>9}  {'':>7}  {'':>5}  {'':>8}  {overrides}: {r['error']}")
+            continue
+        lines.append(f"{rank:>4}  {r['outlier_pct']:>9.2f}  {r['best_outlier_pct']:>7.2f}  "
+                     f"{r['iterations']:>5d}  {r['runtime']:>7.1f}s  {overrides}")
+    return '\n'.join(lines)
@@ -0,0 +1,158 @@
+"""
+Stage timings and per-iteration telemetry of optimization runs.
+
+Author: Sosuke Ichihashi
+Date: 2025-07-29
+"""
+
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB, or None if unavailable.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class Profiler:
+    """
+    Collects monotonic stage timings and per-iteration records of a run.
+
+    Stages are timed with stage() or added with add(). optimize() calls
+    record() after each iteration, which emits one record with the timings
+    of the stages since the previous record; close() emits a summary with
+    the totals of the whole run. Records go to a JSON Lines file, a
+    callback, or both.
+
+    Code that takes a profiler treats None as disabled, so a run without
+    one does no timing at all.
+    """
+
+    def __init__(self, path: Path = None, callback=None):
+        """
+        Args:
+            path: JSON Lines file the records are appended to.
+            callback: Called with each record (a dictionary).
+        """
+        self.path = Path(path) if path is not None else None
+        self.callback = callback
+        self.totals = defaultdict(float)
+        self._pending = defaultdict(float)
+        self._start = time.perf_counter()
+        self._file = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Time the body of a with-statement as the given stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        """
+        Add time spent in a stage.
+
+        Args:
+            name: Stage name.
+            seconds: Elapsed wall-clock time.
+        """
+        self.totals[name] += seconds
+        self._pending[name] += seconds
+
+    def record(self, iteration: int, outlier_pct: float, steps: int, **extra):
+        """
+        Emit the record of one optimizer iteration.
+
+        Args:
+            iteration: Iteration number (1-based).
+            outlier_pct: Outlier percentage of the iteration.
+            steps: Number of simulation timesteps of the iteration.
+            **extra: Further JSON-serializable fields.
+        """
+        record = {
+            'event': 'iteration',
+            'iteration': iteration,
+            'outlier_pct': outlier_pct,
+            'steps': steps,
+            'stages': dict(self._pending),
+            'elapsed': time.perf_counter() - self._start,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        record.update(extra)
+        self._pending.clear()
+        self.emit(record)
+
+    def emit(self, record: dict):
+        """
+        Send a record to the file and the callback.
+        """
+        if self.path is not None:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        if self.callback is not None:
+            self.callback(record)
+
+    def close(self):
+        """
+        Emit the summary record and close the file.
+        """
+        self.emit({
+            'event': 'summary',
+            'stages': dict(self.totals),
+            'elapsed': time.perf_counter() - self._start,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def stage(profiler: Profiler, name: str):
+    """
+    Profiler.stage(name), or a no-op context if profiler is None.
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.stage(name)
+
+
+def format_stages(totals: dict) -> str:
+    """
+    Format stage totals as a table, slowest stage first.
+
+    Args:
+        totals: Mapping of stage names to seconds.
+
+    Returns:
+        Multi-line string with the time and share of each stage.
+    """
+    total = sum(totals.values())
+    width = max([len('stage')] + [len(name) for name in totals])
+    lines = [f"{'stage':<{width}}  {'seconds':>10}  {'share':>6}"]
+    for name, seconds in sorted(totals.items(), key=lambda kv: -kv[1]):
+        share = seconds * 100 / total if total else 0.0
+        lines.append(f"{name:<{width}}  {seconds:>10.3f}  {share:>5.1f}%")
+    lines.append(f"{'total':<{width}}  {total:>10.3f}")
+    return '\n'.join(lines)
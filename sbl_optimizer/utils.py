@@ -24,16 +24,105 @@ Author: Sosuke Ichihashi
 Date: 2025-07-29
 """
 
+import io
+import math
+from pathlib import Path
 from PIL import Image
 from typing import Tuple
 import numpy as np
 
+
+class ImageContext:
+    """
+    Input image decoded once, with the values derived from it cached.
+
+    The optimizer, the result cache and the output writers all accept an
+    ImageContext in place of an image path, so a run decodes the image a
+    single time. Images held in memory (a NumPy array or encoded bytes) can
+    be used directly, without going through a file.
+    """
+
+    def __init__(self, source, dpi=None, name: str = None):
+        """
+        Args:
+            source: Image path, encoded image bytes, a uint8 pixel array
+                (rows x columns, optionally x channels) or a PIL Image.
+            dpi: Resolution as a number or an (x, y) tuple; overrides the DPI
+                stored in the image (default: stored DPI, else 72).
+            name: Base name of output files (default: file stem, else "image").
+        """
+        path = None
+        if isinstance(source, Image.Image):
+            img = source
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            img = Image.open(io.BytesIO(source))
+        elif isinstance(source, np.ndarray):
+            img = Image.fromarray(source)
+        else:
+            path = Path(source)
+            img = Image.open(path)
+        img.load()
+
+        if dpi is not None:
+            img.info['dpi'] = dpi if isinstance(dpi, tuple) else (dpi, dpi)
+
+        self.image = img
+        self.path = path
+        self.name = name or (path.stem if path else "image")
+        self._gray = {}
+
+    @classmethod
+    def of(cls, source):
+        """
+        Return source unchanged if it already is an ImageContext, else wrap it.
+        """
+        return source if isinstance(source, cls) else cls(source)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Image size in pixels (width, height)."""
+        return self.image.size
+
+    @property
+    def dpi(self):
+        """Image resolution (x, y); 72 DPI if the image does not store one."""
+        return self.image.info.get('dpi', (72, 72))
+
+    @property
+    def dims(self):
+        """Same as compute_dims(): pixel width and height, physical width and height."""
+        return compute_dims(self.image)
+
+    def gray(self, resolution: int):
+        """
+        Grayscale pixels resampled to about the given number of cells.
+
+        Args:
+            resolution: Target number of pixels of the resized image.
+
+        Returns:
+            A uint8 NumPy array, cached per resolution.
+        """
+        if resolution not in self._gray:
+            rows, cols = self.grid_shape(resolution)
+            img_rs = self.image.resize((cols, rows), resample=Image.Resampling.LANCZOS)
+            self._gray[resolution] = np.array(img_rs.convert('L'))
+        return self._gray[resolution]
+
+    def grid_shape(self, resolution: int) -> Tuple[int, int]:
+        """
+        Shape (rows, columns) of gray(resolution), without resampling the image.
+        """
+        scale = math.sqrt(resolution / (self.image.width * self.image.height))
+        return int(self.image.height * scale), int(self.image.width * scale)
+
+
 def compute_dims(img: Image.Image) -> Tuple[float, float]:
     """
     Compute the physical dimensions of an image based on its DPI.
 
     Args:
-        img: A PIL Image object.
+        img: A PIL Image object or an ImageContext.
 
     Returns:
         A tuple containing:
@@ -42,6 +131,8 @@ def compute_dims(img: Image.Image) -> Tuple[float, float]:
             - Image width in meters
             - Image height in meters
     """
+    if isinstance(img, ImageContext):
+        img = img.image
     dpi_x, dpi_y = img.info.get('dpi', (72, 72))  # Default to 72 DPI if not provided
     phys_w = img.width * 0.0254 / dpi_x           # Convert width from pixels to meters
     phys_h = img.height * 0.0254 / dpi_y          # Convert height from pixels to meters
@@ -60,3 +151,120 @@ def scale_to_255(H, max_heat: float):
     """
     scaled = H * 255 / max_heat                   # Normalize to 0–255 range
     return np.clip(scaled, 0, 255).astype(np.uint8)  # Clip values and convert to uint8
+
+def resize_field(arr, shape, resample=Image.Resampling.BILINEAR):
+    """
+    Resample a 2D field to a new grid shape.
+
+    Args:
+        arr: 2D NumPy array (e.g. a heat pattern or a mask).
+        shape: Target shape (rows, columns).
+        resample: PIL resampling filter.
+
+    Returns:
+        A float NumPy array of the given shape.
+    """
+    img = Image.fromarray(np.asarray(arr, dtype=np.float32))
+    img = img.resize((shape[1], shape[0]), resample=resample)
+    return np.asarray(img, dtype=float)
+
+def dilate(mask, radius: int):
+    """
+    Grow a boolean mask by a disk of the given radius.
+
+    Args:
+        mask: 2D boolean array.
+        radius: Disk radius in cells.
+
+    Returns:
+        A boolean array marking cells within radius of any True cell.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    out = mask.copy()
+    nx, ny = mask.shape
+    for di in range(-radius, radius + 1):
+        for dj in range(-radius, radius + 1):
+            if (di == 0 and dj == 0) or di * di + dj * dj > radius * radius:
+                continue
+            if abs(di) >= nx or abs(dj) >= ny:
+                continue
+            out[max(di, 0):nx + min(di, 0), max(dj, 0):ny + min(dj, 0)] |= (
+                mask[max(-di, 0):nx - max(di, 0), max(-dj, 0):ny - max(dj, 0)]
+            )
+    return out
+
+# Fixed-point precision of Pillow's 8-bit resampling (see Pillow's Resample.c)
+RESAMPLE_PRECISION_BITS = 32 - 8 - 2
+
+def _bilinear_coeffs(in_size: int, out_size: int):
+    """
+    Bilinear resampling taps along one axis, computed exactly as Pillow does.
+
+    Args:
+        in_size: Input length.
+        out_size: Output length.
+
+    Returns:
+        Tuple of (input indices, fixed-point weights), both of shape
+        (out_size, taps).
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = filterscale  # The bilinear filter has support 1
+    ksize = int(math.ceil(support)) * 2 + 1
+
+    center = (np.arange(out_size) + 0.5) * scale
+    xmin = np.maximum((center - support + 0.5).astype(np.int64), 0)
+    xmax = np.minimum((center + support + 0.5).astype(np.int64), in_size) - xmin
+    x = np.arange(ksize)
+    w = 1.0 - np.abs((x + xmin[:, None] - center[:, None] + 0.5) * (1.0 / filterscale))
+    w = np.where(x < xmax[:, None], np.maximum(w, 0.0), 0.0)
+    ww = w.sum(axis=1, keepdims=True)
+    w = np.divide(w, ww, out=w, where=ww != 0)
+
+    one = 1 << RESAMPLE_PRECISION_BITS
+    kk = np.where(w < 0, np.trunc(-0.5 + w * one), np.trunc(0.5 + w * one)).astype(np.int32)
+    idx = np.minimum(xmin[:, None] + x, in_size - 1)
+    return idx, kk
+
+def _resample_axis(src, idx, kk, axis: int):
+    """
+    Apply taps from _bilinear_coeffs() to a uint8 array along rows (0) or columns (1).
+    """
+    shape = (idx.shape[0], src.shape[1]) if axis == 0 else (src.shape[0], idx.shape[0])
+    acc = np.full(shape, 1 << (RESAMPLE_PRECISION_BITS - 1), dtype=np.int32)
+    for k in range(idx.shape[1]):
+        if axis == 0:
+            acc += src[idx[:, k], :] * kk[:, k, None]
+        else:
+            acc += src[:, idx[:, k]] * kk[None, :, k]
+    return np.clip(acc >> RESAMPLE_PRECISION_BITS, 0, 255).astype(np.uint8)
+
+def resize_strips(arr, size, rows: int):
+    """
+    Bilinearly resize a uint8 image in horizontal strips.
+
+    Concatenating the strips gives exactly the pixels of
+    Image.fromarray(arr).resize(size, Image.Resampling.BILINEAR), while only
+    one strip of the output is held in memory at a time.
+
+    Args:
+        arr: 2D uint8 NumPy array.
+        size: Output size (width, height).
+        rows: Number of output rows per strip.
+
+    Yields:
+        uint8 arrays of shape (rows, width); the last strip may be shorter.
+    """
+    arr = np.asarray(arr, dtype=np.uint8)
+    width, height = size
+    h_idx, h_kk = _bilinear_coeffs(arr.shape[1], width)
+    v_idx, v_kk = _bilinear_coeffs(arr.shape[0], height)
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        taps = v_idx[y0:y1]
+        lo, hi = taps.min(), taps.max() + 1
+
+        # Horizontal pass over the input rows this strip needs, then vertical
+        band = _resample_axis(arr[lo:hi], h_idx, h_kk, axis=1)
+        yield _resample_axis(band, taps - lo, v_kk[y0:y1], axis=0)
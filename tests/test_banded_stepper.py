@@ -0,0 +1,58 @@
+"""
+BandedStepper must match ExplicitStepper bitwise for any number of threads.
+"""
+
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from sbl_optimizer.config import Config
+from sbl_optimizer.heat_solver import mask_to_heat_pattern
+from sbl_optimizer.stepping import BandedStepper, ExplicitStepper, make_stepper, time_step
+
+
+SHAPE = (70, 48)
+PHYS_W, PHYS_H = 0.08, 0.06
+STEPS = 40
+
+
+def _setup(dtype: str):
+    config = replace(Config(), dtype=dtype)
+    dx = PHYS_W / (SHAPE[0] - 1)
+    dy = PHYS_H / (SHAPE[1] - 1)
+    dt = time_step(dx, dy, config)
+    hc_paper = config.c_paper * config.density_paper * PHYS_W * PHYS_H / (SHAPE[0] * SHAPE[1])
+    rng = np.random.default_rng(0)
+    H, max_heat = mask_to_heat_pattern(rng.random(SHAPE) < 0.4, PHYS_W, PHYS_H, config)
+    H = H * rng.uniform(0.0, 2.0, SHAPE)
+    return config, (dx, dy, dt, hc_paper), H, max_heat
+
+
+def _run(stepper, H, max_heat):
+    try:
+        stepper.set_heat(H, max_heat)
+        return stepper.run(STEPS).copy()
+    finally:
+        if hasattr(stepper, 'close'):
+            stepper.close()
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+@pytest.mark.parametrize("threads", [1, 3, 0])
+def test_make_stepper_matches_explicit(dtype, threads):
+    config, grid, H, max_heat = _setup(dtype)
+    expected = _run(ExplicitStepper(SHAPE, *grid, config), H, max_heat)
+    actual = _run(make_stepper(SHAPE, *grid, replace(config, threads=threads)), H, max_heat)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+def test_bands_match_explicit(dtype):
+    # Three uneven bands even where make_stepper() would pick one thread
+    config, grid, H, max_heat = _setup(dtype)
+    stepper = BandedStepper(SHAPE, *grid, config, threads=3)
+    assert len(stepper.bands) == 3
+    expected = _run(ExplicitStepper(SHAPE, *grid, config), H, max_heat)
+    np.testing.assert_array_equal(_run(stepper, H, max_heat), expected)
@@ -0,0 +1,75 @@
+"""
+Incremental re-simulation (DeltaStepper) against full simulations.
+"""
+
+import math
+from dataclasses import replace
+
+import numpy as np
+
+from sbl_optimizer.config import Config
+from sbl_optimizer.heat_solver import mask_to_heat_pattern, optimize_iter, simulate
+from sbl_optimizer.stepping import DeltaStepper, diffusion_length, make_stepper, num_steps, time_step
+
+
+SHAPE = (120, 120)
+PHYS_W = PHYS_H = 0.16
+
+# Largest deviation from a full simulation after a few local edits, in °C
+# (the nonlinear losses near the window edges; the band is 10 °C wide)
+TOLERANCE = 0.1
+
+
+def _design():
+    yy, xx = np.mgrid[:SHAPE[0], :SHAPE[1]]
+    return (yy - 60)**2 + (xx - 60)**2 < 35**2
+
+
+def _delta_stepper(config):
+    dx = PHYS_W / (SHAPE[0] - 1)
+    dy = PHYS_H / (SHAPE[1] - 1)
+    dt = time_step(dx, dy, config)
+    hc_paper = config.c_paper * config.density_paper * PHYS_W * PHYS_H / (SHAPE[0] * SHAPE[1])
+    margin = math.ceil(config.active_margin * diffusion_length(config) / min(dx, dy))
+    stepper = make_stepper(SHAPE, dx, dy, dt, hc_paper, config)
+    return DeltaStepper(stepper, margin, dx, dy, dt, hc_paper, config), num_steps(dt, config)
+
+
+def test_local_edits_stay_close_to_full_simulation():
+    config = Config()
+    H, max_heat = mask_to_heat_pattern(_design(), PHYS_W, PHYS_H, config)
+    stepper, nt = _delta_stepper(config)
+    stepper.set_heat(H, max_heat)
+    stepper.run(nt)
+    assert stepper.last_cells == H.size
+
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        H = H.copy()
+        r, c = rng.integers(30, 80, 2)
+        H[r:r + 10, c:c + 10] = rng.uniform(0.0, max_heat, (10, 10))
+        stepper.set_heat(H, max_heat)
+        T = stepper.run(nt)
+        assert stepper.last_cells < H.size
+        full = simulate(H, max_heat, PHYS_W, PHYS_H, config)
+        assert np.max(np.abs(T - full)) <= TOLERANCE
+
+    # A verification run discards the drift of the edits
+    stepper.invalidate()
+    stepper.set_heat(H, max_heat)
+    T = stepper.run(nt)
+    assert stepper.last_cells == H.size
+    np.testing.assert_array_equal(T, simulate(H, max_heat, PHYS_W, PHYS_H, config))
+
+
+def test_verify_every_runs_full_simulations():
+    config = replace(Config(), incremental=True, verify_every=3, max_iterations=12, verbose=0)
+    mask = _design()
+    H_init, max_heat = mask_to_heat_pattern(mask, PHYS_W, PHYS_H, config)
+    for state in optimize_iter(mask, H_init, max_heat, PHYS_W, PHYS_H, config,
+                               stop_on_convergence=False):
+        full = simulate(state.H, max_heat, PHYS_W, PHYS_H, config)
+        if state.iteration % config.verify_every == 0:
+            np.testing.assert_array_equal(state.T, full)
+        else:
+            assert np.max(np.abs(state.T - full)) <= TOLERANCE
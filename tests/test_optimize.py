@@ -0,0 +1,58 @@
+"""
+optimize() against optimize_iter() driven by hand.
+"""
+
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from sbl_optimizer.config import Config
+from sbl_optimizer.heat_solver import mask_to_heat_pattern, optimize, optimize_iter, simulate
+
+
+SHAPE = (48, 64)
+PHYS_W, PHYS_H = 0.12, 0.16
+
+
+def _design():
+    yy, xx = np.mgrid[:SHAPE[0], :SHAPE[1]]
+    mask = ((yy - 24)**2 + (xx - 20)**2 < 12**2) | ((abs(yy - 24) < 3) & (xx > 30) & (xx < 58))
+    return mask
+
+
+@pytest.mark.parametrize("options", [{}, {'surrogate_every': 3}], ids=["exact", "surrogate"])
+def test_optimize_matches_generator(options):
+    config = replace(Config(), max_iterations=60, verbose=0, **options)
+    mask = _design()
+    H_init, max_heat = mask_to_heat_pattern(mask, PHYS_W, PHYS_H, config)
+    T_best, H, errors = optimize(mask, H_init, max_heat, SHAPE[1], SHAPE[0], PHYS_W, PHYS_H,
+                                 config)
+
+    # The loop optimize() wraps: keep the first field with the fewest outsiders
+    best_err, T_ref = None, None
+    for state in optimize_iter(mask, H_init, max_heat, PHYS_W, PHYS_H, config):
+        if best_err is None or state.outsiders < best_err:
+            best_err, T_ref = state.outsiders, state.T.copy()
+        H_ref, errors_ref = state.H.copy(), list(state.errors)
+
+    assert len(set(errors_ref)) > 1
+    assert errors == errors_ref
+    np.testing.assert_array_equal(T_best, T_ref)
+    np.testing.assert_array_equal(H, H_ref)
+
+
+def test_first_iteration_can_be_best():
+    # Warm-started from its own best pattern, no later iteration does better
+    config = replace(Config(), max_iterations=60, verbose=0)
+    mask = _design()
+    H_init, max_heat = mask_to_heat_pattern(mask, PHYS_W, PHYS_H, config)
+    _, H_best, _ = optimize(mask, H_init, max_heat, SHAPE[1], SHAPE[0], PHYS_W, PHYS_H, config,
+                            best_heat=True)
+
+    config = replace(config, max_iterations=20)
+    T_best, _, errors = optimize(mask, H_best, max_heat, SHAPE[1], SHAPE[0], PHYS_W, PHYS_H,
+                                 config)
+    assert errors[0] == min(errors)
+    # Not the field at ambient temperature, which was returned before
+    np.testing.assert_array_equal(T_best, simulate(H_best, max_heat, PHYS_W, PHYS_H, config))
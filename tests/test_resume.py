@@ -0,0 +1,91 @@
+"""
+A run interrupted at a checkpoint and resumed must end exactly as an
+uninterrupted one.
+"""
+
+from dataclasses import replace
+from importlib import resources
+
+import numpy as np
+import pytest
+
+from sbl_optimizer.checkpoint import Checkpointer, OptimizationInterrupted, load_checkpoint
+from sbl_optimizer.config import Config
+from sbl_optimizer.heat_solver import image_to_heat_pattern, optimize, optimize_multigrid
+from sbl_optimizer.utils import ImageContext
+
+
+ITERATIONS = 40
+STOP_AT = 11
+
+
+class _StopAfterSave(Checkpointer):
+    """
+    Checkpointer that asks for a stop after its first save at the given
+    multigrid level (None: full resolution), as a signal would.
+    """
+
+    def __init__(self, path, every_iterations: int, level: int = None):
+        super().__init__(path, every_iterations)
+        self.level = level
+
+    def save(self, *args, level: int = None, **kwargs):
+        super().save(*args, level=level, **kwargs)
+        if level == self.level:
+            self.stop_requested = True
+
+
+@pytest.fixture(scope="module")
+def image():
+    with resources.as_file(resources.files("sbl_optimizer.assets") / "sample.jpg") as path:
+        yield ImageContext(path)
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {'incremental': True, 'verify_every': 4},
+    {'surrogate_every': 3},
+    {'optimizer': 'adjoint'},
+], ids=["heuristic", "incremental", "surrogate", "adjoint"])
+def test_resume_matches_uninterrupted_run(image, tmp_path, options):
+    config = replace(Config(), resolution=5000, max_iterations=ITERATIONS, verbose=0, **options)
+    img_w, img_h, phys_w, phys_h = image.dims
+    mask, H_init, max_heat = image_to_heat_pattern(image, config)
+
+    def run(**kwargs):
+        return optimize(mask, H_init, max_heat, img_w, img_h, phys_w, phys_h, config, **kwargs)
+
+    T_best, H, errors = run()
+    assert len(errors) > STOP_AT
+
+    path = tmp_path / "checkpoint.npz"
+    with pytest.raises(OptimizationInterrupted) as interrupted:
+        run(checkpoint=_StopAfterSave(path, every_iterations=STOP_AT))
+    assert interrupted.value.iteration == STOP_AT
+
+    resumed = load_checkpoint(path, config, shape=mask.shape)
+    T_best_resumed, H_resumed, errors_resumed = run(resume=resumed)
+    assert errors_resumed == errors
+    np.testing.assert_array_equal(H_resumed, H)
+    np.testing.assert_array_equal(T_best_resumed, T_best)
+
+
+
+@pytest.mark.parametrize("level", [0, None], ids=["coarse", "final"])
+def test_multigrid_resume_matches_uninterrupted_run(image, tmp_path, level):
+    config = replace(Config(), resolution=5000, max_iterations=ITERATIONS, verbose=0,
+                     multigrid_levels=(2000,), multigrid_iterations=(ITERATIONS,))
+    mask, T_best, H, errors, _ = optimize_multigrid(image, config)
+
+    path = tmp_path / "checkpoint.npz"
+    with pytest.raises(OptimizationInterrupted):
+        optimize_multigrid(image, config,
+                           checkpoint=_StopAfterSave(path, every_iterations=STOP_AT, level=level))
+
+    resumed = load_checkpoint(path, config, shape=mask.shape)
+    assert resumed['level'] == level
+    _, T_best_resumed, H_resumed, errors_resumed, _ = optimize_multigrid(image, config,
+                                                                         resume=resumed)
+    assert errors_resumed == errors
+    np.testing.assert_array_equal(H_resumed, H)
+    np.testing.assert_array_equal(T_best_resumed, T_best)
@@ -0,0 +1,50 @@
+"""
+Strip-wise resizing and tiled pattern pages against the untiled pattern.
+"""
+
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from sbl_optimizer.io import save_pattern
+from sbl_optimizer.utils import ImageContext, resize_strips
+
+
+def _pattern(shape, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("shape, size, rows", [
+    ((45, 60), (200, 150), 7),     # upscale by 3.33, strips cut between source rows
+    ((45, 60), (200, 150), 150),   # a single strip
+    ((30, 40), (123, 97), 16),     # different factors along the two axes
+    ((90, 120), (50, 41), 5),      # downscale
+])
+def test_resize_strips_matches_pillow(shape, size, rows):
+    arr = _pattern(shape)
+    expected = np.asarray(Image.fromarray(arr).resize(size, Image.Resampling.BILINEAR))
+    strips = list(resize_strips(arr, size, rows))
+    assert all(len(strip) == rows for strip in strips[:-1])
+    np.testing.assert_array_equal(np.vstack(strips), expected)
+
+
+def _pages(data: bytes):
+    with Image.open(data) as img:
+        return [np.asarray(page.convert('L')) for page in ImageSequence.Iterator(img)]
+
+
+@pytest.mark.parametrize("tile_rows", [37, 64])
+def test_tiled_pages_stack_to_single_page(tile_rows):
+    # 150 rows from 45 cells: page boundaries fall between the source rows
+    image = ImageContext(np.zeros((150, 200), np.uint8), dpi=300, name="design")
+    H = _pattern((45, 60), seed=1) / 255.0
+    single, tiled = {}, {}
+    name = save_pattern(image, H, 1.0, file_format='tiff', buffers=single)
+    save_pattern(image, H, 1.0, file_format='tiff', tile_rows=tile_rows, buffers=tiled)
+
+    single[name].seek(0)
+    tiled[name].seek(0)
+    (expected,) = _pages(single[name])
+    pages = _pages(tiled[name])
+    assert len(pages) == -(-150 // (-(-tile_rows // 8) * 8))
+    np.testing.assert_array_equal(np.vstack(pages), expected)
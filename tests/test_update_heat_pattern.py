@@ -0,0 +1,44 @@
+"""
+Regression test of update_heat_pattern against the reference loop.
+"""
+
+import numpy as np
+import pytest
+
+from sbl_optimizer.heat_solver import update_heat_pattern, update_heat_pattern_reference
+
+
+SWELL = 145.0
+BUFFER = 10.0
+MAX_HEAT = 1.0
+
+
+def _inputs(seed: int, shape=(24, 32), H_low=0.0, H_high=MAX_HEAT):
+    rng = np.random.default_rng(seed)
+    T = rng.uniform(20.0, SWELL + 3 * BUFFER, shape)
+    H = rng.uniform(H_low, H_high, shape)
+    mask = rng.random(shape) < 0.5
+    return T, H, mask
+
+
+def _both(T, H, mask):
+    H_fast, H_ref = H.copy(), H.copy()
+    update_heat_pattern(T, H_fast, mask, SWELL, BUFFER, MAX_HEAT)
+    update_heat_pattern_reference(T, H_ref, mask, SWELL, BUFFER, MAX_HEAT)
+    return H_fast, H_ref
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference_within_one_step(seed):
+    # Random H near both bounds clamps often; the documented bound is one step
+    H_fast, H_ref = _both(*_inputs(seed))
+    assert np.max(np.abs(H_fast - H_ref)) <= MAX_HEAT / 256
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_reference_without_clamping(seed):
+    # H far from 0 and max_heat, so no update reaches either bound
+    T, H, mask = _inputs(seed, H_low=0.4 * MAX_HEAT, H_high=0.6 * MAX_HEAT)
+    H_fast, H_ref = _both(T, H, mask)
+    assert H_ref.min() > 0 and H_ref.max() < MAX_HEAT
+    np.testing.assert_allclose(H_fast, H_ref, rtol=0, atol=1e-12 * MAX_HEAT)